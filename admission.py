@@ -0,0 +1,261 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+
+from flask import request, session, g, jsonify
+
+
+# 每一類路由各自的排隊設定（每類預留 max_active + max_queue 條執行緒）：
+#   max_active = 同時處理幾個請求
+#   max_queue  = 最多幾個在排隊，超過就直接回 503（不在執行緒裡乾等）
+#   max_wait   = 排隊最多等幾秒，等不到也回 503；也是 503 回應的 Retry-After
+#   rate / burst = 每個帳號的 token bucket（每秒補幾個 token / 最多存幾個）；
+#                  瀏覽不限流（每個頁面都要寫一次跨 worker 的 SQLite 鎖，不划算）
+ROUTE_CLASSES = {
+    "login":    {"max_active": 2, "max_queue": 3, "max_wait": 5.0, "rate": 0.2, "burst": 5},
+    "grading":  {"max_active": 2, "max_queue": 2, "max_wait": 8.0, "rate": 0.1, "burst": 3},
+    "browsing": {"max_active": 3, "max_queue": 2, "max_wait": 3.0},
+}
+
+SPARE_THREADS = 1   # 留給不排隊的 endpoint（靜態檔、公式圖檔、監控頁）
+
+# 老師即時看板（SSE）：一條連線在整個串流期間都佔著一條執行緒，所以每個 worker 另外預留固定幾條，
+# 超過的觀看者會收到「連線已滿」事件、過一陣子自己重連（成本見 tools/bench_sse.py --http）
+STREAM_THREADS = int(os.environ.get("QUIZ_MAX_STREAMS", "2"))
+
+
+def reserved_threads(classes=ROUTE_CLASSES):
+    """排隊的請求是在 before_request 裡等，等的時候一樣佔著一條執行緒：每類要預留 處理中 + 排隊中 條。"""
+    return sum(cfg["max_active"] + cfg["max_queue"] for cfg in classes.values())
+
+
+# 每個 worker 的執行緒數（gunicorn.conf.py 也讀這個）：各類預留的加上備用、看板連線，
+# 交卷塞車時才不會佔滿所有執行緒，讓登入請求連被分派的機會都沒有
+WORKER_THREADS = int(os.environ.get("WEB_THREADS", reserved_threads() + SPARE_THREADS + STREAM_THREADS))
+
+# endpoint 名稱 -> 路由類別（沒列到的都算 browsing）
+# 作答暫存（PATCH answers）只 append 暫存檔、每 3 秒送一次，留在 browsing；
+# 交卷 API 才是批改，跟表單交卷一起排 grading 的隊
+ENDPOINT_CLASSES = {
+    "login": "login",
+    "submit": "grading",
+    "api_quiz_finalize": "grading",
+}
+
+# 不經過排隊的 endpoint（靜態檔、公式圖檔、監控頁本身、老師即時看板的長連線、
+# 取樣分析：就是塞車的時候才要用，不能跟著排隊）
+EXEMPT_ENDPOINTS = {
+    "static", "admission_stats", "formula_svg", "teacher_stream",
+    "teacher_profile", "teacher_profile_start", "teacher_profile_download",
+}
+
+# 沒登入、也沒帶帳號的請求只能用 IP 當限流的 key；一整班常在同一個學校 NAT 後面，
+# 所以 IP 的 bucket 放大成一個班的量
+SHARED_IP_FACTOR = 40
+
+# 各 worker 共用的 token bucket 狀態檔
+STATE_FILE = os.environ.get(
+    "ADMISSION_STATE_FILE",
+    os.path.join(tempfile.gettempdir(), "physics_quiz_admission.sqlite3"),
+)
+
+
+class RouteQueue:
+    """單一路由類別的排隊閘門（每個 worker 一份）。"""
+
+    def __init__(self, name, max_active, max_queue, max_wait, **_):
+        self.name = name
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.waits = deque(maxlen=500)   # 最近的排隊時間（秒）
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """排到就回傳等待秒數；排不到回傳 None。"""
+        start = time.monotonic()
+        with self._cond:
+            if self.active < self.max_active and self.waiting == 0:
+                self.active += 1
+                self.waits.append(0.0)
+                return 0.0
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                return None
+            self.waiting += 1
+            try:
+                deadline = start + self.max_wait
+                while self.active >= self.max_active:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return None
+                    self._cond.wait(remaining)
+                self.active += 1
+            finally:
+                self.waiting -= 1
+        waited = time.monotonic() - start
+        self.waits.append(waited)
+        return waited
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def stats(self):
+        waits = sorted(self.waits)
+        if waits:
+            avg_ms = round(sum(waits) / len(waits) * 1000, 1)
+            p95_ms = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1)
+        else:
+            avg_ms = p95_ms = None
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_active": self.max_active,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "avg_wait_ms": avg_ms,
+            "p95_wait_ms": p95_ms,
+        }
+
+
+class TokenBuckets:
+    """每個帳號的 token bucket，存在 SQLite 檔讓所有 gunicorn worker 共用。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=2, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, rate, burst):
+        """扣一個 token；成功回傳 0，不夠時回傳還要等幾秒。"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                tokens = float(burst)
+            else:
+                tokens = min(float(burst), row[0] + (now - row[1]) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0
+            else:
+                retry_after = (1 - tokens) / rate
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return retry_after
+
+
+class AdmissionControl:
+    """在 Flask before/teardown_request 掛上排隊與限流。"""
+
+    def __init__(self, app=None, classes=ROUTE_CLASSES, state_file=STATE_FILE, threads=WORKER_THREADS):
+        self.classes = classes
+        self.queues = {name: RouteQueue(name, **cfg) for name, cfg in classes.items()}
+        reserved = reserved_threads(classes)
+        if reserved + SPARE_THREADS + STREAM_THREADS > threads:
+            print(f"⚠️ 排隊設定共佔 {reserved} 條執行緒，加上備用 {SPARE_THREADS} 條、看板連線 {STREAM_THREADS} 條，"
+                  f"超過每個 worker 的 {threads} 條：排隊的請求會把執行緒佔滿")
+        self.buckets = TokenBuckets(state_file)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before)
+        app.teardown_request(self._teardown)
+        app.add_url_rule("/admin/admission", "admission_stats", self._stats_view)
+
+    @staticmethod
+    def classify(endpoint):
+        return ENDPOINT_CLASSES.get(endpoint, "browsing")
+
+    @staticmethod
+    def _busy(status, retry_after, msg):
+        resp = jsonify({"error": msg, "retry_after": int(retry_after) + 1})
+        resp.status_code = status
+        resp.headers["Retry-After"] = str(int(retry_after) + 1)
+        return resp
+
+    def _before(self):
+        if request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        cls = self.classify(request.endpoint)
+        cfg = self.classes[cls]
+
+        # 1. 每個帳號的速率限制（登入前用表單帳號；只有設了 rate 的類別：登入、交卷）
+        #    沒登入的 GET（打開登入頁、首頁轉址）不限流，只排隊；
+        #    沒帳號的 POST 才用 IP，而且 bucket 放大成一個班的量（同一個 NAT 後面的同學共用）
+        account = session.get("user_account")
+        if not account and request.method == "POST":
+            account = request.form.get("account", "").strip()
+        if cfg.get("rate") is None:
+            key = None
+        elif account:
+            key, rate, burst = f"{cls}:{account}", cfg["rate"], cfg["burst"]
+        elif request.method == "POST":
+            key = f"{cls}:ip:{request.remote_addr}"
+            rate, burst = cfg["rate"] * SHARED_IP_FACTOR, cfg["burst"] * SHARED_IP_FACTOR
+        else:
+            key = None
+        retry_after = 0
+        if key is not None:
+            try:
+                retry_after = self.buckets.take(key, rate, burst)
+            except sqlite3.Error as e:
+                # 狀態檔有問題時不擋人，只在伺服器記錄
+                print("⚠️ 限流狀態檔讀寫失敗：", e)
+        if retry_after > 0:
+            return self._busy(429, retry_after, "操作太頻繁，請稍後再試。")
+
+        # 2. 排隊（每一類各自一條隊伍，交卷塞車不會卡到登入）
+        queue = self.queues[cls]
+        waited = queue.acquire()
+        if waited is None:
+            return self._busy(503, queue.max_wait, "目前使用人數眾多，請稍後再試。")
+        g.admission_queue = queue
+        g.admission_wait = waited
+        return None
+
+    def _teardown(self, exc):
+        queue = g.pop("admission_queue", None)
+        if queue is not None:
+            queue.release()
+
+    def stats(self):
+        return {
+            "pid": os.getpid(),
+            "classes": {name: q.stats() for name, q in self.queues.items()},
+        }
+
+    def _stats_view(self):
+        if session.get("user_account") != "t001" and not session.get("is_teacher"):
+            return jsonify({"error": "forbidden"}), 403
+        return jsonify(self.stats())
@@ -1,19 +1,34 @@
-from flask import Flask, render_template, request, redirect, url_for, session
-from openpyxl import Workbook, load_workbook
+from flask import Flask, Response, render_template, request, redirect, url_for, session, jsonify, abort, send_from_directory
 from datetime import datetime, date  # ✅ 一次匯入 datetime 和 date
 import random
 import os
 import json
-import gspread
-
-
-
-from google.oauth2.service_account import Credentials
-
-from openpyxl import load_workbook
+import threading
+import time
+import uuid
+
+# openpyxl / gspread / google-auth / numpy 都很慢（合起來約 0.4 秒），
+# 等到真的用到才在函式裡 import，worker 冷啟動不用等
+from quiz_pool import QuizPaperPool
+from admission import AdmissionControl, STREAM_THREADS
+from autosave import AutosaveBuffer
+from storage import open_storage, record_to_row
+from sheets_mirror import SheetMirror, FakeWorksheet
+from search_index import QuestionIndex
+from shared_cache import SharedQuestionIndex, SharedLeaderboard, shared_path
+from formula_cache import FormulaCache
+from numeric_questions import VariantBank, load_templates, is_numeric
+from irt import IrtCalibrator, IrtEstimates, IrtRefresher
+from leaderboards import WindowedLeaderboard, WINDOWS, bucket_label
+from archive import ResultArchive
+from events import SharedEventLog
+from capture import TrafficCapture, request_rng, REPLAY_MODE
+from profiler import SamplingProfiler, hot_functions, by_request
 
 def load_question_bank():
     """從 questions.xlsx 載入題庫，並檢查欄位完整性"""
+    from openpyxl import load_workbook
+
     filename = "questions.xlsx"
     required_headers = ["id", "text", "options", "answer", "explanation", "category"]
 
@@ -77,8 +92,12 @@ def load_question_bank():
             "category": category,
         })
 
+    # 參數化數值題（工作表「Templates」，沒有就略過）
+    templates = load_templates(wb, error_list)
+    questions.extend(templates)
+
     # 印出載入結果與錯誤統計
-    print(f"✅ 題庫載入完成，共 {len(questions)} 題。")
+    print(f"✅ 題庫載入完成，共 {len(questions)} 題（其中參數化題 {len(templates)} 題）。")
     if error_list:
         print("⚠️ 以下題目內容有問題：")
         for err in error_list:
@@ -89,30 +108,41 @@ def load_question_bank():
     return questions
 
 
-# 啟動時載入題庫
-QUESTION_BANK = load_question_bank()
-SETTINGS_FILE = "settings.json"
+# 資料存取後端（QUIZ_STORAGE=xlsx / sqlite:路徑 / redis://主機:埠/編號，預設 xlsx）
+STORAGE = open_storage()
+
+# 舊月份的作答封存在 archive/（python archive.py rollover），STORAGE 只留目前的月份
+ARCHIVE = ResultArchive()
+
+# IRT 估計值（題目難度 / 學生能力）；由 python irt.py refresh、老師首頁的按鈕或交卷累積時在背景更新
+IRT = IrtEstimates(STORAGE)
+
+
+def _irt_refreshed(summary):
+    IRT.invalidate()
+    if SETTINGS.get("adaptive_selection"):
+        QUIZ_POOL.invalidate()  # 權重變了，預做的個人考卷重做
+
+
+IRT_REFRESHER = IrtRefresher(lambda: IrtCalibrator(STORAGE, archive=ARCHIVE), on_done=_irt_refreshed)
 
 DEFAULT_SETTINGS = {
     "questions_per_test": 5,        # 每次抽題數
     "show_explanation": True,       # 顯示詳解
     "wrong_only_mode": False,       # 錯題再練
     "daily_limit": 3,               # 每日作答次數上限（0 = 不限制）
-    "time_limit_seconds": 0         # 作答時間（秒），0 表示不啟用倒數計時
+    "time_limit_seconds": 0,        # 作答時間（秒），0 表示不啟用倒數計時
+    "client_render_quiz": False,    # 考卷改由瀏覽器畫面產生，並自動暫存作答
+    "adaptive_selection": False,    # 適性抽題：多出接近學生能力的題目（需先做 IRT 校準）
+    "quiz_category": ""             # 只從這個分類抽題（空字串 = 全部）
 }
 
 
 def load_settings():
-    if not os.path.exists(SETTINGS_FILE):
-        save_settings(DEFAULT_SETTINGS)
-        return DEFAULT_SETTINGS
-
-    try:
-        with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    except:
+    data = STORAGE.load_settings()
+    if data is None:
         save_settings(DEFAULT_SETTINGS)
-        return DEFAULT_SETTINGS
+        return dict(DEFAULT_SETTINGS)
 
     # 若有新欄位，用預設值補
     for k, v in DEFAULT_SETTINGS.items():
@@ -121,40 +151,63 @@ def load_settings():
     return data
 
 def save_settings(settings: dict):
-    with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
-        json.dump(settings, f, ensure_ascii=False, indent=2)
+    STORAGE.save_settings(settings)
+
+# 設定等到第一個請求才去後端讀（import app 時不做 I/O）；之後一律原地修改這個 dict
+SETTINGS = {}
+_settings_lock = threading.Lock()
+
 
-SETTINGS = load_settings()
+def ensure_settings():
+    if SETTINGS:
+        return SETTINGS
+    with _settings_lock:
+        if not SETTINGS:
+            SETTINGS.update(load_settings())
+    return SETTINGS
 
 
 app = Flask(__name__)
-app.secret_key = "change-this-secret-key"  # 可以改成你自己的亂碼字串
+app.secret_key = os.environ.get("QUIZ_SECRET_KEY", "change-this-secret-key")  # 可以改成你自己的亂碼字串
 
-USERS_FILE = "users.xlsx"
-RESULT_FILE = "quiz_results.xlsx"
-# ===== Google Sheets 設定 =====
-import os
-from google.oauth2.service_account import Credentials
-import gspread
+# 流量錄製（QUIZ_CAPTURE=檔名 才會開）；放在排隊之前，記到的時間才包含排隊
+CAPTURE = TrafficCapture(app)
+
+# 取樣分析：老師從後台開 N 秒，各 worker 一起抓呼叫堆疊（沒開時只有一條每秒看控制檔的執行緒）
+PROFILER = SamplingProfiler(app)
+PROFILE_TOP_N = 30   # 取樣結果頁列出幾個最花時間的函式
+
+# 排隊與限流：交卷 / 登入 / 一般瀏覽各排各的隊，滿了就回 503 + Retry-After
+ADMISSION = AdmissionControl(app)
 
+
+@app.before_request
+def _load_settings_once():
+    ensure_settings()
+
+# ===== Google Sheets 設定 =====
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 GOOGLE_CREDS_FILE = os.path.join(BASE_DIR, "service_account.json")  # 確保用絕對路徑
 GOOGLE_SHEET_NAME = "quiz_results_online"
+GOOGLE_RESULTS_WORKSHEET = "作答紀錄"   # 交卷紀錄放這個工作表（帳號在第一個工作表）
 
 GOOGLE_SCOPES = [
     "https://www.googleapis.com/auth/spreadsheets",
     "https://www.googleapis.com/auth/drive",
 ]
 
-_sheet = None  # 暫存 worksheet 物件
+_spreadsheet = None     # 暫存試算表物件
+_sheet = None           # 暫存帳號 worksheet 物件
+_results_sheet = None   # 暫存作答紀錄 worksheet 物件
 
-def get_google_sheet():
-    """取得 Google Sheet 的 sheet1 物件。"""
-    global _sheet
-    if _sheet is None:
+def _open_spreadsheet():
+    global _spreadsheet
+    if _spreadsheet is None:
         try:
             print("📡 正在連線到 Google 試算表…")
+            from google.oauth2.service_account import Credentials
+            import gspread
 
             creds = Credentials.from_service_account_file(
                 GOOGLE_CREDS_FILE,
@@ -163,112 +216,183 @@ def get_google_sheet():
             client = gspread.authorize(creds)
 
             # ✅ 用名稱開啟試算表
-            sh = client.open(GOOGLE_SHEET_NAME)
-            _sheet = sh.sheet1  # 第一個工作表
+            _spreadsheet = client.open(GOOGLE_SHEET_NAME)
 
-            # 🔍 除錯資訊：印出實際寫入的試算表網址與工作表名稱
-            print("✅ 已連線到 Google 試算表：", sh.url)
-            print("✅ 使用的工作表名稱：", _sheet.title)
+            # 🔍 除錯資訊：印出實際寫入的試算表網址
+            print("✅ 已連線到 Google 試算表：", _spreadsheet.url)
 
         except Exception as e:
             print("❌ 連線 Google 試算表失敗：", e)
             # 這裡 raise 讓你在測試時看到錯誤（正式上線也可以改成 pass）
             raise
+    return _spreadsheet
 
+
+def get_google_sheet():
+    """取得 Google Sheet 的 sheet1 物件（帳號表）。"""
+    global _sheet
+    if _sheet is None and os.environ.get("QUIZ_SHEETS_OFFLINE"):
+        # 本機開發 / 沒網路：用離線替身，不連 Google
+        _sheet = FakeWorksheet([["account", "password", "name", "total_points"]])
+    if _sheet is None:
+        _sheet = _open_spreadsheet().sheet1  # 第一個工作表
+        print("✅ 使用的工作表名稱：", _sheet.title)
     return _sheet
 
 
+def get_results_sheet():
+    """取得作答紀錄的 worksheet；試算表裡還沒有這個工作表就新增一個。"""
+    global _results_sheet
+    if _results_sheet is None and os.environ.get("QUIZ_SHEETS_OFFLINE"):
+        _results_sheet = FakeWorksheet()
+    if _results_sheet is None:
+        import gspread
+
+        sh = _open_spreadsheet()
+        try:
+            _results_sheet = sh.worksheet(GOOGLE_RESULTS_WORKSHEET)
+        except gspread.WorksheetNotFound:
+            _results_sheet = sh.add_worksheet(GOOGLE_RESULTS_WORKSHEET, rows=1000, cols=60)
+        print("✅ 作答紀錄工作表：", _results_sheet.title)
+    return _results_sheet
+
+
+# 帳號 -> 列號索引 + 批次寫入（不再每次 get_all_records 整張下載）
+SHEET_MIRROR = SheetMirror(get_google_sheet, get_results_sheet)
+
+
+# ===== 公式圖檔（python formula_cache.py build 預先產生） =====
+FORMULAS = FormulaCache()
+
+
+@app.template_filter("math")
+def math_filter(text):
+    """模板用：{{ q.text|math }} 會把 $...$ 公式換成預先算好的 SVG 圖。"""
+    return FORMULAS.render(text, lambda digest: url_for("formula_svg", digest=digest))
+
+
+@app.route("/formula/<digest>.svg")
+def formula_svg(digest):
+    """公式圖檔：檔名就是內容雜湊，內容不會變，所以讓瀏覽器快取一年。"""
+    if not FORMULAS.has(digest):
+        abort(404)
+    resp = send_from_directory(FORMULAS.directory, f"{digest}.svg", mimetype="image/svg+xml", max_age=31536000)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+
 # ===== 題庫設定 =====
-# 之後你只要一直在這裡加題目就好
-QUESTION_BANK = load_question_bank()
+# 題庫倒排索引（老師搜尋題目、依分類抽題都用它，不用每次掃整個題庫）
+# 第一次用到時才讀 questions.xlsx。預設放在各 worker 共用的 mmap 檔（見 shared_cache.py），
+# QUIZ_SHARED_CACHE=0 則改回每個 worker 各自一份
+if os.environ.get("QUIZ_SHARED_CACHE", "1") != "0":
+    QUESTION_INDEX = SharedQuestionIndex(shared_path("bank"), loader=load_question_bank, source="questions.xlsx")
+else:
+    QUESTION_INDEX = QuestionIndex(loader=load_question_bank)
+
+
+def get_question_bank():
+    """目前的題庫（照 questions.xlsx 的順序；共用快取時是取到才解碼的唯讀序列）。"""
+    return QUESTION_INDEX.bank()
+
+
+def build_shared_caches():
+    """gunicorn --preload：master 先把題庫共用檔建好，fork 出來的 worker 直接沿用（見 gunicorn.conf.py）。"""
+    print(f"🧾 題庫共用快取：{len(QUESTION_INDEX)} 題")
+
+
+def reload_question_bank():
+    """重新讀 questions.xlsx；索引只重建有改過的題目，預產的考卷作廢。"""
+    added, changed, removed = QUESTION_INDEX.update(load_question_bank())
+    QUIZ_POOL.invalidate()
+    FORMULAS.refresh()
+    return added, changed, removed
 
 
 NUM_QUESTIONS_PER_QUIZ = 3  # 每次測驗抽幾題
+MAX_OPEN_PAPERS = 5         # session 最多記幾份還沒交的考卷（參數化題目的數字）
 
 
-def load_wrong_questions(account):#老師介面錯題讀取
-    """從 quiz_results.xlsx 擷取該學生所有錯題 ID"""
-    if not os.path.exists("quiz_results.xlsx"):
-        return []
+def iter_account_results(account):
+    """該生全部作答，由舊到新：先是封存的舊月份，再接 STORAGE 裡本月的。"""
+    yield from ARCHIVE.account_results(account)
+    yield from STORAGE.iter_results(account)
 
-    wb = load_workbook("quiz_results.xlsx")
-    ws = wb.active
 
+def load_wrong_questions(account):#老師介面錯題讀取
+    """從作答紀錄擷取該學生所有錯題 ID（含封存的舊月份）"""
     wrong_ids = set()
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        t, acc, name, score, qid, ans, ok = row
-        if acc == account and ok == "錯誤":
-            wrong_ids.add(qid)
+    for rec in iter_account_results(account):
+        for qid, (ans, mark) in rec["answers"].items():
+            if mark == "X":
+                wrong_ids.add(qid)
 
-    return [q for q in QUESTION_BANK if q["id"] in wrong_ids]
+    return QUESTION_INDEX.get_many(wrong_ids)
 
 
-# ===== Excel 初始化 =====
+def load_wrong_questions_in_category(account):
+    """錯題再練 + 指定分類：只留該分類的錯題。"""
+    wrong_q = load_wrong_questions(account)
+    category = SETTINGS.get("quiz_category")
+    if not category:
+        return wrong_q
+    allowed = QUESTION_INDEX.category_ids(category)
+    return [q for q in wrong_q if q["id"] in allowed]
 
-def init_users_excel():
-    """如果沒有 users.xlsx，就建立一份，順便放幾個測試帳號。"""
-    if not os.path.exists(USERS_FILE):
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Users"
-        ws.append(["帳號", "密碼", "姓名", "總積分"])
-        # 測試資料：之後你可以改成真正學生名單
-        ws.append(["s001", "1234", "小明", 0])
-        ws.append(["s002", "1234", "小美", 0])
-        wb.save(USERS_FILE)
 
+# ===== 參數化數值題：每個模板整批預先算好數字 =====
+VARIANTS = VariantBank(seed=0 if REPLAY_MODE else None)   # 重播時固定種子，每次代入的數字都一樣
 
-def init_results_excel():
-    """如果沒有 quiz_results.xlsx，就建立一份（每列一人一次作答）。"""
-    if not os.path.exists(RESULT_FILE):
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Results"
 
-        # 基本欄位
-        headers = ["時間", "帳號", "姓名", "作答次數", "本次分數"]
+# ===== 考卷預產池（開考瞬間大家同時按 /quiz 時直接取現成考卷） =====
+QUIZ_POOL = QuizPaperPool(
+    bank_getter=lambda: QUESTION_INDEX.in_category(ensure_settings().get("quiz_category")),
+    settings_getter=ensure_settings,
+    wrong_loader=load_wrong_questions_in_category,
+    instantiate=VARIANTS.instantiate_paper,
+    weigher=lambda account, questions: (
+        IRT.selection_weights(account, questions)
+        if ensure_settings().get("adaptive_selection") else None
+    ),
+)
 
-        # 依照題庫動態加欄位：每題兩欄（答案 / 是否正確）
-        for q in QUESTION_BANK:
-            headers.append(f"{q['id']}_答案")
-            headers.append(f"{q['id']}_是否正確")
 
-        ws.append(headers)
-        wb.save(RESULT_FILE)
+# ===== 初始化 =====
 
+def init_storage():
+    """第一次啟動：沒有 users.xlsx / quiz_results.xlsx（或資料表）就建立。"""
+    STORAGE.init(question_ids=QUESTION_INDEX.ids())
 
 
 # ===== 輔助函式 =====
 
-def get_user_row(account):
-    """回傳 (wb, ws, row_index) 讓你可以更新該使用者總積分。"""
-    wb = load_workbook(USERS_FILE)
-    ws = wb["Users"]
-    for idx, row in enumerate(ws.iter_rows(min_row=2), start=2):
-        if row[0].value == account:
-            return wb, ws, idx
-    return wb, ws, None
+# 全班總積分排序好放在共用檔，各 worker 用 bisect 查名次（最多舊 LEADERBOARD_TTL 秒）
+LEADERBOARD = SharedLeaderboard(
+    shared_path("leaderboard"),
+    loader=lambda: [u["total_points"] for u in STORAGE.list_users()],
+)
+
+
+# 交卷事件：寫進共用事件檔，每個 worker 讀回來推給老師首頁的即時看板（SSE）
+EVENTS = SharedEventLog(shared_path("events", suffix=".log"))
+# 每個 worker 最多幾條看板連線：每條佔一條執行緒，admission 已經替它們預留（QUIZ_MAX_STREAMS）
+MAX_STREAMS_PER_WORKER = STREAM_THREADS
+STREAM_BUSY_RETRY_MS = 15000     # 連線已滿時，請瀏覽器隔多久再連
+
+# 今日 / 本週 / 本學期排行：交卷時加進各時段的積分表，查詢直接走索引
+WINDOW_BOARDS = WindowedLeaderboard(STORAGE)
+WINDOW_TOP_N = 200   # 老師首頁時段排行最多列幾人
+ARCHIVE_QUERY_LIMIT = 500   # 封存查詢一次最多列幾筆
+
+
 def get_user_rank(account):
-    """根據總積分計算該帳號的排名（1 是最高分）。"""
-    wb = load_workbook(USERS_FILE)
-    ws = wb["Users"]
-
-    users = []
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        acc, pwd, name, total = row
-        total = total or 0
-        users.append((acc, total))
-
-    # 按總積分由高到低排序
-    users.sort(key=lambda x: x[1], reverse=True)
-
-    rank = None
-    for idx, (acc, _) in enumerate(users, start=1):
-        if acc == account:
-            rank = idx
-            break
-
-    return rank, len(users)
+    """根據總積分計算該帳號的排名（1 是最高分，同分同名次）。"""
+    user = STORAGE.get_user(account)
+    total_users = LEADERBOARD.stats()["count"]
+    if user is None:
+        return None, total_users
+    return LEADERBOARD.rank(user["total_points"]), total_users
 def get_level(total_points):
     """根據總積分回傳等級稱號。你可以自己改門檻和名稱。"""
     if total_points < 10:
@@ -297,42 +421,15 @@ def login():
         account = request.form.get("account", "")
         password = request.form.get("password", "")
 
-        from openpyxl import load_workbook
-
-        # 讀 users.xlsx
-        wb = load_workbook(USERS_FILE, read_only=True)
-        try:
-            ws = wb["Users"]
-        except KeyError:
-            ws = wb.active  # 萬一你的表不叫 Users
-
-        # 讀表頭並建立欄位索引（1 列）
-        headers = [str(c.value).strip() if c.value else "" for c in ws[1]]
-        need = ["account", "password", "name", "total_points"]
-        miss = [h for h in need if h not in headers]
-        if miss:
-            return render_template("login.html", error=f"users.xlsx 缺少欄位：{', '.join(miss)}")
-
-        col = {h: headers.index(h) for h in need}  # 0-based index
-
-        # 掃資料列
         found = False
         user_name = ""
         total_points = 0
 
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            # 用表頭索引安全取值（即使有多餘欄也不怕）
-            acc  = str(row[col["account"]]  or "").strip()
-            pwd  = str(row[col["password"]] or "").strip()
-            name = str(row[col["name"]]     or "").strip()
-            total = row[col["total_points"]]
-            total = int(total) if isinstance(total, (int, float)) else 0
-
-            if acc == str(account).strip() and pwd == str(password).strip():
-                found = True
-                user_name = name or acc
-                total_points = total
-                break
+        user = STORAGE.get_user(account)
+        if user and user["password"] == str(password).strip():
+            found = True
+            user_name = user["name"] or user["account"]
+            total_points = user["total_points"]
 
         if found:
             session["user_account"] = account
@@ -381,6 +478,13 @@ def home():
         print("計算排名時發生錯誤：", e)
         rank, total_users = None, None
 
+    # 本週排名（只比本週有作答的人）
+    try:
+        week_rank, week_points, week_users = WINDOW_BOARDS.rank(account, "week")
+    except Exception as e:
+        print("計算本週排名時發生錯誤：", e)
+        week_rank, week_points, week_users = None, 0, 0
+
     # === 今日作答上限狀態 ===
     daily_limit = SETTINGS.get("daily_limit", 0)
     today = date.today().isoformat()
@@ -415,17 +519,10 @@ def home():
     last_time = None      # 最近一次時間
 
     try:
-        wb_r = load_workbook(RESULT_FILE)
-        ws_r = wb_r["Results"]
-
         scores_sum = 0
 
-        for row in ws_r.iter_rows(min_row=2, values_only=True):
-            # 結構：[時間, 帳號, 姓名, 作答次數, 分數, 之後是各題答案/對錯...]
-            tstr, acc, nm, attempt_no, score = row[:5]
-
-            if acc != account:
-                continue
+        for rec in STORAGE.iter_results(account):
+            tstr, attempt_no, score = rec["time"], rec["attempt_no"], rec["score"]
 
             total_attempts += 1
             score = score or 0
@@ -446,6 +543,13 @@ def home():
                     "score": score
                 })
 
+        # 封存的舊月份：用 manifest 的彙總補上，不用打開封存檔
+        archived = ARCHIVE.account_totals(account)
+        total_attempts += archived["attempts"]
+        scores_sum += archived["points"]
+        if archived["best"] is not None and (best_score is None or archived["best"] > best_score):
+            best_score = archived["best"]
+
         if total_attempts > 0:
             avg_score = round(scores_sum / total_attempts, 1)
 
@@ -465,6 +569,9 @@ def home():
         level=level,
         rank=rank,
         total_users=total_users,
+        week_rank=week_rank,
+        week_points=week_points,
+        week_users=week_users,
         daily_limit=daily_limit,
         limit_msg=limit_msg,
         reached_limit=reached_limit,
@@ -483,35 +590,38 @@ def teacher_home():
     if session.get("user_account") != "t001" and not session.get("is_teacher"):
         return redirect(url_for("home"))
 
-    # 讀 users.xlsx 來做排行榜
-    try:
-        wb = load_workbook(USERS_FILE)
-        # 你原本的使用者表名稱如果是 "Users" 就用這個，若是 active 就改成 wb.active
-        try:
-            ws = wb["Users"]
-        except KeyError:
-            ws = wb.active
+    # 排行時段：空字串 = 總積分，其餘見 WINDOWS（今日 / 本週 / 本學期）
+    window = request.args.get("window", "")
+    if window not in WINDOWS:
+        window = ""
 
-        students = []
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            # 預期欄位：[帳號, 密碼, 姓名, 總積分, ...]
-            if not row or not row[0]:
-                continue
-            account, pwd, name, total_points = (row + (0, 0, 0, 0))[:4]
-            total_points = total_points or 0
+    # 讀帳號資料來做排行榜（用快照，不會卡到同時在交卷的學生）
+    try:
+        users = STORAGE.snapshot().users
+        if window:
+            # 時段排行直接讀 rollup 表的前幾名（已排好、同分同名次）
+            names = {u["account"]: u["name"] for u in users}
+            students = [
+                {"account": r["account"], "name": names.get(r["account"], ""),
+                 "total_points": r["points"], "rank": r["rank"]}
+                for r in WINDOW_BOARDS.top(window, limit=WINDOW_TOP_N)
+            ]
+        else:
+            students = [
+                {"account": u["account"], "name": u["name"], "total_points": u["total_points"]}
+                for u in users
+            ]
 
-            students.append({
-                "account": account,
-                "name": name,
-                "total_points": total_points
-            })
+            # 依總積分排序（大到小），若積分相同以姓名排序
+            students.sort(key=lambda s: (-s["total_points"], s["name"] or ""))
 
-        # 依總積分排序（大到小），若積分相同以姓名排序
-        students.sort(key=lambda s: (-s["total_points"], s["name"] or ""))
+            # 幫每個學生加上名次（1,2,3,...）
+            for idx, s in enumerate(students, start=1):
+                s["rank"] = idx
 
-        # 幫每個學生加上名次（1,2,3,...）
-        for idx, s in enumerate(students, start=1):
-            s["rank"] = idx
+        # IRT 能力估計
+        for s in students:
+            s["ability"] = IRT.ability(s["account"])
 
         total_students = len(students)
         avg_points = None
@@ -535,19 +645,254 @@ def teacher_home():
         students=students,
         total_students=total_students,
         avg_points=avg_points,
-        max_points=max_points
+        max_points=max_points,
+        window=window,
+        windows=WINDOWS,
+        window_label=bucket_label(WINDOW_BOARDS.bucket(window)) if window else None,
+        pool_stats=QUIZ_POOL.stats(),
+        irt=_irt_summary(),
+        irt_message=request.args.get("irt_message"),
+        irt_running=IRT_REFRESHER.busy(),
     )
 
 
+def _irt_summary():
+    """老師首頁的題目難度表：依難度 b 由難到易排。"""
+    doc = IRT.get()
+    if not doc.get("items"):
+        return None
+    items = []
+    for qid, it in doc["items"].items():
+        q = QUESTION_INDEX.get(qid)
+        items.append(dict(it, id=qid, text=(q or {}).get("text", "（題庫已無此題）")))
+    items.sort(key=lambda it: -it["b"])
+    return {
+        "model": doc.get("model"),
+        "fitted_at": doc.get("fitted_at"),
+        "responses": doc.get("responses"),
+        "items": items,
+    }
+
+
+@app.route("/teacher/stream")
+def teacher_stream():
+    """老師首頁的即時看板：交卷事件的 server-sent events 串流。"""
+    if session.get("user_account") != "t001" and not session.get("is_teacher"):
+        abort(403)
+
+    if EVENTS.viewers >= MAX_STREAMS_PER_WORKER:
+        # 連線已滿：告訴瀏覽器（看板會顯示），然後結束串流請它晚點重連（回 503 的話 EventSource 會直接放棄）
+        # （不帶 id：瀏覽器的 Last-Event-ID 要留著，連上之後才補得到這段時間的交卷）
+        data = json.dumps({"limit": MAX_STREAMS_PER_WORKER, "retry_seconds": STREAM_BUSY_RETRY_MS // 1000})
+        return Response(f"retry: {STREAM_BUSY_RETRY_MS}\nevent: busy\ndata: {data}\n\n",
+                        mimetype="text/event-stream")
+
+    return Response(
+        EVENTS.listen(request.headers.get("Last-Event-ID")),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-@app.route("/quiz")
-def quiz():
-    if "user_account" not in session:
-        return redirect(url_for("login"))
 
-    account = session["user_account"]
+@app.route("/teacher/archive")
+def teacher_archive():
+    """封存查詢：列出各月份分區，選一個分區（可再指定帳號）看當時的作答。"""
+    if session.get("user_account") != "t001" and not session.get("is_teacher"):
+        return redirect(url_for("home"))
+
+    partition = request.args.get("partition", "").strip()
+    account = request.args.get("account", "").strip()
+    partitions = ARCHIVE.partitions()
+    records = []
+    truncated = False
+    if partition and partition in dict(partitions):
+        for rec in ARCHIVE.iter_results(partition, account=account or None):
+            if len(records) >= ARCHIVE_QUERY_LIMIT:
+                truncated = True
+                break
+            rec["correct"] = sum(1 for _, mark in rec["answers"].values() if mark == "O")
+            records.append(rec)
+
+    return render_template(
+        "archive.html",
+        partitions=partitions,
+        partition=partition,
+        account=account,
+        records=records,
+        truncated=truncated,
+        limit=ARCHIVE_QUERY_LIMIT,
+        title="作答封存查詢"
+    )
+
+
+@app.route("/teacher/archive/<partition>.jsonl.gz")
+def teacher_archive_download(partition):
+    """下載整個分區的原始封存檔。"""
+    if session.get("user_account") != "t001" and not session.get("is_teacher"):
+        return redirect(url_for("home"))
+    if partition not in ARCHIVE.manifest().get("partitions", {}):
+        abort(404)
+    return send_from_directory(ARCHIVE.directory, ARCHIVE.file_name(partition), as_attachment=True)
+
+
+@app.route("/teacher/profile")
+def teacher_profile():
+    """取樣分析：開始取樣、看最近幾次的結果（哪些請求、哪些函式最花時間）。"""
+    if session.get("user_account") != "t001" and not session.get("is_teacher"):
+        return redirect(url_for("home"))
+
+    control = PROFILER.control()
+    remaining = max(0, int(control["until"] - time.time() + 0.999)) if control else 0
+    sessions = PROFILER.sessions()
+    selected = request.args.get("id", "").strip() or (sessions[0][0] if sessions else "")
+    hot, request_rows, total = [], [], 0
+    if selected in dict(sessions):
+        counts = PROFILER.merged(selected)
+        total = sum(counts.values())
+        hot = hot_functions(counts, PROFILE_TOP_N)
+        request_rows = by_request(counts)
+
+    return render_template(
+        "profile.html",
+        control=control,
+        remaining=remaining,
+        sessions=sessions,
+        selected=selected,
+        hot=hot,
+        requests=request_rows,
+        total=total,
+        message=request.args.get("message", ""),
+        title="效能取樣分析"
+    )
+
+
+@app.route("/teacher/profile/start", methods=["POST"])
+def teacher_profile_start():
+    """所有 worker 一起開始取樣 N 秒。"""
+    if session.get("user_account") != "t001" and not session.get("is_teacher"):
+        return redirect(url_for("home"))
+
+    control = PROFILER.control()
+    if control and time.time() < control["until"]:
+        return redirect(url_for("teacher_profile", message="已經有取樣在進行中，請等它結束"))
+    try:
+        seconds = int(request.form.get("seconds", 10))
+        interval_ms = float(request.form.get("interval_ms", 10))
+    except ValueError:
+        return redirect(url_for("teacher_profile", message="秒數 / 間隔要填數字"))
+
+    session_id = PROFILER.start(
+        seconds,
+        interval=max(1.0, min(100.0, interval_ms)) / 1000,
+        all_threads=bool(request.form.get("all_threads")),
+        by=session.get("user_account"),
+    )
+    print(f"🛠 開始取樣分析 {session_id}（{seconds} 秒）")
+    return redirect(url_for("teacher_profile", message=f"已開始取樣（{session_id}），時間到後重新整理就能看結果"))
+
+
+@app.route("/teacher/profile/<session_id>.folded")
+def teacher_profile_download(session_id):
+    """下載合併所有 worker 的 collapsed stack（flamegraph.pl / speedscope 可直接讀）。"""
+    if session.get("user_account") != "t001" and not session.get("is_teacher"):
+        return redirect(url_for("home"))
+    if session_id not in dict(PROFILER.sessions()):
+        abort(404)
+
+    counts = PROFILER.merged(session_id)
+    body = "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
+    return Response(
+        body,
+        mimetype="text/plain",
+        headers={"Content-Disposition": f"attachment; filename=profile-{session_id}.folded"},
+    )
+
+
+@app.route("/teacher/irt/refresh", methods=["POST"])
+def teacher_irt_refresh():
+    """重新校準題目難度 / 學生能力（只讀上次之後的新作答）；在背景算，不讓老師的請求等。"""
+    if session.get("user_account") != "t001" and not session.get("is_teacher"):
+        return redirect(url_for("home"))
+
+    if not IRT_REFRESHER.request():
+        return redirect(url_for("teacher_home", irt_message="已經有校準在進行中，請稍後再看"))
+    return redirect(url_for("teacher_home", irt_message="已在背景開始校準，過一會兒重新整理就會看到新的估計值"))
+
+
+@app.route("/teacher/questions")
+def teacher_questions():
+    """老師的題庫搜尋 / 瀏覽頁。"""
+    if session.get("user_account") != "t001" and not session.get("is_teacher"):
+        return redirect(url_for("home"))
+
+    keyword = request.args.get("q", "").strip()
+    category = request.args.get("category", "").strip()
+    answer = request.args.get("answer", "").strip()
+    results = QUESTION_INDEX.search(keyword, category=category or None, answer=answer or None, limit=200)
+
+    return render_template(
+        "question_search.html",
+        keyword=keyword,
+        category=category,
+        answer=answer,
+        categories=QUESTION_INDEX.categories(),
+        results=results,
+        total=len(QUESTION_INDEX),
+        message=request.args.get("message"),
+        title="題庫搜尋"
+    )
+
+
+@app.route("/api/questions/search")
+def api_questions_search():
+    """題庫搜尋 JSON：?q=關鍵字&category=分類&answer=答案&limit=50"""
+    if session.get("user_account") != "t001" and not session.get("is_teacher"):
+        return _api_error("只有老師可以搜尋題庫。", 403)
+
+    try:
+        limit = max(1, min(int(request.args.get("limit", 50)), 500))
+    except ValueError:
+        limit = 50
+    results = QUESTION_INDEX.search(
+        request.args.get("q", ""),
+        category=request.args.get("category") or None,
+        answer=request.args.get("answer") or None,
+        limit=limit,
+    )
+    return jsonify({"count": len(results), "questions": results})
+
+
+@app.route("/teacher/questions/reload", methods=["POST"])
+def teacher_reload_questions():
+    """老師改完 questions.xlsx 後按這個，不用重開伺服器。"""
+    if session.get("user_account") != "t001" and not session.get("is_teacher"):
+        return redirect(url_for("home"))
+
+    added, changed, removed = reload_question_bank()
+    msg = f"題庫已重新載入：新增 {added} 題、修改 {changed} 題、刪除 {removed} 題"
+    return redirect(url_for("teacher_questions", message=msg))
+
+
+@app.route("/teacher/prewarm", methods=["POST"])
+def teacher_prewarm():
+    """老師按「準備開考」：先把考卷做好放進預產池。"""
+    if session.get("user_account") != "t001" and not session.get("is_teacher"):
+        return redirect(url_for("home"))
 
-    # daily limit（教師設定）
+    accounts = []
+    try:
+        accounts = [u["account"] for u in STORAGE.list_users() if u["account"] != "t001"]
+    except Exception as e:
+        print("讀取學生名單失敗（只預產一般考卷）：", e)
+
+    QUIZ_POOL.prewarm(accounts)
+    print(f"🧾 已開始預產考卷（學生 {len(accounts)} 人）")
+    return redirect(url_for("teacher_home"))
+
+
+
+def check_daily_limit():
+    """daily limit（教師設定）：已達上限回傳提示文字，否則回傳 None。"""
     limit = SETTINGS.get("daily_limit", 0)
     if limit > 0:
         today = date.today().isoformat()
@@ -561,33 +906,52 @@ def quiz():
         if session.get("last_quiz_date") != today:
             session["last_quiz_date"] = today
             session["quiz_times_today"] = 0
+    return None
 
-    # 錯題模式（教師設定）
-    if SETTINGS.get("wrong_only_mode", False):
-        wrong_q = load_wrong_questions(account)
-        if wrong_q:
-            usable_bank = wrong_q
-        else:
-            usable_bank = QUESTION_BANK
-    else:
-        usable_bank = QUESTION_BANK
 
-    if not usable_bank:
-        return "⚠️ 沒有可用的題目。"
+@app.route("/quiz")
+def quiz():
+    if "user_account" not in session:
+        return redirect(url_for("login"))
+
+    account = session["user_account"]
+
+    limit_msg = check_daily_limit()
+    if limit_msg:
+        return limit_msg
 
-    # 取得抽題數
-    n = min(SETTINGS.get("questions_per_test", 5), len(usable_bank))
-    questions_for_view = random.sample(usable_bank, n)
+    # 考卷交給瀏覽器用 /api/quiz 產生（會自動暫存作答）
+    if SETTINGS.get("client_render_quiz", False):
+        return render_template(
+            "quiz_app.html",
+            name=session["user_name"],
+            show_explanation=SETTINGS.get("show_explanation", True),
+            time_limit_seconds=SETTINGS.get("time_limit_seconds", 0)
+        )
 
-    # 打亂選項
-    for q in questions_for_view:
-        if "options" in q:
-            random.shuffle(q["options"])
+    # 從預產池取一份考卷（錯題模式 / 抽題數 / 打亂選項都在池子裡處理好）
+    questions_for_view = QUIZ_POOL.pop(account, rng=request_rng())
+
+    if not questions_for_view:
+        return "⚠️ 沒有可用的題目。"
+
+    # 參數化題目的變數值記在 session（有簽章，學生改不了），交卷時照這組重算答案批改。
+    # 只放變數值、不放答案：session cookie 只有簽章沒有加密，學生打開開發者工具就看得到。
+    # 每份考卷各記一格（表單帶 paper_id 回來對），開兩個分頁各寫各的考卷也不會互相蓋掉
+    paper_id = uuid.uuid4().hex[:16]
+    variants = {q["id"]: {"values": q["variant"]["values"]} for q in questions_for_view if "variant" in q}
+    if variants:
+        papers = {k: v for k, v in (session.get("variants") or {}).items() if isinstance(v, dict) and "q" in v}
+        papers[paper_id] = {"t": int(time.time()), "q": variants}
+        # 只留最近幾份（cookie 有大小限制）；session 存成 JSON 時 key 會排序，所以用時間挑
+        newest = sorted(papers, key=lambda k: papers[k]["t"], reverse=True)[:MAX_OPEN_PAPERS]
+        session["variants"] = {k: papers[k] for k in newest}
 
     return render_template(
         "quiz.html",
         name=session["user_name"],
         quiz=questions_for_view,
+        paper_id=paper_id,
         show_explanation=SETTINGS.get("show_explanation", True),
         time_limit_seconds=SETTINGS.get("time_limit_seconds", 0)
 )
@@ -597,41 +961,31 @@ def quiz():
 @app.route("/admin")
 def admin():
     """簡單老師後台：列出所有學生統計（一列一個測驗）。"""
-    # 讀取 users.xlsx
-    wb_u = load_workbook(USERS_FILE)
-    ws_u = wb_u["Users"]
-
-    users = []
-    for row in ws_u.iter_rows(min_row=2, values_only=True):
-        acc, pwd, name, total = row
-        total = total or 0
-        users.append({
-            "account": acc,
-            "name": name,
-            "total_points": total,
-        })
-
-    # 讀取 quiz_results.xlsx，計算作答次數與平均分數
-    wb_r = load_workbook(RESULT_FILE)
-    ws_r = wb_r["Results"]
+    # 帳號與作答紀錄取自同一份快照：讀很久也不會擋到交卷，也不會讀到寫一半的檔案
+    snap = STORAGE.snapshot()
+    users = [
+        {"account": u["account"], "name": u["name"], "total_points": u["total_points"]}
+        for u in snap.users
+    ]
 
+    # 計算作答次數與平均分數
     # 準備一個 map 來累積每個人的測驗次數和總分
     stats_map = {}
     for u in users:
         stats_map[u["account"]] = {"attempts": 0, "sum_score": 0}
 
-    for row in ws_r.iter_rows(min_row=2, values_only=True):
-        # 依照欄位順序：時間, 帳號, 姓名, 作答次數, 本次分數, ...
-        time_str, acc, name, attempt_no, score, *rest = row
+    for rec in snap.results:
+        acc, score = rec["account"], rec["score"]
         if acc in stats_map:
             stats_map[acc]["attempts"] += 1
             stats_map[acc]["sum_score"] += (score or 0)
 
-    # 合併回 users
+    # 合併回 users（加上封存的舊月份）
     for u in users:
         acc = u["account"]
-        att = stats_map[acc]["attempts"]
-        ssum = stats_map[acc]["sum_score"]
+        archived = ARCHIVE.account_totals(acc)
+        att = stats_map[acc]["attempts"] + archived["attempts"]
+        ssum = stats_map[acc]["sum_score"] + archived["points"]
         u["attempts"] = att
         u["avg_score"] = round(ssum / att, 2) if att > 0 else None
 
@@ -652,27 +1006,20 @@ def points():
     account = session["user_account"]
     name = session["user_name"]
 
-     # 讀取作答成績檔 quiz_results.xlsx
-    wb = load_workbook(RESULT_FILE)
-    ws = wb["Results"]
-
-    # 找出該學生所有紀錄
+    # 找出該學生所有紀錄（含封存的舊月份）
     records = []
-    # 根據你現在的一列一人格式：
-    # 欄位：0時間, 1帳號, 2姓名, 3作答次數, 4本次分數, ...
     total_points = 0
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        if row[1] == account:  # 帳號欄
-            total_points += row[4]  # 累積分數欄
-            records.append({
-                "time": row[0],
-                "score": row[4],
-                "points": total_points,
-                "rank": "-"
-            })
+    for rec in iter_account_results(account):
+        total_points += rec["score"]  # 累積分數
+        records.append({
+            "time": rec["time"],
+            "score": rec["score"],
+            "points": total_points,
+            "rank": "-"
+        })
     
     # 目前總積分 & 排名
-    # 你之前有 get_user_rank / get_user_row，就直接用那個
+    # 你之前有 get_user_rank，就直接用那個
     rank, total_users = get_user_rank(account)
     total_points = session.get("total_points", 0)
 
@@ -692,7 +1039,6 @@ def settings_page():
     if session.get("user_account") != "t001":
         return redirect(url_for("quiz"))
 
-    global SETTINGS
     message = None
     error = None
 
@@ -707,6 +1053,12 @@ def settings_page():
         limit_str = request.form.get("daily_limit", "").strip()
         # 5. 作答時間（分鐘）
         time_limit_str = request.form.get("time_limit_minutes", "").strip()
+        # 6. 考卷由瀏覽器產生 + 自動暫存
+        client_render_quiz = "client_render_quiz" in request.form
+        # 7. 適性抽題
+        adaptive_selection = "adaptive_selection" in request.form
+        # 8. 只從某分類抽題
+        quiz_category = request.form.get("quiz_category", "").strip()
 
         try:
             # 抽題數
@@ -733,14 +1085,22 @@ def settings_page():
                     raise ValueError("作答時間不可為負數。")
                 time_limit_seconds = time_limit_minutes * 60
 
+            # 分類
+            if quiz_category and quiz_category not in dict(QUESTION_INDEX.categories()):
+                raise ValueError(f"題庫裡沒有「{quiz_category}」這個分類。")
+
             # ✅ 寫回設定
             SETTINGS["questions_per_test"] = q_num
             SETTINGS["show_explanation"] = show_explanation
             SETTINGS["wrong_only_mode"] = wrong_only_mode
             SETTINGS["daily_limit"] = daily_limit
             SETTINGS["time_limit_seconds"] = time_limit_seconds
+            SETTINGS["client_render_quiz"] = client_render_quiz
+            SETTINGS["adaptive_selection"] = adaptive_selection
+            SETTINGS["quiz_category"] = quiz_category
 
             save_settings(SETTINGS)
+            QUIZ_POOL.invalidate()  # 抽題數 / 模式改了，預產的考卷作廢
             message = "設定已更新 ✔"
 
             print("🛠 設定更新：", SETTINGS)
@@ -754,6 +1114,7 @@ def settings_page():
         name=session.get("user_name", "老師"),
         message=message,
         error=error,
+        categories=QUESTION_INDEX.categories(),
         title="老師設定"
     )
 
@@ -782,43 +1143,26 @@ def change_password():
         elif len(new1) < 4:
             error = "新密碼至少需 4 個字元。"
         else:
-            from openpyxl import load_workbook
             try:
-                wb_u = load_workbook(USERS_FILE)
-                ws_u = wb_u["Users"]
+                user = STORAGE.get_user(account)
             except Exception as e:
                 return render_template("change_password.html", name=name, error=f"讀取使用者資料失敗：{e}")
 
             updated = False
-            for row in ws_u.iter_rows(min_row=2):
-                acc_cell, pwd_cell, name_cell, total_cell = row
-                if str(acc_cell.value) == account:
-                    if str(pwd_cell.value) != current:
-                        error = "目前密碼不正確。"
-                    else:
-                        pwd_cell.value = new1
-                        updated = True
-                    break
+            if user is not None:
+                if user["password"] != current:
+                    error = "目前密碼不正確。"
+                else:
+                    updated = True
 
             if updated and not error:
                 try:
-                    wb_u.save(USERS_FILE)
+                    STORAGE.set_password(account, new1)
                     message = "密碼已更新成功！下次登入請使用新密碼。"
 
-                    # === 同步更新到 Google 試算表 ===
+                    # === 同步更新到 Google 試算表（用本機索引直接改那一格） ===
                     try:
-                        sheet = get_google_sheet()  # 你原本用來連接的函式
-                        records = sheet.get_all_records()  # 取全部資料列
-                        # 找到該帳號對應的列
-                        row_index = None
-                        for i, rec in enumerate(records, start=2):  # 第1列是表頭
-                            if str(rec.get("account")) == account:
-                                row_index = i
-                                break
-                        if row_index:
-                            # 密碼欄是第2欄 (B)，若你的表格欄位不同請改這裡
-                            sheet.update_cell(row_index, 2, new1)
-                        else:
+                        if not SHEET_MIRROR.update_field(account, "password", new1):
                             print("⚠️ Google Sheet 找不到該帳號，未更新密碼。")
                     except Exception as e:
                         print("Google Sheet 更新密碼失敗：", e)
@@ -830,17 +1174,8 @@ def change_password():
 
     return render_template("change_password.html", name=name, message=message, error=error, title="變更密碼")
 
-@app.route("/submit", methods=["POST"])
-def submit():
-    if "user_account" not in session:
-        return redirect(url_for("login"))
-
-    session["logged_in"] = True  # 🔹保證側邊欄顯示
-    
-    account = session["user_account"]
-    name = session["user_name"]
-
-    # 🔽🔽🔽 在這裡加入：更新「今天作答次數」 🔽🔽🔽
+def count_today_attempt():
+    """交卷算一次作答：更新 session 裡「今天作答次數」。"""
     today = date.today().isoformat()
 
     # 如果是新的一天，就重置
@@ -848,97 +1183,162 @@ def submit():
         session["last_quiz_date"] = today
         session["quiz_times_today"] = 0
 
-    # 交卷算一次作答
     session["quiz_times_today"] = session.get("quiz_times_today", 0) + 1
-    # 🔼🔼🔼 新增區塊到這裡 🔼🔼🔼
-    
+
+
+def grade_answers(answers, qids=None, variants=None):
+    """批改作答，回傳 (score, details)。
+
+    answers 是 {題目ID: 學生答案}；qids 指定要批改哪些題，
+    None 代表只批改 answers 裡有出現的題目（和原本表單交卷一樣）。
+    variants 是參數化題目出題時的那組數字 {題目ID: variant}，數值題照這組批改；
+    variant 只有變數值（表單交卷從 session 拿回來的）時，答案用模板重算。
+    數值題找不到可用的 variant 時不能批改（題目的 answer 是公式字串，拿來比對會全錯），
+    details 裡標 ungradable、不計分。
+    """
+    variants = variants or {}
     score = 0
     details = []
 
-    # 只批改表單裡有出現的題目 id
-    for q in QUESTION_BANK:
+    # 只取要批改的題目（照題庫順序），不用掃整個題庫
+    for q in QUESTION_INDEX.get_many(qids if qids is not None else list(answers.keys())):
         qid = q["id"]
-        if qid in request.form:
-            user_answer = request.form.get(qid)
-            correct_answer = q["answer"]
-            is_correct = (user_answer == correct_answer)
-            if is_correct:
-                score += 1
-
-            details.append({
-                "id": qid,
-                "text": q["text"],
-                "user_answer": user_answer if user_answer else "（未作答）",
-                "correct_answer": correct_answer,
-                "correct": is_correct,
-                "explanation": q["explanation"]
-            })
-
-    total_questions = len(details)
-
-        # ===== 寫入 quiz_results.xlsx（每列 = 一人一次作答） =====
-    wb_r = load_workbook(RESULT_FILE)
-    ws_r = wb_r["Results"]
-    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    # 先計算這個學生是第幾次作答
-    attempt_count = 0
-    for row in ws_r.iter_rows(min_row=2, values_only=True):
-        acc_in_row = row[1]  # 第2欄是「帳號」
-        if acc_in_row == account:
-            attempt_count += 1
-    attempt_no = attempt_count + 1  # 這次是第幾次作答
-
-    # 先把這次作答的結果整理成 dict，方便填到對應欄位
-    answer_map = {}  # key: 題目ID -> (答案字串, 是否正確)
-    for d in details:
-        answer_map[d["id"]] = (d["user_answer"], "O" if d["correct"] else "X")
-
-    # 組一整列資料
-    row_values = [
-        now_str,       # 時間
-        account,       # 帳號
-        name,          # 姓名
-        attempt_no,    # 作答次數
-        score          # 本次分數
-    ]
 
-    # 依照 QUESTION_BANK 的順序，把每題填進去
-    for q in QUESTION_BANK:
-        qid = q["id"]
-        if qid in answer_map:
-            ans, mark = answer_map[qid]
+        user_answer = answers.get(qid)
+        if is_numeric(q):
+            variant = variants.get(qid)
+            if variant is not None and "answer" not in variant:
+                try:
+                    variant = VARIANTS.restore(q, variant["values"])
+                except (KeyError, ValueError) as e:
+                    # 出題後老師改了這題的變數：這組數字已經算不出答案
+                    print(f"⚠️ {qid} 的變數值和目前的題目對不上，無法批改：", e)
+                    variant = None
+            if variant is None:
+                details.append({
+                    "id": qid,
+                    "text": q["text"],
+                    "user_answer": user_answer if user_answer else "（未作答）",
+                    "correct_answer": "（找不到出題時的數字，這題無法批改、不計分）",
+                    "correct": False,
+                    "ungradable": True,
+                    "explanation": "",
+                })
+                continue
+            q = VARIANTS.instantiate(q, variant)
+            is_correct = VARIANTS.check(q, variant, user_answer)
         else:
-            ans, mark = "", ""  # 這次沒出到的題目留空
-        row_values.append(ans)
-        row_values.append(mark)
+            is_correct = (user_answer == q["answer"])
+        correct_answer = q["answer"]
+        if is_correct:
+            score += 1
 
-    ws_r.append(row_values)
-    wb_r.save(RESULT_FILE)
-    
+        details.append({
+            "id": qid,
+            "text": q["text"],
+            "user_answer": user_answer if user_answer else "（未作答）",
+            "correct_answer": correct_answer,
+            "correct": is_correct,
+            "explanation": q["explanation"]
+        })
 
-    # ===== 同步一份到 Google 試算表 =====
-    try:
-        sheet = get_google_sheet()
-        sheet.append_row(row_values)
-    except Exception as e:
-        # 不讓學生看到錯誤，只在伺服器印出來方便你除錯
-        print("寫入 Google Sheet 失敗：", e)
+    return score, details
+
+
+def graded_count(details):
+    """計分的題數（無法批改的數值題不算）。"""
+    return sum(1 for d in details if not d.get("ungradable"))
+
+
+def record_attempt(account, name, score, details, attempt_id=None):
+    """把一次作答寫進作答紀錄、同步 Google 試算表並更新總積分；回傳新的總積分。
+
+    attempt_id（交卷 API 的作答編號）會和作答紀錄一起寫入，交卷前用 STORAGE.has_attempt 檢查。
+    """
+    now = datetime.now()
+    now_str = now.strftime("%Y-%m-%d %H:%M:%S")
+
+    # 先計算這個學生是第幾次作答（封存的舊月份也要算）
+    attempt_no = STORAGE.count_attempts(account) + ARCHIVE.account_totals(account)["attempts"] + 1
+
+    record = {
+        "time": now_str,
+        "account": account,
+        "name": name,
+        "attempt_no": attempt_no,
+        "score": score,
+        # 題目ID -> (答案字串, 是否正確)
+        "answers": {
+            d["id"]: (d["user_answer"], "O" if d["correct"] else "X") for d in details if not d.get("ungradable")
+        },
+    }
+    if attempt_id:
+        record["attempt_id"] = attempt_id
+    STORAGE.append_result(record)
 
+    # 錯題變了：替這個學生預做的錯題 / 適性考卷作廢重做
+    QUIZ_POOL.refresh(account)
+
+    # ===== 同步一份到 Google 試算表（依題庫的順序展開成一列，背景批次送出） =====
+    SHEET_MIRROR.append_row(record_to_row(record, QUESTION_INDEX.ids()))
 
     # 更新使用者總積分
-    wb_u, ws_u, row_idx = get_user_row(account)
-    new_total_points = None
-    if row_idx is not None:
-        total_cell = ws_u.cell(row=row_idx, column=4)  # 第4欄是「總積分」
-        current_total = total_cell.value or 0
-        total_cell.value = current_total + score
-        new_total_points = total_cell.value
-        wb_u.save(USERS_FILE)
-    else:
-        # 理論上不會發生，如果 users.xlsx 沒這個人
+    new_total_points = STORAGE.add_points(account, score)
+    if new_total_points is None:
+        # 理論上不會發生，如果帳號資料沒這個人
         new_total_points = score
 
+    # 累積夠多新作答時，IRT 在背景重新校準
+    IRT_REFRESHER.note_result()
+
+    # 今日 / 本週 / 本學期排行各加一次（失敗不影響交卷，之後可用 leaderboards.py rebuild 補）
+    try:
+        WINDOW_BOARDS.record(account, score, now)
+    except Exception as e:
+        print("⚠️ 更新時段排行失敗：", e)
+
+    # 通知老師的即時看板
+    try:
+        EVENTS.publish("submission", {
+            "time": now_str,
+            "account": account,
+            "name": name,
+            "attempt_no": attempt_no,
+            "score": score,
+            "correct": sum(1 for d in details if d["correct"]),
+            "questions": graded_count(details),
+            "total_points": new_total_points,
+        })
+    except Exception as e:
+        print("⚠️ 發送交卷事件失敗：", e)
+
+    return new_total_points
+
+
+@app.route("/submit", methods=["POST"])
+def submit():
+    if "user_account" not in session:
+        return redirect(url_for("login"))
+
+    session["logged_in"] = True  # 🔹保證側邊欄顯示
+    
+    account = session["user_account"]
+    name = session["user_name"]
+
+    count_today_attempt()
+
+    # 這份考卷出題時的數字（依表單帶回來的 paper_id 找；找不到的數值題會標成無法批改）
+    papers = dict(session.get("variants") or {})
+    paper = papers.pop(request.form.get("paper_id", ""), None)
+    session["variants"] = papers
+    variants = paper["q"] if isinstance(paper, dict) and "q" in paper else None
+
+    # 只批改表單裡有出現的題目 id
+    answers = {k: v for k, v in request.form.items() if k != "paper_id"}
+    score, details = grade_answers(answers, variants=variants)
+    total_questions = graded_count(details)
+
+    new_total_points = record_attempt(account, name, score, details)
     session["total_points"] = new_total_points
 
     # 計算該生排名
@@ -961,10 +1361,186 @@ def submit():
     )
 
 
-def _build_qid_meta():
-    """把題庫轉成 {qid: {text, answer, explanation}} 方便查表。"""
-    return {q["id"]: {"text": q["text"], "answer": q["answer"], "explanation": q.get("explanation", "")}
-            for q in QUESTION_BANK}
+# ===== JSON 作答 API（瀏覽器產生考卷 + 作答自動暫存） =====
+AUTOSAVE = AutosaveBuffer()
+
+
+def _api_error(msg, status):
+    return jsonify({"error": msg}), status
+
+
+def _load_own_attempt(attempt_id):
+    """讀出這位學生自己的作答暫存；回傳 (state, 錯誤回應)。"""
+    if "user_account" not in session:
+        return None, _api_error("請先登入。", 401)
+    if not AUTOSAVE.valid_id(attempt_id):
+        return None, _api_error("找不到這份考卷。", 404)
+    state = AUTOSAVE.load(attempt_id)
+    if state is None or state["account"] != session["user_account"]:
+        return None, _api_error("找不到這份考卷。", 404)
+    return state, None
+
+
+def _paper_for_view(layout):
+    """依暫存的題目順序 / 選項排列組回考卷（不含答案和詳解）。"""
+    return [
+        _question_for_view(VARIANTS.instantiate(
+            dict(QUESTION_INDEX.get(item["id"]), options=item["options"]), item.get("variant")))
+        for item in layout if QUESTION_INDEX.get(item["id"])
+    ]
+
+
+def _question_for_view(q):
+    """給瀏覽器的題目（不含答案）；*_html 是公式換成圖檔後的版本。"""
+    options = list(q.get("options") or [])
+    return {
+        "id": q["id"],
+        "text": q["text"],
+        "text_html": str(math_filter(q["text"])),
+        "options": options,
+        "options_html": [str(math_filter(o)) for o in options],
+        "kind": q.get("kind", "choice"),
+        "unit": q.get("unit", ""),
+    }
+
+
+def _detail_for_view(d, show_explanation):
+    """批改結果給瀏覽器；*_html 是公式換成圖檔後的版本（和表單交卷的結果頁一樣，其餘文字已跳脫）。"""
+    explanation = d["explanation"] if show_explanation else ""
+    return dict(
+        d,
+        explanation=explanation,
+        text_html=str(math_filter(d["text"])),
+        user_answer_html=str(math_filter(d["user_answer"])),
+        correct_answer_html=str(math_filter(d["correct_answer"])),
+        explanation_html=str(math_filter(explanation)),
+    )
+
+
+@app.route("/api/quiz/paper", methods=["POST"])
+def api_quiz_paper():
+    """開一份新考卷，回傳題目 JSON 與 attempt_id。"""
+    if "user_account" not in session:
+        return _api_error("請先登入。", 401)
+
+    limit_msg = check_daily_limit()
+    if limit_msg:
+        return _api_error(limit_msg, 403)
+
+    paper = QUIZ_POOL.pop(session["user_account"], rng=request_rng())
+    if not paper:
+        return _api_error("⚠️ 沒有可用的題目。", 404)
+
+    attempt_id = AUTOSAVE.start(session["user_account"], paper)
+    return jsonify({
+        "attempt_id": attempt_id,
+        "time_limit_seconds": SETTINGS.get("time_limit_seconds", 0),
+        "questions": [_question_for_view(q) for q in paper],
+    })
+
+
+@app.route("/api/quiz/<attempt_id>", methods=["GET"])
+def api_quiz_attempt(attempt_id):
+    """斷線 / 重整後接回作答：回傳考卷、已暫存的答案，交過卷的話連結果一起回傳。"""
+    state, err = _load_own_attempt(attempt_id)
+    if err:
+        return err
+    return jsonify({
+        "attempt_id": attempt_id,
+        "time_limit_seconds": SETTINGS.get("time_limit_seconds", 0),
+        "questions": _paper_for_view(state["paper"]),
+        "answers": state["answers"],
+        "result": state["final"],
+    })
+
+
+@app.route("/api/quiz/<attempt_id>/answers", methods=["PATCH"])
+def api_quiz_autosave(attempt_id):
+    """批次暫存作答：body 為 {"answers": {題目ID: 答案}}，只寫進暫存檔。"""
+    state, err = _load_own_attempt(attempt_id)
+    if err:
+        return err
+    if state["final"] is not None:
+        return _api_error("這份考卷已經交卷。", 409)
+
+    data = request.get_json(silent=True) or {}
+    qids = {item["id"] for item in state["paper"]}
+    answers = {str(k): str(v) for k, v in (data.get("answers") or {}).items() if k in qids}
+    if answers:
+        AUTOSAVE.save(attempt_id, answers)
+    return jsonify({"saved": len(answers)})
+
+
+@app.route("/api/quiz/<attempt_id>/finalize", methods=["POST"])
+def api_quiz_finalize(attempt_id):
+    """交卷：合併暫存答案後批改並寫入成績。重複呼叫只會回傳同一份結果。"""
+    state, err = _load_own_attempt(attempt_id)
+    if err:
+        return err
+    if state["final"] is not None:
+        return jsonify(state["final"])
+
+    # 最後一批還沒暫存的答案可以跟著交卷一起送
+    data = request.get_json(silent=True) or {}
+    qids = [item["id"] for item in state["paper"]]
+    last = {str(k): str(v) for k, v in (data.get("answers") or {}).items() if k in qids}
+    if last:
+        AUTOSAVE.save(attempt_id, last)
+        state["answers"].update(last)
+
+    if not AUTOSAVE.claim_final(attempt_id):
+        # 另一個請求（例如時間到自動交卷 + 學生按送出）正在批改：不在這裡等（會佔著批改的名額），請瀏覽器稍後再問
+        resp = jsonify({"error": "交卷處理中，請稍候。"})
+        resp.status_code = 202
+        resp.headers["Retry-After"] = "2"
+        return resp
+
+    account = session["user_account"]
+    name = session["user_name"]
+
+    # 拿到交卷權利之後：批改或寫成績失敗要把權利還回去，不然這份考卷之後再也交不了
+    try:
+        state = AUTOSAVE.load(attempt_id)
+        if state["final"] is not None:
+            AUTOSAVE.release_final(attempt_id)
+            return jsonify(state["final"])
+        variants = {item["id"]: item["variant"] for item in state["paper"] if "variant" in item}
+        score, details = grade_answers(state["answers"], qids=set(qids), variants=variants)
+        # 上一個拿到權利的請求可能寫完成績就掛了（權利過期才輪到這裡）：成績已經在了就只補結果，不再記一次
+        recorded = STORAGE.has_attempt(attempt_id)
+        if recorded:
+            user = STORAGE.get_user(account)
+            new_total_points = user["total_points"] if user else score
+        else:
+            new_total_points = record_attempt(account, name, score, details, attempt_id=attempt_id)
+    except Exception as e:
+        AUTOSAVE.release_final(attempt_id)
+        print("❌ 交卷批改失敗：", e)
+        return _api_error("交卷失敗，請再按一次交卷。", 500)
+
+    if not recorded:
+        count_today_attempt()
+    session["total_points"] = new_total_points
+    try:
+        rank, total_users = get_user_rank(account)
+    except Exception as e:
+        # 成績已經寫進去了，排名算不出來也要把結果交回去
+        print("⚠️ 計算排名失敗：", e)
+        rank, total_users = None, None
+
+    show_explanation = SETTINGS.get("show_explanation", True)
+    result = {
+        "score": score,
+        "total": graded_count(details),
+        "total_points": new_total_points,
+        "rank": rank,
+        "total_users": total_users,
+        "level": get_level(new_total_points),
+        "details": [_detail_for_view(d, show_explanation) for d in details],
+    }
+    AUTOSAVE.finish(attempt_id, result)
+    return jsonify(result)
+
 
 @app.route("/review")
 def review():
@@ -974,41 +1550,18 @@ def review():
     account = session["user_account"]
     name = session.get("user_name", account)
 
-    # 開啟成績檔
-    wb_r = load_workbook(RESULT_FILE)
-    ws_r = wb_r["Results"]
-
-    # 讀標題列，找出各題「答案欄」與「對錯欄」的索引
-    headers = [cell.value for cell in ws_r[1]]
-    # 結構：時間, 帳號, 姓名, 作答次數, 本次分數, q1_答案, q1_是否正確, q2_答案, q2_是否正確, ...
-    q_cols = {}  # qid -> (ans_idx, mark_idx)
-    for i in range(5, len(headers), 2):  # 從第6欄(索引5)開始，每兩欄一題
-        if i + 1 < len(headers):
-            ans_h = headers[i]
-            mark_h = headers[i + 1]
-            # 期望欄名像 "q1_答案", "q1_是否正確"
-            if ans_h and "_答案" in ans_h:
-                qid = ans_h.split("_答案")[0]
-                q_cols[qid] = (i, i + 1)
-
-    qmeta = _build_qid_meta()
-
     # 蒐集「該生所有作答中答錯的題目」：統計錯題次數 & 最近一次錯誤
     wrong_map = {}  # qid -> {count, last_time, last_user_answer}
-    for row in ws_r.iter_rows(min_row=2, values_only=True):
-        if row[1] != account:
-            continue
+    for rec in iter_account_results(account):
         # 時間字串
-        tstr = row[0]
+        tstr = rec["time"]
         try:
             tval = datetime.strptime(tstr, "%Y-%m-%d %H:%M:%S")
         except Exception:
             tval = None
 
-        for qid, (ai, mi) in q_cols.items():
-            mark = row[mi]  # "O" 或 "X" 或空
+        for qid, (user_ans, mark) in rec["answers"].items():
             if mark == "X":
-                user_ans = row[ai]
                 info = wrong_map.get(qid, {"count": 0, "last_time": None, "last_user_answer": ""})
                 info["count"] += 1
                 # 更新最近一次錯誤
@@ -1020,7 +1573,7 @@ def review():
     # 組成模板要用的清單
     wrong_list = []
     for qid, info in wrong_map.items():
-        mm = qmeta.get(qid, {"text": f"{qid}（題庫已移除或未載入）", "answer": "", "explanation": ""})
+        mm = QUESTION_INDEX.get(qid) or {"text": f"{qid}（題庫已移除或未載入）", "answer": "", "explanation": ""}
         wrong_list.append({
             "id": qid,
             "text": mm["text"],
@@ -1043,8 +1596,7 @@ RUNNING_IN_RENDER = os.environ.get("RENDER") is not None
 
 if __name__ == "__main__":
     if not RUNNING_IN_RENDER:  # 本機才會初始化
-        init_users_excel()
-        init_results_excel()
+        init_storage()
 
     app.run(host="0.0.0.0", port=5000, debug=True)
 
@@ -0,0 +1,242 @@
+"""作答紀錄封存：把舊月份的作答搬出 STORAGE，壓成唯讀的 gzip JSONL。
+
+quiz_results.xlsx 只會越來越大，每個讀作答的頁面都要把全部歷史讀一遍。
+這裡按月份分區：目前的月份留在 STORAGE（熱資料），更早的月份封存到
+  archive/results-2025-09.jsonl.gz   （一行一筆作答，JSON）
+  archive/manifest.json              （每個分區的筆數、時間範圍，以及每位學生的彙總）
+學生首頁、後台的「總作答次數 / 平均分」用 manifest 的彙總補上封存的部分，不用打開封存檔；
+錯題、積分紀錄要逐筆看的頁面用 account_results，只打開 manifest 記錄該生有作答的分區；
+老師要查舊作答時再到「封存查詢」頁打開單一分區。
+
+每月跑一次（或排程）：
+  python archive.py rollover                  # 封存本月以前的作答
+  python archive.py rollover --keep-months 3  # 保留最近 3 個月（含本月）
+  python archive.py rollover --dry-run        # 只列出會搬哪些月份
+"""
+import gzip
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import date
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ARCHIVE_DIR = os.environ.get("QUIZ_ARCHIVE_DIR", os.path.join(BASE_DIR, "archive"))
+ACCOUNT_CACHE_SIZE = 64   # 每個 worker 記住最近幾位學生的封存作答（封存檔不會變，manifest 換了才重讀）
+
+
+def partition_of(time_str):
+    """作答時間 -> 分區名稱（YYYY-MM）。"""
+    return str(time_str)[:7]
+
+
+def cutoff_for(keep_months, today=None):
+    """保留最近 keep_months 個月（含本月）：回傳第一個要保留的月份的 1 號（YYYY-MM-DD）。"""
+    today = today or date.today()
+    months = today.year * 12 + today.month - 1 - (max(1, keep_months) - 1)
+    return f"{months // 12:04d}-{months % 12 + 1:02d}-01"
+
+
+def _record_key(rec):
+    return (rec["account"], str(rec["attempt_no"]), str(rec["time"]))
+
+
+def _summarize(records):
+    """一個分區的 manifest 內容（每位學生：作答次數、總分、最高分、最後作答時間）。"""
+    accounts = {}
+    for rec in records:
+        score = int(rec.get("score") or 0)
+        a = accounts.setdefault(rec["account"], {"attempts": 0, "points": 0, "best": None, "last_time": ""})
+        a["attempts"] += 1
+        a["points"] += score
+        a["best"] = score if a["best"] is None else max(a["best"], score)
+        a["last_time"] = max(a["last_time"], str(rec["time"]))
+    times = [str(r["time"]) for r in records]
+    return {
+        "records": len(records),
+        "first_time": min(times) if times else None,
+        "last_time": max(times) if times else None,
+        "accounts": accounts,
+    }
+
+
+class ResultArchive:
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._manifest = None
+        self._manifest_key = None
+        self._totals = None
+        self._accounts = OrderedDict()   # account -> 封存的作答 tuple（最近用過的在後面）
+
+    # ===== 檔案 =====
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, "manifest.json")
+
+    def file_name(self, partition):
+        return f"results-{partition}.jsonl.gz"
+
+    def path_of(self, partition):
+        return os.path.join(self.directory, self.file_name(partition))
+
+    def manifest(self):
+        """manifest.json 的內容（檔案沒變就用記憶體裡的）。"""
+        try:
+            st = os.stat(self.manifest_path)
+            key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            key = None
+        with self._lock:
+            if key != self._manifest_key or self._manifest is None:
+                data = {"partitions": {}}
+                if key is not None:
+                    try:
+                        with open(self.manifest_path, "r", encoding="utf-8") as f:
+                            data = json.load(f)
+                    except (OSError, ValueError) as e:
+                        print("⚠️ 讀取封存 manifest 失敗：", e)
+                self._manifest, self._manifest_key, self._totals = data, key, None
+                self._accounts.clear()
+            return self._manifest
+
+    def _write_manifest(self, data):
+        tmp = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp, self.manifest_path)
+
+    def partitions(self):
+        """[(分區, manifest 資訊), ...]，新的在前。"""
+        parts = self.manifest().get("partitions", {})
+        return sorted(parts.items(), reverse=True)
+
+    # ===== 讀 =====
+
+    def iter_results(self, partition=None, account=None):
+        """逐筆讀封存的作答（不給 partition 就從最舊的分區讀到最新的）。"""
+        names = [partition] if partition else sorted(self.manifest().get("partitions", {}))
+        for name in names:
+            try:
+                f = gzip.open(self.path_of(name), "rt", encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            with f:
+                for line in f:
+                    rec = json.loads(line)
+                    if account is not None and rec["account"] != account:
+                        continue
+                    rec["answers"] = {k: tuple(v) for k, v in rec.get("answers", {}).items()}
+                    yield rec
+
+    def account_results(self, account):
+        """該生封存的全部作答（由舊到新，唯讀 tuple）；只打開 manifest 記錄他有作答的分區。"""
+        manifest = self.manifest()
+        with self._lock:
+            cached = self._accounts.get(account)
+            if cached is not None:
+                self._accounts.move_to_end(account)
+                return cached
+        names = [name for name, info in sorted(manifest.get("partitions", {}).items())
+                 if account in info.get("accounts", {})]
+        records = tuple(rec for name in names for rec in self.iter_results(name, account=account))
+        with self._lock:
+            if self._manifest is manifest:   # 讀的途中 manifest 換過就不放進快取
+                self._accounts[account] = records
+                while len(self._accounts) > ACCOUNT_CACHE_SIZE:
+                    self._accounts.popitem(last=False)
+        return records
+
+    def account_totals(self, account):
+        """封存部分的彙總：{"attempts", "points", "best"}（只讀 manifest）。"""
+        manifest = self.manifest()
+        with self._lock:
+            if self._totals is None:
+                totals = {}
+                for info in manifest.get("partitions", {}).values():
+                    for acc, a in info.get("accounts", {}).items():
+                        t = totals.setdefault(acc, {"attempts": 0, "points": 0, "best": None})
+                        t["attempts"] += a["attempts"]
+                        t["points"] += a["points"]
+                        if a["best"] is not None:
+                            t["best"] = a["best"] if t["best"] is None else max(t["best"], a["best"])
+                self._totals = totals
+            return self._totals.get(account, {"attempts": 0, "points": 0, "best": None})
+
+    # ===== 寫 =====
+
+    def _write_partition(self, partition, records):
+        path = self.path_of(partition)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=9) as f:
+            for rec in records:
+                f.write(json.dumps(dict(rec, answers=dict(rec.get("answers") or {})), ensure_ascii=False))
+                f.write("\n")
+        os.chmod(tmp, 0o444)   # 封存檔唯讀；之後要補資料是整個換檔
+        os.replace(tmp, path)
+        return os.path.getsize(path)
+
+    def add(self, records):
+        """把作答併進各自的分區（已經封存過的同一筆會略過）；回傳 {分區: 新增筆數}。"""
+        by_partition = defaultdict(list)
+        for rec in records:
+            by_partition[partition_of(rec["time"])].append(rec)
+        if not by_partition:
+            return {}
+
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = json.loads(json.dumps(self.manifest()))
+        added = {}
+        for partition, new in sorted(by_partition.items()):
+            existing = list(self.iter_results(partition)) if partition in manifest["partitions"] else []
+            seen = {_record_key(r) for r in existing}
+            fresh = [r for r in new if _record_key(r) not in seen]
+            if not fresh:
+                continue
+            merged = sorted(existing + fresh, key=lambda r: str(r["time"]))
+            size = self._write_partition(partition, merged)
+            manifest["partitions"][partition] = dict(
+                _summarize(merged), file=self.file_name(partition), bytes=size)
+            added[partition] = len(fresh)
+        self._write_manifest(manifest)
+        return added
+
+
+def rollover(storage, archive, keep_months=1, dry_run=False):
+    """把 cutoff 以前的作答搬進封存；先寫封存檔再刪 STORAGE（中途失敗重跑也不會重複）。
+
+    回傳 (cutoff, {分區: 筆數}, 從 STORAGE 刪掉的筆數)。
+    """
+    cutoff = cutoff_for(keep_months)
+    old = [rec for rec in storage.iter_results() if str(rec["time"]) < cutoff]
+    if dry_run:
+        counts = defaultdict(int)
+        for rec in old:
+            counts[partition_of(rec["time"])] += 1
+        return cutoff, dict(counts), 0
+    added = archive.add(old)
+    removed = storage.delete_results_before(cutoff) if old else 0
+    return cutoff, added, removed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    sys.path.insert(0, BASE_DIR)
+    from storage import open_storage
+
+    parser = argparse.ArgumentParser(description="作答紀錄封存（按月份分區）")
+    parser.add_argument("command", choices=["rollover"])
+    parser.add_argument("--keep-months", type=int, default=1, help="STORAGE 保留最近幾個月（含本月）")
+    parser.add_argument("--dry-run", action="store_true", help="只列出會封存哪些月份")
+    args = parser.parse_args()
+
+    cutoff, added, removed = rollover(open_storage(), ResultArchive(), args.keep_months, args.dry_run)
+    if not added:
+        print(f"✅ {cutoff} 以前沒有需要封存的作答")
+    for partition, n in sorted(added.items()):
+        print(f"{'🧾 會封存' if args.dry_run else '✅ 已封存'} {partition}：{n} 筆")
+    if removed:
+        print(f"🧾 已從 STORAGE 移除 {removed} 筆（{cutoff} 以前）")
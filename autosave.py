@@ -0,0 +1,172 @@
+import json
+import os
+import re
+import time
+import uuid
+
+
+AUTOSAVE_DIR = os.environ.get(
+    "QUIZ_AUTOSAVE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "autosave"),
+)
+
+_ATTEMPT_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+# 交卷權利最多佔幾秒：批改到一半 worker 被砍掉（來不及還）的話，過了這個時間下一個請求可以接手
+FINAL_CLAIM_TIMEOUT = 120
+
+# 暫存檔最後一次寫入超過這麼久就刪掉（交完卷的結果、放棄沒交的考卷都一樣）；每個 worker 最多每小時清一次
+KEEP_SECONDS = int(os.environ.get("QUIZ_AUTOSAVE_KEEP_DAYS", "3")) * 24 * 3600
+CLEANUP_INTERVAL = 3600
+
+
+class AutosaveBuffer:
+    """作答暫存：每次作答一個 JSONL 檔，只往後 append，不碰成績 Excel。
+
+    每行是一個事件：
+      {"type": "start", "account": ..., "paper": [{"id", "options", "variant"?}, ...], "ts": ...}
+      {"type": "save",  "answers": {qid: 答案}, "ts": ...}
+      {"type": "final", "result": {...}, "ts": ...}
+    """
+
+    def __init__(self, directory=AUTOSAVE_DIR, keep_seconds=KEEP_SECONDS):
+        self.directory = directory
+        self.keep_seconds = keep_seconds
+        self._last_cleanup = 0.0
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def valid_id(attempt_id):
+        return bool(_ATTEMPT_ID_RE.match(attempt_id or ""))
+
+    def _path(self, attempt_id):
+        return os.path.join(self.directory, f"{attempt_id}.jsonl")
+
+    def _append(self, attempt_id, event):
+        event["ts"] = time.time()
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        # O_APPEND：多個 worker 同時寫也不會互相蓋掉（一行一次 write）
+        fd = os.open(self._path(attempt_id), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    def start(self, account, paper):
+        """開一份新的作答；記下題目順序、選項排列和參數化題目的數字，斷線重整後才能原樣接回去。"""
+        self._maybe_cleanup()
+        attempt_id = uuid.uuid4().hex
+        layout = []
+        for q in paper:
+            item = {"id": q["id"], "options": list(q.get("options") or [])}
+            if "variant" in q:
+                item["variant"] = q["variant"]
+            layout.append(item)
+        self._append(attempt_id, {"type": "start", "account": account, "paper": layout})
+        return attempt_id
+
+    def save(self, attempt_id, answers):
+        self._append(attempt_id, {"type": "save", "answers": answers})
+
+    def load(self, attempt_id):
+        """重播事件，回傳 {account, paper, answers, final}；找不到回傳 None。"""
+        try:
+            with open(self._path(attempt_id), "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return None
+
+        state = {"account": None, "paper": [], "answers": {}, "final": None}
+        for line in lines:
+            try:
+                ev = json.loads(line)
+            except ValueError:
+                continue  # 斷線時寫到一半的行，直接略過
+            if ev.get("type") == "start":
+                state["account"] = ev.get("account")
+                state["paper"] = ev.get("paper", [])
+            elif ev.get("type") == "save":
+                state["answers"].update(ev.get("answers") or {})
+            elif ev.get("type") == "final":
+                state["final"] = ev.get("result")
+        return state
+
+    def claim_final(self, attempt_id):
+        """搶「交卷」的權利；同一份考卷只有第一個呼叫的人會拿到 True。
+
+        拿到的人批改失敗要呼叫 release_final 還回去；超過 FINAL_CLAIM_TIMEOUT 秒還沒交完的權利視為失效。
+        """
+        marker = self._path(attempt_id) + ".final"
+        for _ in range(2):
+            try:
+                fd = os.open(marker, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                if not self._reclaim_stale(marker):
+                    return False
+                continue
+            os.close(fd)
+            return True
+        return False
+
+    @staticmethod
+    def _reclaim_stale(marker):
+        """把過期的交卷權利改名移走；移走了（或已經不在）回傳 True。"""
+        try:
+            if time.time() - os.stat(marker).st_mtime < FINAL_CLAIM_TIMEOUT:
+                return False
+            # 改名是原子操作，兩個請求同時接手只有一個會成功
+            stale = f"{marker}.{uuid.uuid4().hex}.stale"
+            os.rename(marker, stale)
+        except FileNotFoundError:
+            return True
+        if time.time() - os.stat(stale).st_mtime < FINAL_CLAIM_TIMEOUT:
+            # 剛好搶到別人才建好的新權利：放回去
+            try:
+                os.link(stale, marker)
+            except FileExistsError:
+                pass
+            os.remove(stale)
+            return False
+        os.remove(stale)
+        return True
+
+    def release_final(self, attempt_id):
+        """批改失敗時把交卷權利還回去，之後重送交卷才能再批改一次。"""
+        try:
+            os.remove(self._path(attempt_id) + ".final")
+        except FileNotFoundError:
+            pass
+
+    def finish(self, attempt_id, result):
+        """寫入最後結果；之後重送交卷都直接回傳這份結果，交卷權利的標記檔就用不到了。"""
+        self._append(attempt_id, {"type": "final", "result": result})
+        self.release_final(attempt_id)
+
+    def _maybe_cleanup(self):
+        now = time.time()
+        if now - self._last_cleanup < CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        try:
+            removed = self.cleanup(now)
+        except OSError as e:
+            print("⚠️ 清理作答暫存失敗：", e)
+            return
+        if removed:
+            print(f"🧾 清掉 {removed} 個過期的作答暫存檔")
+
+    def cleanup(self, now=None):
+        """刪掉超過 keep_seconds 沒再寫入的暫存檔、交卷標記和接手時留下的 .stale 檔；回傳刪了幾個。"""
+        cutoff = (now or time.time()) - self.keep_seconds
+        removed = 0
+        for name in os.listdir(self.directory):
+            if not (name.endswith(".jsonl") or name.endswith(".final") or name.endswith(".stale")):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
@@ -0,0 +1,121 @@
+"""流量錄製：把線上的請求記成 JSONL，之後用 tools/replay.py 在本機重播、比較版本快慢。
+
+預設關閉；設定環境變數才會錄：
+  QUIZ_CAPTURE=/tmp/traffic.jsonl gunicorn app:app ...
+
+每個請求一行：
+  {"ts", "pid", "method", "path", "endpoint", "args", "form", "json", "session",
+   "status", "bytes", "ms", "seed"}，開新考卷（api_quiz_paper）再加 "attempt_id"
+  - form / json / session 裡名稱含 password 的欄位一律拿掉（登入、改密碼都不會留下密碼）
+  - session 是「請求開始前」的內容，重播時直接放回 session，不用重新登入
+  - seed 是這個請求的亂數種子；重播時用同一個種子抽題、打亂選項
+  - attempt_id 是回傳給瀏覽器的考卷編號（uuid4，重播時會是另一個），重播時拿來改寫之後的 /api/quiz/<id>/...
+
+重播模式（QUIZ_REPLAY=1，只給 tools/replay.py 用）：請求帶 X-Replay-Seed 標頭時，
+抽題改用以該種子建立的 random.Random（見 request_rng()），同一份錄製檔每次重播抽到的題目都一樣。
+"""
+import json
+import os
+import random
+import threading
+import time
+
+from flask import g, request, session
+
+CAPTURE_FILE = os.environ.get("QUIZ_CAPTURE", "")
+REPLAY_MODE = os.environ.get("QUIZ_REPLAY") == "1"
+REPLAY_SEED_HEADER = "X-Replay-Seed"
+
+# 不錄的 endpoint（靜態檔、公式圖檔、即時看板長連線）
+SKIP_ENDPOINTS = {"static", "formula_svg", "teacher_stream"}
+
+
+def sanitize(value):
+    """拿掉名稱含 password 的欄位（dict 裡一層層往下找）。"""
+    if isinstance(value, dict):
+        return {k: sanitize(v) for k, v in value.items() if "password" not in str(k).lower()}
+    if isinstance(value, (list, tuple)):
+        return [sanitize(v) for v in value]
+    return value
+
+
+def _multi(d):
+    """MultiDict -> {名稱: 值}（同名多個值時是 list）。"""
+    out = {}
+    for k in d:
+        values = d.getlist(k)
+        out[k] = values[0] if len(values) == 1 else values
+    return out
+
+
+def request_rng():
+    """重播模式下回傳這個請求專用的 random.Random；平常回傳 None（照原本的方式抽題）。"""
+    return g.get("replay_rng")
+
+
+class TrafficCapture:
+    def __init__(self, app, path=CAPTURE_FILE, replay=REPLAY_MODE):
+        self.path = path
+        self.replay = replay
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+        if path or replay:
+            app.before_request(self._before)
+        if path:
+            app.after_request(self._after)
+            print(f"🧾 流量錄製中：{path}")
+
+    def _before(self):
+        if request.endpoint in SKIP_ENDPOINTS:
+            return None
+        seed = None
+        if self.replay:
+            raw = request.headers.get(REPLAY_SEED_HEADER)
+            if raw and raw.isdigit():
+                seed = int(raw)
+                g.replay_rng = random.Random(seed)
+        if self.path:
+            g.capture = {
+                "t0": time.perf_counter(),
+                "ts": round(time.time(), 3),
+                "seed": seed if seed is not None else random.getrandbits(32),
+                "session": sanitize(dict(session)),
+            }
+        return None
+
+    def _after(self, response):
+        cap = g.pop("capture", None)
+        if cap is None:
+            return response
+        body = request.get_json(silent=True) if request.is_json else None
+        record = {
+            "ts": cap["ts"],
+            "pid": os.getpid(),
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "args": _multi(request.args),
+            "form": sanitize(_multi(request.form)),
+            "json": sanitize(body) if body is not None else None,
+            "session": cap["session"],
+            "status": response.status_code,
+            "bytes": response.calculate_content_length(),
+            "ms": round((time.perf_counter() - cap["t0"]) * 1000, 2),
+            "seed": cap["seed"],
+        }
+        if request.endpoint == "api_quiz_paper" and response.is_json:
+            record["attempt_id"] = (response.get_json(silent=True) or {}).get("attempt_id")
+        try:
+            self._write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            print("⚠️ 流量錄製寫入失敗：", e)
+        return response
+
+    def _write(self, line):
+        # 各 worker 各開一次檔，O_APPEND 一次寫一整行，不會跟別的 worker 交錯
+        with self._lock:
+            if self._fd is None or self._pid != os.getpid():
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                self._pid = os.getpid()
+            os.write(self._fd, line.encode("utf-8"))
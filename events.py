@@ -0,0 +1,217 @@
+"""老師即時看板：交卷事件用 server-sent events（SSE）推到老師首頁，不用一直重新整理。
+
+兩層：
+  EventBus        一個 worker 裡的 pub-sub。事件只編碼成 SSE 文字一次，放進環狀緩衝區，
+                  所有觀看者共用同一份 bytes；發佈時 notify_all 一次叫醒大家，
+                  每個觀看者只記得自己讀到第幾筆（斷線重連帶 Last-Event-ID 就從那裡接著送）。
+  SharedEventLog  跨 gunicorn worker：交卷的 worker 把事件 append 到共用事件檔（一行一筆 JSON），
+                  每個 worker 有一條背景執行緒跟著讀（tail），讀到就丟進自己的 EventBus。
+                  事件 id 用「檔案 inode-位移」，哪個 worker 重連都對得上。
+
+事件檔超過 MAX_FILE_BYTES 就換新檔（舊檔改名 .1），正在讀舊檔的 worker 讀完再跳到新檔。
+"""
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+try:
+    import fcntl  # Windows 沒有，就只用執行緒鎖
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+RING_SIZE = 500             # 每個 worker 記住最近幾筆事件（重連補送用）
+BACKLOG = 20                # 新開的看板先補送最近幾筆
+HEARTBEAT = 15.0            # 幾秒沒事件就送一行註解，順便偵測瀏覽器斷線
+STREAM_LIFETIME = 300.0     # 一條連線最多開幾秒，之後讓瀏覽器自動重連（釋放 worker 執行緒）
+RETRY_MS = 3000             # 告訴瀏覽器斷線後幾毫秒重連
+POLL_INTERVAL = 0.2         # tail 事件檔的間隔（秒）
+MAX_FILE_BYTES = 1 << 20    # 事件檔超過 1 MB 就換新檔
+REPLAY_BYTES = 64 * 1024    # worker 剛啟動時從事件檔尾端往回讀多少（補齊 backlog）
+
+
+def encode_sse(event_id, kind, data):
+    """一筆事件 -> SSE 文字（bytes）。data 是 dict，轉成單行 JSON。"""
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return f"id: {event_id}\nevent: {kind}\ndata: {body}\n\n".encode("utf-8")
+
+
+class EventBus:
+    def __init__(self, size=RING_SIZE):
+        self._cond = threading.Condition()
+        self._ring = deque(maxlen=size)   # (序號, 事件 id, SSE bytes)
+        self._seq = 0
+        self._viewers = 0
+
+    @property
+    def viewers(self):
+        return self._viewers
+
+    def publish(self, event_id, kind, data):
+        payload = encode_sse(event_id, kind, data)
+        with self._cond:
+            self._seq += 1
+            self._ring.append((self._seq, event_id, payload))
+            self._cond.notify_all()
+
+    def _start_seq(self, last_event_id, backlog):
+        """從哪個序號之後開始送（呼叫時要拿著鎖）。"""
+        if last_event_id:
+            for seq, event_id, _ in reversed(self._ring):
+                if event_id == last_event_id:
+                    return seq
+            # 找不到（太久沒連或換了 worker 且已被擠出緩衝區）：只能從現在開始
+            return self._seq
+        return max(self._seq - backlog, self._ring[0][0] - 1 if self._ring else 0)
+
+    def _pending(self, cursor):
+        """序號 > cursor 的事件（呼叫時要拿著鎖）；落後太多被擠出緩衝區就回傳 None。"""
+        if not self._ring or cursor >= self._seq:
+            return []
+        first = self._ring[0][0]
+        if cursor < first - 1:
+            return None
+        return [p for _, _, p in itertools.islice(self._ring, cursor - first + 1, None)]
+
+    def listen(self, last_event_id=None, backlog=BACKLOG, heartbeat=HEARTBEAT, lifetime=STREAM_LIFETIME):
+        """SSE 串流產生器：給 Flask Response 用。"""
+        with self._cond:
+            self._viewers += 1
+            cursor = self._start_seq(last_event_id, backlog)
+        deadline = time.monotonic() + lifetime
+        try:
+            yield f"retry: {RETRY_MS}\n\n".encode("ascii")
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                with self._cond:
+                    self._cond.wait_for(lambda: self._seq > cursor, timeout=min(heartbeat, remaining))
+                    items = self._pending(cursor)
+                    cursor = self._seq
+                if items is None:
+                    # 太慢跟不上：請頁面整個重新載入
+                    yield b"event: reset\ndata: {}\n\n"
+                elif items:
+                    yield b"".join(items)
+                else:
+                    yield b": ping\n\n"
+        finally:
+            with self._cond:
+                self._viewers -= 1
+
+
+class SharedEventLog:
+    """跨 worker 的事件：寫進共用事件檔，各 worker 的 tail 執行緒讀回來丟進自己的 EventBus。"""
+
+    def __init__(self, path, bus=None):
+        self.path = path
+        self.bus = bus or EventBus()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    # ===== 發佈 =====
+
+    def publish(self, kind, data):
+        line = (json.dumps({"kind": kind, "data": data}, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            fd = self._open_locked()
+            try:
+                if os.fstat(fd).st_size + len(line) > MAX_FILE_BYTES:
+                    os.replace(self.path, self.path + ".1")
+                    os.close(fd)
+                    fd = self._open_locked()
+                os.write(fd, line)
+            finally:
+                os.close(fd)   # 關檔時 flock 一起放掉
+        self.ensure_started()
+
+    def _open_locked(self):
+        """開事件檔並拿 flock；拿到鎖時檔案已被別的 worker 換掉的話，重開新的那個。"""
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            if fcntl is None:
+                return fd
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    # ===== 訂閱 =====
+
+    def listen(self, last_event_id=None, **kwargs):
+        self.ensure_started()
+        return self.bus.listen(last_event_id, **kwargs)
+
+    @property
+    def viewers(self):
+        return self.bus.viewers
+
+    # ===== tail 執行緒 =====
+
+    def ensure_started(self):
+        # gunicorn fork 之後執行緒不會跟過去，所以用 pid 判斷要不要重開
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="event-tail", daemon=True)
+            self._thread.start()
+
+    def _open(self):
+        """打開事件檔，從尾端往回 REPLAY_BYTES 開始讀；還沒有檔案回傳 (None, 0)。"""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return None, 0
+        size = os.fstat(f.fileno()).st_size
+        if size > REPLAY_BYTES:
+            f.seek(size - REPLAY_BYTES)
+            f.readline()           # 跳過被切到一半的那一行
+        return f, f.tell()
+
+    def _run(self):
+        f, pos = self._open()
+        buf = b""
+        while True:
+            try:
+                if f is None:
+                    time.sleep(POLL_INTERVAL)
+                    f, pos = self._open()
+                    continue
+                chunk = f.read()
+                if chunk:
+                    buf += chunk
+                    ino = os.fstat(f.fileno()).st_ino
+                    while b"\n" in buf:
+                        line, buf = buf.split(b"\n", 1)
+                        event_id = f"{ino:x}-{pos}"
+                        pos += len(line) + 1
+                        try:
+                            event = json.loads(line)
+                        except ValueError:
+                            continue
+                        self.bus.publish(event_id, event["kind"], event["data"])
+                    continue
+                # 沒有新資料：看看是不是換新檔了
+                try:
+                    changed = os.stat(self.path).st_ino != os.fstat(f.fileno()).st_ino
+                except FileNotFoundError:
+                    changed = False
+                if changed:
+                    f.close()
+                    f, pos = self._open()
+                    buf = b""
+                    continue
+                time.sleep(POLL_INTERVAL)
+            except Exception as e:
+                print("⚠️ 讀取即時事件檔失敗：", e)
+                time.sleep(1.0)
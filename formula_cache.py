@@ -0,0 +1,148 @@
+"""物理公式預先算圖：把題庫裡的 LaTeX 公式先轉成 SVG 存起來，頁面直接引用圖檔。
+
+題目、選項、詳解裡用 $...$ 或 \\(...\\) 包起來的就是公式，例如：
+  物體的平均速度 $v=\\frac{\\Delta x}{\\Delta t}$，單位為 $\\mathrm{m/s}$
+
+離線產生（用 matplotlib 內建的 mathtext 與字型，不需要網路）：
+  python formula_cache.py build
+
+圖檔以「公式內容的雜湊」命名（content-addressed），內容不變檔名就不變，
+所以瀏覽器可以放心長期快取。
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import threading
+
+from markupsafe import Markup, escape
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FORMULA_DIR = os.environ.get("QUIZ_FORMULA_DIR", os.path.join(BASE_DIR, "formula_cache"))
+
+# 改了字型大小 / 算圖方式就改這個版本，舊圖檔自然不會再被引用
+RENDER_VERSION = "mathtext-1"
+FONT_SIZE = 14
+
+_MATH_RE = re.compile(r"\$(.+?)\$|\\\((.+?)\\\)", re.S)
+
+
+def extract_formulas(text):
+    """回傳文字中所有公式（LaTeX 原文，不含 $）。"""
+    return [(m.group(1) or m.group(2)).strip() for m in _MATH_RE.finditer(str(text or ""))]
+
+
+def formula_hash(latex):
+    raw = f"{RENDER_VERSION}|{FONT_SIZE}|{latex.strip()}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:20]
+
+
+def render_svg(latex):
+    """用 matplotlib mathtext 把公式轉成 SVG（字形會轉成路徑，瀏覽器不需要字型）。"""
+    from matplotlib import rcParams
+    from matplotlib.font_manager import FontProperties
+    from matplotlib.mathtext import math_to_image
+
+    rcParams["svg.fonttype"] = "path"
+    buf = io.BytesIO()
+    math_to_image(f"${latex}$", buf, prop=FontProperties(size=FONT_SIZE), format="svg")
+    return buf.getvalue()
+
+
+class FormulaCache:
+    """記住哪些公式已經有圖檔；頁面上用 render() 把文字裡的公式換成 <img>。"""
+
+    def __init__(self, directory=FORMULA_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._known = set()
+        self.refresh()
+
+    def refresh(self):
+        """重新掃一次資料夾（build 完或題庫重新載入後呼叫）。"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            names = []
+        known = {n[:-4] for n in names if n.endswith(".svg")}
+        with self._lock:
+            self._known = known
+
+    def path_of(self, digest):
+        return os.path.join(self.directory, f"{digest}.svg")
+
+    def has(self, digest):
+        return digest in self._known
+
+    def build(self, texts):
+        """把 texts 裡的公式都算成 SVG（已經有的跳過）；回傳 (新產生, 已存在, 失敗清單)。"""
+        os.makedirs(self.directory, exist_ok=True)
+        created = existed = 0
+        failed = []
+        manifest = {}
+        for latex in {f for t in texts for f in extract_formulas(t)}:
+            digest = formula_hash(latex)
+            manifest[digest] = latex
+            path = self.path_of(digest)
+            if os.path.exists(path):
+                existed += 1
+                continue
+            try:
+                svg = render_svg(latex)
+            except Exception as e:
+                failed.append((latex, str(e)))
+                continue
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(svg)
+            os.replace(tmp, path)
+            created += 1
+
+        with open(os.path.join(self.directory, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+        self.refresh()
+        return created, existed, failed
+
+    def render(self, text, url_for_digest):
+        """把文字中的公式換成圖檔 <img>；沒有圖檔的公式就原樣顯示。其餘文字會跳脫。"""
+        text = str(text or "")
+        out = []
+        pos = 0
+        for m in _MATH_RE.finditer(text):
+            out.append(escape(text[pos:m.start()]))
+            latex = (m.group(1) or m.group(2)).strip()
+            digest = formula_hash(latex)
+            if self.has(digest):
+                out.append(Markup('<img class="formula" src="{}" alt="{}" style="vertical-align: middle;">').format(
+                    url_for_digest(digest), latex))
+            else:
+                out.append(escape(m.group(0)))
+            pos = m.end()
+        out.append(escape(text[pos:]))
+        return Markup("").join(out)
+
+
+def question_texts(bank):
+    """題庫中會顯示出來的所有文字：題目、選項、答案、詳解。"""
+    for q in bank:
+        yield q.get("text", "")
+        yield from q.get("options", [])
+        yield q.get("answer", "")
+        yield q.get("explanation", "")
+
+
+if __name__ == "__main__":
+    # 用法：python formula_cache.py build
+    if sys.argv[1:] == ["build"]:
+        from app import load_question_bank
+
+        cache = FormulaCache()
+        created, existed, failed = cache.build(question_texts(load_question_bank()))
+        print(f"✅ 公式圖檔：新產生 {created} 個、已存在 {existed} 個（{cache.directory}）")
+        for latex, err in failed:
+            print(f"⚠️ 公式無法算圖：{latex}（{err}）")
+    else:
+        print("用法：python formula_cache.py build")
@@ -0,0 +1,17 @@
+"""gunicorn 設定（render.yaml 的 startCommand 會帶 --preload）。
+
+--preload 讓 master 先 import app；這裡在 master 開好 worker 之前把題庫共用快取建好，
+fork 出來的 worker 直接用同一份 mmap，不會每個 worker 各讀一次 Excel。
+"""
+from admission import WORKER_THREADS
+
+preload_app = True
+# 執行緒數跟排隊設定共用同一個數字（WEB_THREADS，預設是各類排隊預留的 + 備用 + 看板連線），
+# 排隊的名額才不會超過執行緒
+threads = WORKER_THREADS
+
+
+def when_ready(server):
+    import app
+
+    app.build_shared_caches()
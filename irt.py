@@ -0,0 +1,544 @@
+"""IRT 校準：用全部作答估計每題的難度與每位學生的能力。
+
+get_level() 只看累積積分（寫越多題越高），分不出「會」還是「寫得多」。
+這裡用試題反應理論（IRT）：
+  Rasch（1PL）：P(答對) = σ(θ學生 − b題目)
+  2PL         ：P(答對) = σ(a題目 × (θ學生 − b題目))
+θ 是能力、b 是難度、a 是鑑別度；三者都加上常態先驗（MAP），題目少、作答少也不會發散。
+2PL 每輪把 θ 標準化成平均 0、標準差 1（b、a 跟著換算），尺度才定得住。
+
+做法：把每一筆作答攤平成 (學生, 題目, 對/錯) 三個陣列，用 NumPy 一次算整批的 Newton 步；
+學生很多時把學生分組交給 process pool 平行算（每組同時回傳它對題目參數的梯度，
+主行程加總後更新題目參數）。
+
+增量更新：作答陣列與上次的參數存在 irt_cache.npz，下次只讀新的作答、從上次的解開始迭代，
+幾輪就收斂。結果存到 STORAGE 的文件「irt」，老師首頁與適性抽題都讀它。
+網站裡由 IrtRefresher 在背景執行緒校準：老師按按鈕、或交卷累積一定數量時觸發。
+
+用法：
+  python irt.py refresh                 # 增量更新（第一次會整個算）
+  python irt.py refresh --full          # 全部重算
+  python irt.py refresh --model rasch --workers 4
+"""
+import itertools
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import fcntl  # Windows 沒有，就只擋同一個行程裡的重複校準
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from shared_cache import shared_path
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_FILE = os.environ.get("QUIZ_IRT_CACHE", os.path.join(BASE_DIR, "irt_cache.npz"))
+DOCUMENT = "irt"
+
+# 先驗標準差：θ ~ N(0, 1)、b ~ N(0, 2)、log a ~ N(0, 0.5)
+THETA_SD = 1.0
+B_SD = 2.0
+LOG_A_SD = 0.5
+MAX_STEP = 1.0                 # 每次 Newton 步最多走多遠（避免一開始亂跳）
+PARALLEL_MIN_RESPONSES = 200_000   # 作答筆數超過這個才開 process pool
+AUTO_REFRESH_EVERY = 50        # 這個 worker 累積幾次新交卷就自動校準一次
+AUTO_REFRESH_INTERVAL = 600    # 有新交卷但不到上面的數量時，最多隔幾秒也校準一次
+
+
+def _sigmoid(np, z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+# ===== 一組學生的一步（單機和 process pool 共用） =====
+
+_CHUNKS = None   # process pool 的 worker 各自保存自己那組作答（fork 時帶過去，不用每輪傳）
+
+
+def _init_worker(chunks):
+    global _CHUNKS
+    _CHUNKS = chunks
+
+
+def _chunk_step(chunk, theta, b, log_a, n_items, fit_a):
+    """一組學生：先更新他們的 θ（題目參數固定），再回傳這組對題目參數的梯度與 Hessian
+    （2PL 連 b 和 log a 的交叉項一起，兩者要一起解，分開走會互相拉扯、某些題 a 縮到 0）。
+
+    chunk = (s, i, y)：s 是組內的學生編號（0 起算），i 是題目編號，y 是 0/1。
+    """
+    import numpy as np
+
+    s, i, y = chunk
+    a = np.exp(log_a)
+    ai = a[i]
+
+    # θ：一步 Newton（負 Hessian = Σ a²p(1−p) + 先驗）
+    p = _sigmoid(np, ai * (theta[s] - b[i]))
+    r = y - p
+    w = p * (1 - p)
+    g_t = np.bincount(s, ai * r, minlength=len(theta)) - theta / THETA_SD ** 2
+    h_t = np.bincount(s, ai * ai * w, minlength=len(theta)) + 1 / THETA_SD ** 2
+    theta = theta + np.clip(g_t / h_t, -MAX_STEP, MAX_STEP)
+
+    # 用新的 θ 算題目參數的梯度（先驗由主行程加）
+    d = theta[s] - b[i]
+    p = _sigmoid(np, ai * d)
+    r = y - p
+    w = p * (1 - p)
+    g_b = np.bincount(i, -ai * r, minlength=n_items)
+    h_b = np.bincount(i, ai * ai * w, minlength=n_items)
+    if fit_a:
+        g_a = np.bincount(i, ai * d * r, minlength=n_items)
+        h_a = np.bincount(i, (ai * d) ** 2 * w, minlength=n_items)
+        h_ab = np.bincount(i, -ai * ai * d * w, minlength=n_items)
+    else:
+        g_a = h_a = h_ab = None
+    return theta, h_t, g_b, h_b, g_a, h_a, h_ab
+
+
+def _pool_step(k, theta, b, log_a, n_items, fit_a):
+    return _chunk_step(_CHUNKS[k], theta, b, log_a, n_items, fit_a)
+
+
+# ===== 擬合 =====
+
+def _standardize(np, theta, b, log_a):
+    """2PL 的尺度沒有定錨：θ 縮小、a 放大，a(θ − b) 不變，光靠先驗拉不住（θ 會縮到 SD 0.3 左右）。
+
+    每輪把 θ 標準化成平均 0、標準差 1，b 和 a 跟著換算，讓 a(θ − b) 不變。
+    回傳 (theta, b, log_a, 標準差)；學生太少算不出標準差時只平移。
+    """
+    mean = theta.mean() if len(theta) else 0.0
+    sd = theta.std() if len(theta) > 1 else 0.0
+    if not sd > 1e-6:
+        sd = 1.0
+    return (theta - mean) / sd, (b - mean) / sd, log_a + np.log(sd), sd
+
+
+def fit(s, i, y, n_students, n_items, model="2pl", theta=None, b=None, log_a=None,
+        max_iter=100, tol=1e-4, workers=1):
+    """回傳 dict(theta, se_theta, b, se_b, a, iterations)。
+
+    theta / b / log_a 可以給上一次的解當起點（增量更新）。
+    """
+    import numpy as np
+
+    fit_a = model == "2pl"
+    theta = np.zeros(n_students) if theta is None else np.asarray(theta, dtype=float).copy()
+    b = np.zeros(n_items) if b is None else np.asarray(b, dtype=float).copy()
+    log_a = np.zeros(n_items) if log_a is None or not fit_a else np.asarray(log_a, dtype=float).copy()
+
+    # 依學生切組：每組的學生編號連續，θ 可以各自更新
+    n_chunks = max(1, workers if len(y) >= PARALLEL_MIN_RESPONSES else 1)
+    order = np.argsort(s, kind="stable")
+    s, i, y = s[order], i[order], y[order].astype(float)
+    bounds = np.linspace(0, n_students, n_chunks + 1).astype(int)
+    chunks = []
+    slices = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        a0, a1 = np.searchsorted(s, lo), np.searchsorted(s, hi)
+        chunks.append((s[a0:a1] - lo, i[a0:a1], y[a0:a1]))
+        slices.append((lo, hi))
+
+    pool = None
+    if n_chunks > 1:
+        pool = ProcessPoolExecutor(max_workers=n_chunks, initializer=_init_worker, initargs=(chunks,))
+
+    h_t = np.ones(n_students)
+    h_b = np.ones(n_items)
+    iterations = 0
+    try:
+        for iterations in range(1, max_iter + 1):
+            if pool is None:
+                results = [_chunk_step(chunks[0], theta, b, log_a, n_items, fit_a)]
+            else:
+                futures = [
+                    pool.submit(_pool_step, k, theta[lo:hi], b, log_a, n_items, fit_a)
+                    for k, (lo, hi) in enumerate(slices)
+                ]
+                results = [f.result() for f in futures]
+
+            new_theta = np.concatenate([r[0] for r in results])
+            h_t = np.concatenate([r[1] for r in results])
+            g_b = sum(r[2] for r in results) - b / B_SD ** 2
+            h_b = sum(r[3] for r in results) + 1 / B_SD ** 2
+            new_log_a = log_a
+            if fit_a:
+                # 每題的 (b, log a) 一起走一步 2×2 Newton
+                g_a = sum(r[4] for r in results) - log_a / LOG_A_SD ** 2
+                h_a = sum(r[5] for r in results) + 1 / LOG_A_SD ** 2
+                h_ab = sum(r[6] for r in results)
+                det = h_b * h_a - h_ab ** 2
+                new_b = b + np.clip((h_a * g_b - h_ab * g_a) / det, -MAX_STEP, MAX_STEP)
+                new_log_a = log_a + np.clip((h_b * g_a - h_ab * g_b) / det, -MAX_STEP / 2, MAX_STEP / 2)
+                h_b = det / h_a       # b 的標準誤要扣掉和 a 相關的部分
+                new_theta, new_b, new_log_a, scale = _standardize(np, new_theta, new_b, new_log_a)
+                h_t = h_t * scale ** 2        # 值除以 scale，標準誤也除以 scale
+                h_b = h_b * scale ** 2
+            else:
+                new_b = b + np.clip(g_b / h_b, -MAX_STEP, MAX_STEP)
+            change = max(
+                np.max(np.abs(new_theta - theta), initial=0),
+                np.max(np.abs(new_b - b), initial=0),
+                np.max(np.abs(new_log_a - log_a), initial=0),
+            )
+            theta, b, log_a = new_theta, new_b, new_log_a
+            if change < tol:
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return {
+        "theta": theta,
+        "se_theta": 1 / np.sqrt(h_t),
+        "b": b,
+        "se_b": 1 / np.sqrt(h_b),
+        "log_a": log_a,
+        "iterations": iterations,
+    }
+
+
+# ===== 作答資料 + 增量更新 =====
+
+def _record_key(rec):
+    return f"{rec['account']}|{rec['attempt_no']}|{rec['time']}"
+
+
+class IrtCalibrator:
+    def __init__(self, storage, cache_file=CACHE_FILE, model="2pl", workers=1, archive=None):
+        self.storage = storage
+        self.archive = archive    # ResultArchive：整個重算時連封存的舊月份一起讀
+        self.cache_file = cache_file
+        self.model = model
+        self.workers = workers
+
+    def _load_cache(self):
+        import numpy as np
+
+        try:
+            with np.load(self.cache_file, allow_pickle=False) as z:
+                if str(z["model"]) != self.model:
+                    return None
+                return {k: z[k] for k in z.files}
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _save_cache(self, data):
+        import numpy as np
+
+        tmp = f"{self.cache_file}.{os.getpid()}.tmp.npz"
+        np.savez(tmp, **data)
+        os.replace(tmp, self.cache_file)
+
+    def refresh(self, full=False):
+        """讀新作答、更新估計值並存回 STORAGE；回傳摘要 dict（沒有新作答就回傳 None）。"""
+        import numpy as np
+
+        cache = None if full else self._load_cache()
+        if cache is None:
+            accounts, qids = [], []
+            s, i, y = [], [], []
+            watermark, seen = "", set()
+            theta = b = log_a = None
+            records = self.storage.iter_results()
+            if self.archive is not None:
+                records = itertools.chain(self.archive.iter_results(), records)
+        else:
+            accounts, qids = cache["accounts"].tolist(), cache["qids"].tolist()
+            s, i, y = cache["s"].tolist(), cache["i"].tolist(), cache["y"].tolist()
+            watermark, seen = str(cache["watermark"]), set(cache["seen"].tolist())
+            theta, b, log_a = cache["theta"], cache["b"], cache["log_a"]
+            records = self.storage.iter_results_since(watermark)
+
+        acc_index = {a: k for k, a in enumerate(accounts)}
+        q_index = {q: k for k, q in enumerate(qids)}
+        added = 0
+        for rec in records:
+            t = str(rec["time"])
+            key = _record_key(rec)
+            if t < watermark or (t == watermark and key in seen):
+                continue
+            if t > watermark:
+                watermark, seen = t, set()
+            seen.add(key)
+            sk = acc_index.setdefault(rec["account"], len(acc_index))
+            for qid, (_, mark) in rec["answers"].items():
+                qk = q_index.setdefault(qid, len(q_index))
+                s.append(sk)
+                i.append(qk)
+                y.append(1 if mark == "O" else 0)
+                added += 1
+
+        if cache is not None and added == 0:
+            return None
+
+        accounts = list(acc_index)
+        qids = list(q_index)
+        s = np.asarray(s, dtype=np.int64)
+        i = np.asarray(i, dtype=np.int64)
+        y = np.asarray(y, dtype=np.int8)
+
+        # 上一次的解當起點；新學生 / 新題目從 0 開始
+        warm = theta is not None
+        if warm:
+            theta = np.concatenate([theta, np.zeros(len(accounts) - len(theta))])
+            b = np.concatenate([b, np.zeros(len(qids) - len(b))])
+            log_a = np.concatenate([log_a, np.zeros(len(qids) - len(log_a))])
+
+        started = time.time()
+        result = fit(
+            s, i, y, len(accounts), len(qids), model=self.model,
+            theta=theta, b=b, log_a=log_a,
+            max_iter=30 if warm else 200, workers=self.workers,
+        )
+
+        self._save_cache({
+            "model": np.array(self.model),
+            "accounts": np.array(accounts, dtype=str),
+            "qids": np.array(qids, dtype=str),
+            "s": s, "i": i, "y": y,
+            "watermark": np.array(watermark),
+            "seen": np.array(sorted(seen), dtype=str),
+            "theta": result["theta"], "b": result["b"], "log_a": result["log_a"],
+        })
+
+        n_by_student = np.bincount(s, minlength=len(accounts))
+        n_by_item = np.bincount(i, minlength=len(qids))
+        correct_by_item = np.bincount(i, y.astype(float), minlength=len(qids))
+        a = np.exp(result["log_a"])
+        doc = {
+            "model": self.model,
+            "fitted_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "responses": int(len(y)),
+            "iterations": int(result["iterations"]),
+            "students": {
+                acc: {
+                    "theta": round(float(result["theta"][k]), 3),
+                    "se": round(float(result["se_theta"][k]), 3),
+                    "n": int(n_by_student[k]),
+                }
+                for k, acc in enumerate(accounts)
+            },
+            "items": {
+                qid: {
+                    "b": round(float(result["b"][k]), 3),
+                    "se": round(float(result["se_b"][k]), 3),
+                    "a": round(float(a[k]), 3),
+                    "n": int(n_by_item[k]),
+                    "p_correct": round(float(correct_by_item[k] / n_by_item[k]), 3) if n_by_item[k] else None,
+                }
+                for k, qid in enumerate(qids)
+            },
+        }
+        self.storage.save_document(DOCUMENT, doc)
+        return {
+            "added": added,
+            "responses": doc["responses"],
+            "students": len(accounts),
+            "items": len(qids),
+            "iterations": doc["iterations"],
+            "seconds": round(time.time() - started, 2),
+            "warm_start": warm,
+        }
+
+
+@contextmanager
+def refresh_lock(path=None, blocking=True):
+    """同一台機器同時只跑一個校準（幾個 worker 加上命令列共用一個鎖檔）；拿不到鎖時 yield False。"""
+    if fcntl is None:
+        yield True
+        return
+    fd = os.open(path or shared_path("irt-refresh", suffix=".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+class IrtRefresher:
+    """背景校準：老師按按鈕、或交卷累積到一定數量時，在背景執行緒跑 refresh()，請求不用等它算完。"""
+
+    def __init__(self, calibrator_factory, on_done=None,
+                 every=AUTO_REFRESH_EVERY, interval=AUTO_REFRESH_INTERVAL, lock_path=None):
+        self._make_calibrator = calibrator_factory   # () -> IrtCalibrator
+        self._on_done = on_done                      # summary -> None（清快取等），沒有新作答時不呼叫
+        self.every = every
+        self.interval = interval
+        self.lock_path = lock_path
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._requested = False      # 老師按了按鈕
+        self._new_results = 0        # 上次校準後這個 worker 收到的交卷數
+        self._last_run = time.time()
+        self._thread = None
+        self._pid = None
+        self.running = False
+        self.last_summary = None
+
+    def _ensure_thread(self):
+        # gunicorn fork 之後執行緒不會跟過去，所以用 pid 判斷要不要重開
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="irt-refresh", daemon=True)
+            self._thread.start()
+
+    def busy(self):
+        """是否有校準正在跑（任何一個 worker 或命令列）。"""
+        if self.running:
+            return True
+        with refresh_lock(self.lock_path, blocking=False) as got:
+            return not got
+
+    def request(self):
+        """老師要求馬上校準；回傳 False 代表已經有校準在進行中。"""
+        if self.busy():
+            return False
+        with self._lock:
+            self._requested = True
+        self._ensure_thread()
+        self._wake.set()
+        return True
+
+    def note_result(self):
+        """交卷時呼叫：累積到 every 次就叫醒背景執行緒。"""
+        with self._lock:
+            self._new_results += 1
+            due = self._new_results >= self.every
+        self._ensure_thread()
+        if due:
+            self._wake.set()
+
+    def _due(self):
+        with self._lock:
+            return (self._requested or self._new_results >= self.every
+                    or (self._new_results and time.time() - self._last_run >= self.interval))
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=60)
+            self._wake.clear()
+            if self._due():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    print("❌ IRT 校準失敗：", e)
+
+    def run_once(self):
+        """在目前的執行緒校準一次；別的 worker 正在算就跳過（交卷數留著，下一輪再看）。"""
+        with refresh_lock(self.lock_path, blocking=False) as got:
+            if not got:
+                return None
+            with self._lock:
+                self._requested = False
+                self._new_results = 0
+                self._last_run = time.time()
+            self.running = True
+            try:
+                summary = self._make_calibrator().refresh()
+            finally:
+                self.running = False
+        self.last_summary = summary
+        if summary is None:
+            print("🔄 IRT 沒有新的作答，估計值不用更新")
+        else:
+            print(f"🔄 IRT 校準完成：新增 {summary['added']} 筆作答，學生 {summary['students']} 人、"
+                  f"題目 {summary['items']} 題，迭代 {summary['iterations']} 輪，{summary['seconds']} 秒")
+            if self._on_done is not None:
+                self._on_done(summary)
+        return summary
+
+
+class IrtEstimates:
+    """網站端讀估計值：每隔 ttl 秒才重新從 STORAGE 讀一次。"""
+
+    def __init__(self, storage, ttl=60):
+        self.storage = storage
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._doc = None
+        self._loaded_at = 0.0
+
+    def get(self):
+        with self._lock:
+            if self._doc is None or time.time() - self._loaded_at > self.ttl:
+                try:
+                    self._doc = self.storage.load_document(DOCUMENT) or {}
+                except Exception as e:
+                    print("⚠️ 讀取 IRT 估計值失敗：", e)
+                    self._doc = self._doc or {}
+                self._loaded_at = time.time()
+            return self._doc
+
+    def invalidate(self):
+        with self._lock:
+            self._doc = None
+
+    def ability(self, account):
+        return (self.get().get("students") or {}).get(account)
+
+    def item(self, qid):
+        return (self.get().get("items") or {}).get(qid)
+
+    def selection_weights(self, account, questions):
+        """適性抽題用的權重：題目在這位學生能力附近提供的資訊量 a²p(1−p)。
+
+        還沒校準的學生 / 題目用 θ=0、b=0、a=1，權重仍大於 0，所有題目都抽得到。
+        """
+        import math
+
+        doc = self.get()
+        students = doc.get("students") or {}
+        items = doc.get("items") or {}
+        theta = (students.get(account) or {}).get("theta", 0.0)
+        weights = []
+        for q in questions:
+            it = items.get(q["id"]) or {}
+            a = it.get("a", 1.0)
+            p = 1 / (1 + math.exp(-max(-30.0, min(30.0, a * (theta - it.get("b", 0.0))))))
+            weights.append(a * a * p * (1 - p) + 0.01)
+        return weights
+
+
+if __name__ == "__main__":
+    import argparse
+
+    sys.path.insert(0, BASE_DIR)
+    from archive import ResultArchive
+    from storage import open_storage
+
+    parser = argparse.ArgumentParser(description="IRT 校準（題目難度 / 學生能力）")
+    parser.add_argument("command", choices=["refresh"])
+    parser.add_argument("--full", action="store_true", help="不用快取，全部重算")
+    parser.add_argument("--model", choices=["rasch", "2pl"], default="2pl")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with refresh_lock():
+        summary = IrtCalibrator(
+            open_storage(), model=args.model, workers=args.workers, archive=ResultArchive()
+        ).refresh(full=args.full)
+    if summary is None:
+        print("✅ 沒有新的作答，估計值不用更新")
+    else:
+        print(
+            f"✅ IRT 校準完成：新增 {summary['added']} 筆作答（共 {summary['responses']} 筆），"
+            f"學生 {summary['students']} 人、題目 {summary['items']} 題，"
+            f"迭代 {summary['iterations']} 輪，{summary['seconds']} 秒"
+        )
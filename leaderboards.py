@@ -0,0 +1,124 @@
+"""時段排行榜：今日 / 本週 / 本學期的積分排名。
+
+總積分排行只看累積，早開始寫的人永遠在前面。這裡把每次交卷的分數同時加進
+「這一天」「這一週」「這學期」三個時段的積分表（rollup），查詢時直接讀那張表：
+前幾名、某人的名次都走 STORAGE 的索引（Redis 是 sorted set），不會去掃作答紀錄。
+
+時段名稱：
+  day:2026-10-19    week:2026-W42（ISO 週，週一開始）    term:2026-1（2026 學年上學期）
+
+上線前已經有的作答可以補進去（會先清掉全部時段再重算，封存的舊月份也會讀）：
+  python leaderboards.py rebuild
+"""
+import itertools
+import os
+import sys
+from collections import defaultdict
+from datetime import datetime
+
+WINDOWS = {
+    "day": "今日",
+    "week": "本週",
+    "term": "本學期",
+}
+
+# 學期從幾月開始：8 月起是上學期，2 月起是下學期（1 月還算前一學年的上學期）
+FALL_TERM_MONTH = 8
+SPRING_TERM_MONTH = 2
+
+
+def term_of(when):
+    """回傳 (學年, 1 或 2)。"""
+    if when.month >= FALL_TERM_MONTH:
+        return when.year, 1
+    if when.month >= SPRING_TERM_MONTH:
+        return when.year - 1, 2
+    return when.year - 1, 1
+
+
+def buckets_for(when):
+    """when 那一刻屬於哪些時段：{"day": ..., "week": ..., "term": ...}"""
+    iso_year, iso_week, _ = when.isocalendar()
+    year, half = term_of(when)
+    return {
+        "day": f"day:{when:%Y-%m-%d}",
+        "week": f"week:{iso_year}-W{iso_week:02d}",
+        "term": f"term:{year}-{half}",
+    }
+
+
+def bucket_label(bucket):
+    """時段名稱 -> 給人看的文字。"""
+    kind, _, value = bucket.partition(":")
+    if kind == "week":
+        year, week = value.split("-W")
+        return f"{year} 年第 {int(week)} 週"
+    if kind == "term":
+        year, half = value.split("-")
+        return f"{year} 學年{'上' if half == '1' else '下'}學期"
+    return value
+
+
+def _parse_time(text):
+    try:
+        return datetime.strptime(str(text), "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+class WindowedLeaderboard:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def record(self, account, points, when=None):
+        """交卷時呼叫：三個時段各加一次分數（0 分也記，代表這個時段有作答）。"""
+        buckets = buckets_for(when or datetime.now())
+        self.storage.rollup_add([(b, account, points) for b in buckets.values()])
+
+    def bucket(self, window, when=None):
+        return buckets_for(when or datetime.now())[window]
+
+    def top(self, window, limit=50, when=None):
+        """[{"account", "points", "rank"}, ...]，同分同名次。"""
+        rows = []
+        for account, points in self.storage.rollup_top(self.bucket(window, when), limit):
+            if rows and rows[-1]["points"] == points:
+                rank = rows[-1]["rank"]
+            else:
+                rank = len(rows) + 1
+            rows.append({"account": account, "points": points, "rank": rank})
+        return rows
+
+    def rank(self, account, window, when=None):
+        """回傳 (名次, 積分, 人數)；這個時段還沒作答名次是 None。"""
+        return self.storage.rollup_rank(self.bucket(window, when), account)
+
+    def rebuild(self, records=None):
+        """清掉所有時段，從作答紀錄（預設是 STORAGE 裡的全部）重算一次；回傳讀了幾筆作答。"""
+        totals = defaultdict(int)
+        n = 0
+        for rec in self.storage.iter_results() if records is None else records:
+            when = _parse_time(rec["time"])
+            if when is None:
+                continue
+            for b in buckets_for(when).values():
+                totals[(b, rec["account"])] += int(rec["score"] or 0)
+            n += 1
+        self.storage.rollup_clear()
+        self.storage.rollup_add([(b, acc, pts) for (b, acc), pts in totals.items()])
+        return n
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from archive import ResultArchive
+    from storage import open_storage
+
+    if sys.argv[1:] == ["rebuild"]:
+        storage = open_storage()
+        # 封存的舊月份也要算（本學期可能橫跨好幾個月）
+        n = WindowedLeaderboard(storage).rebuild(
+            itertools.chain(ResultArchive().iter_results(), storage.iter_results()))
+        print(f"✅ 時段排行已重建（讀了 {n} 筆作答）")
+    else:
+        print("用法：python leaderboards.py rebuild")
@@ -0,0 +1,367 @@
+"""參數化數值題：同一個題目模板，每位學生拿到不同的數字，答案用公式算。
+
+questions.xlsx 另開一個工作表「Templates」，欄位：
+  id          題號（和一般題目共用編號空間，例如 T001）
+  text        題目，變數寫成 {m}、{v}：「質量 {m} kg 的物體以 {v} m/s 運動，動能為多少？」
+  variables   變數範圍，用分號隔開：m=1:10:0.5; v=2:20:1（最小:最大:間隔）、g=9.8（固定值）
+              沒寫間隔就是連續值，取 3 位有效數字
+  answer      答案公式：0.5*m*v**2（可用 sqrt、sin、cos、tan、asin、acos、atan、exp、log、log10、
+              abs、radians、degrees、pi、e；三角函數用弧度）
+  unit        單位（顯示用，例如 J）
+  tolerance   容許誤差：「2%」是相對誤差，「0.1」是絕對誤差；空白＝四捨五入到有效位數後相同
+  sig_figs    有效位數（空白＝3 位，且不要求學生寫幾位）
+  explanation 詳解（一樣可以用 {m} 等變數）
+  category    分類
+
+數字是「整批」用 NumPy 一次算好的（每個模板一次 256 組），出題時只從批次裡拿一組，
+所以參數化題目出一份考卷的成本和固定題差不多。
+"""
+import ast
+import math
+import re
+import threading
+from collections import deque
+
+
+TEMPLATE_SHEET = "Templates"
+TEMPLATE_HEADERS = ["id", "text", "variables", "answer", "unit", "tolerance", "sig_figs", "explanation", "category"]
+
+DEFAULT_SIG_FIGS = 3
+BATCH_SIZE = 256
+
+# 公式可用的函式 -> NumPy 函式名稱（numpy 等到真的要算才 import，啟動不用等它）
+_FUNCTIONS = {
+    "sqrt": "sqrt", "sin": "sin", "cos": "cos", "tan": "tan",
+    "asin": "arcsin", "acos": "arccos", "atan": "arctan",
+    "exp": "exp", "log": "log", "log10": "log10", "abs": "abs",
+    "radians": "radians", "degrees": "degrees",
+}
+_CONSTANTS = {"pi": math.pi, "e": math.e}
+_BINOPS = {
+    ast.Add: "add", ast.Sub: "subtract", ast.Mult: "multiply",
+    ast.Div: "true_divide", ast.Pow: "power",
+}
+_UNARYOPS = {ast.USub: "negative", ast.UAdd: "positive"}
+
+_VAR_RE = re.compile(r"^\s*([A-Za-z_]\w*)\s*=\s*([^:]+?)\s*(?::\s*([^:]+?)\s*(?::\s*([^:]+?)\s*)?)?$")
+_PLACEHOLDER_RE = re.compile(r"\{([A-Za-z_]\w*)\}")
+
+
+class TemplateError(ValueError):
+    pass
+
+
+# ===== 公式：只允許四則運算、次方和白名單函式（不用 eval） =====
+
+def compile_formula(formula, variables):
+    """把公式字串編譯成 f(values: {變數: ndarray}) -> ndarray；不合法就丟 TemplateError。"""
+    import numpy as np
+
+    try:
+        tree = ast.parse(str(formula).replace("^", "**"), mode="eval")
+    except SyntaxError as e:
+        raise TemplateError(f"公式語法錯誤：{formula}") from e
+
+    def build(node):
+        if isinstance(node, ast.Expression):
+            return build(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) \
+                and not isinstance(node.value, bool):
+            value = float(node.value)
+            return lambda env: value
+        if isinstance(node, ast.Name):
+            name = node.id
+            if name in variables:
+                return lambda env: env[name]
+            if name in _CONSTANTS:
+                value = _CONSTANTS[name]
+                return lambda env: value
+            raise TemplateError(f"公式用到未定義的變數：{name}")
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINOPS:
+            op, left, right = getattr(np, _BINOPS[type(node.op)]), build(node.left), build(node.right)
+            return lambda env: op(left(env), right(env))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARYOPS:
+            op, operand = getattr(np, _UNARYOPS[type(node.op)]), build(node.operand)
+            return lambda env: op(operand(env))
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+                and node.func.id in _FUNCTIONS and len(node.args) == 1 and not node.keywords:
+            fn, arg = getattr(np, _FUNCTIONS[node.func.id]), build(node.args[0])
+            return lambda env: fn(arg(env))
+        raise TemplateError(f"公式含有不允許的寫法：{ast.dump(node)[:40]}")
+
+    return build(tree)
+
+
+# ===== 數字格式 =====
+
+def round_sig(x, sig):
+    """四捨五入到 sig 位有效數字（支援 ndarray）。"""
+    import numpy as np
+
+    x = np.asarray(x, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mag = np.where(x == 0, 0, np.floor(np.log10(np.abs(x))))
+    factor = 10.0 ** (sig - 1 - mag)
+    return np.round(x * factor) / factor
+
+
+def format_number(x, sig=DEFAULT_SIG_FIGS):
+    """12.5、0.00314、3.0×10^8 這種給人看的寫法。"""
+    x = float(round_sig(x, sig))
+    if x != 0 and not 1e-3 <= abs(x) < 1e5:
+        mantissa, exp = f"{x:.{sig - 1}e}".split("e")
+        return f"{mantissa}×10^{int(exp)}"
+    # 小數位數依有效位數決定，44.0 才不會被寫成 44
+    decimals = max(sig - 1 - int(math.floor(math.log10(abs(x)))), 0) if x else sig - 1
+    return f"{x:.{decimals}f}"
+
+
+_SCI_RE = re.compile(r"^([-+]?(?:\d+\.?\d*|\.\d+))\s*(?:[x×*]\s*10\s*(?:\^|\*\*)\s*([-+]?\d+)|[eE]([-+]?\d+))?$")
+
+
+def parse_number(text):
+    """學生輸入的數字 -> (數值, 有效位數)；看不懂回傳 (None, 0)。"""
+    s = str(text or "").strip().replace(",", "").replace("−", "-").replace(" ", "")
+    m = _SCI_RE.match(s)
+    if not m:
+        return None, 0
+    mantissa, exp = m.group(1), m.group(2) or m.group(3)
+    value = float(mantissa) * (10.0 ** int(exp) if exp else 1.0)
+    digits = mantissa.lstrip("+-").replace(".", "").lstrip("0")
+    return value, max(len(digits), 1)
+
+
+# ===== 模板 =====
+
+def parse_variables(spec):
+    """「m=1:10:0.5; g=9.8」-> [{"name", "low", "high", "step"}]"""
+    result = []
+    for part in re.split(r"[;\n]", str(spec or "")):
+        if not part.strip():
+            continue
+        m = _VAR_RE.match(part)
+        if not m:
+            raise TemplateError(f"變數格式看不懂：{part.strip()}")
+        name, low, high, step = m.groups()
+        try:
+            low = float(low)
+            high = float(high) if high is not None else low
+            step = float(step) if step is not None else 0.0
+        except ValueError as e:
+            raise TemplateError(f"變數範圍不是數字：{part.strip()}") from e
+        if high < low or step < 0:
+            raise TemplateError(f"變數範圍不合理：{part.strip()}")
+        result.append({"name": name, "low": low, "high": high, "step": step})
+    if not result:
+        raise TemplateError("沒有任何變數")
+    return result
+
+
+def parse_tolerance(text):
+    """「2%」-> ("rel", 0.02)；「0.1」-> ("abs", 0.1)；空白 -> None"""
+    s = str(text or "").strip()
+    if not s:
+        return None
+    try:
+        if s.endswith("%"):
+            return ("rel", float(s[:-1]) / 100)
+        return ("abs", float(s))
+    except ValueError as e:
+        raise TemplateError(f"容許誤差格式看不懂：{s}") from e
+
+
+class NumericTemplate:
+    """編譯好的模板：sample() 一次產生一整批變數值和答案。"""
+
+    def __init__(self, q):
+        self.id = q["id"]
+        self.variables = parse_variables(q["variables"])
+        names = [v["name"] for v in self.variables]
+        self.formula = compile_formula(q["formula"], set(names))
+        self.tolerance = parse_tolerance(q.get("tolerance"))
+        self.sig_figs = int(q.get("sig_figs") or DEFAULT_SIG_FIGS)
+        self.strict_sig_figs = bool(q.get("sig_figs"))
+
+    def sample(self, n, rng):
+        """回傳 (變數值 {name: ndarray}, 答案 ndarray)，已去掉算不出答案的組合。"""
+        import numpy as np
+
+        env = {}
+        for v in self.variables:
+            if v["high"] == v["low"]:
+                env[v["name"]] = np.full(n, v["low"])
+            elif v["step"]:
+                count = int(round((v["high"] - v["low"]) / v["step"])) + 1
+                env[v["name"]] = np.round(v["low"] + rng.integers(0, count, n) * v["step"], 10)
+            else:
+                env[v["name"]] = round_sig(rng.uniform(v["low"], v["high"], n), DEFAULT_SIG_FIGS)
+        with np.errstate(all="ignore"):
+            answers = np.broadcast_to(np.asarray(self.formula(env), dtype=float), (n,))
+        ok = np.isfinite(answers)
+        return {k: a[ok] for k, a in env.items()}, answers[ok]
+
+    def answer_for(self, values):
+        """用一組變數值重算正確答案（跟 sample() 同一個公式，算出來的數字一樣）。"""
+        import numpy as np
+
+        env = {v["name"]: np.asarray([float(values[v["name"]])]) for v in self.variables}
+        with np.errstate(all="ignore"):
+            answer = np.asarray(self.formula(env), dtype=float).reshape(-1)[0]
+        return float(answer)
+
+    def check(self, user_answer, correct):
+        """數值批改：在容許誤差內才算對；有指定有效位數時，學生寫的位數不能比較少。"""
+        value, digits = parse_number(user_answer)
+        if value is None:
+            return False
+        if self.strict_sig_figs and digits < self.sig_figs:
+            return False
+        if self.tolerance is None:
+            return float(round_sig(value, self.sig_figs)) == float(round_sig(correct, self.sig_figs))
+        kind, tol = self.tolerance
+        limit = tol * abs(correct) if kind == "rel" else tol
+        return abs(value - correct) <= limit + 1e-12 * max(1.0, abs(correct))
+
+
+def format_value(x):
+    """變數值照原樣顯示（2.5 就是 2.5，不補成 2.50）；很大或很小才用 ×10^n。"""
+    text = f"{float(x):.6g}"
+    if "e" in text:
+        mantissa, exp = text.split("e")
+        return f"{mantissa}×10^{int(exp)}"
+    return text
+
+
+def fill_text(text, values):
+    """把題目 / 詳解裡的 {m} 換成這一組的數字（不是變數的 {...} 保留原樣，LaTeX 不會被弄壞）。"""
+    def repl(m):
+        name = m.group(1)
+        if name not in values:
+            return m.group(0)
+        return format_value(values[name])
+    return _PLACEHOLDER_RE.sub(repl, str(text or ""))
+
+
+def load_templates(wb, error_list):
+    """從活頁簿讀「Templates」工作表，回傳題目 dict list（沒有這個工作表就回傳空 list）。"""
+    if TEMPLATE_SHEET not in wb.sheetnames:
+        return []
+    ws = wb[TEMPLATE_SHEET]
+    headers = [str(cell.value).strip() if cell.value else "" for cell in ws[1]]
+    missing = [h for h in ("id", "text", "variables", "answer") if h not in headers]
+    if missing:
+        error_list.append(f"工作表「{TEMPLATE_SHEET}」缺少欄位：{', '.join(missing)}")
+        return []
+
+    templates = []
+    for i, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
+        cell = {h: (str(row[headers.index(h)]).strip() if h in headers and row[headers.index(h)] is not None else "")
+                for h in TEMPLATE_HEADERS}
+        if not cell["id"] or not cell["text"]:
+            continue
+        q = {
+            "id": cell["id"],
+            "text": cell["text"],
+            "options": [],
+            "answer": cell["answer"],      # 出題前顯示公式；代入數字後換成數值答案
+            "formula": cell["answer"],
+            "explanation": cell["explanation"],
+            "category": cell["category"],
+            "kind": "numeric",
+            "variables": cell["variables"],
+            "unit": cell["unit"],
+            "tolerance": cell["tolerance"],
+            "sig_figs": cell["sig_figs"],
+        }
+        try:
+            NumericTemplate(q)
+            if cell["sig_figs"] and int(cell["sig_figs"]) < 1:
+                raise TemplateError("有效位數至少 1 位")
+        except (TemplateError, ValueError) as e:
+            error_list.append(f"{TEMPLATE_SHEET} 第 {i} 列（{cell['id']}）：{e}")
+            continue
+        templates.append(q)
+    return templates
+
+
+def is_numeric(q):
+    return bool(q) and q.get("kind") == "numeric"
+
+
+class VariantBank:
+    """每個模板預先算好一批數字；出題時拿一組，用完再整批補。
+
+    拿到的那一組（變數值 + 正確答案）會跟著考卷存起來，批改時直接用，不再重算；
+    只有變數值的地方（表單交卷的 session cookie，學生看得到內容）批改時用 restore() 重算答案。
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, seed=None):
+        self.batch_size = batch_size
+        self._seed = seed
+        self._rng = None
+        self._lock = threading.Lock()
+        self._compiled = {}   # qid -> (模板 dict 的指紋, NumericTemplate)
+        self._batches = {}    # qid -> deque[(values, answer)]
+
+    def template(self, q):
+        key = (q["variables"], q["formula"], q.get("tolerance"), q.get("sig_figs"))
+        with self._lock:
+            cached = self._compiled.get(q["id"])
+            if cached is None or cached[0] != key:
+                cached = (key, NumericTemplate(q))
+                self._compiled[q["id"]] = cached
+                self._batches.pop(q["id"], None)
+            return cached[1]
+
+    def _refill(self, q, tpl):
+        if self._rng is None:
+            import numpy as np
+            self._rng = np.random.default_rng(self._seed)
+        values, answers = tpl.sample(self.batch_size, self._rng)
+        names = list(values)
+        columns = [values[name].tolist() for name in names]
+        batch = deque(
+            ({name: col[i] for name, col in zip(names, columns)}, answers[i].item())
+            for i in range(len(answers))
+        )
+        if not batch:
+            raise TemplateError(f"{q['id']}：變數範圍內算不出任何有效答案")
+        self._batches[q["id"]] = batch
+        return batch
+
+    def take(self, q):
+        """取一組數字：{"values": {變數: 數值}, "answer": 正確答案}。"""
+        tpl = self.template(q)
+        with self._lock:
+            batch = self._batches.get(q["id"])
+            if not batch:
+                batch = self._refill(q, tpl)
+            values, answer = batch.popleft()
+        return {"values": values, "answer": answer}
+
+    def restore(self, q, values):
+        """只有變數值（例如從 session 拿回來的）時，重算答案組回完整的一組數字。"""
+        return {"values": values, "answer": self.template(q).answer_for(values)}
+
+    def instantiate(self, q, variant=None):
+        """把模板題變成這位學生看到的題目（一般題目原樣回傳）。"""
+        if not is_numeric(q):
+            return q
+        variant = variant or self.take(q)
+        return dict(
+            q,
+            text=fill_text(q["text"], variant["values"]),
+            explanation=fill_text(q.get("explanation"), variant["values"]),
+            answer=self.format_answer(q, variant),
+            variant=variant,
+        )
+
+    def instantiate_paper(self, paper):
+        return [self.instantiate(q) for q in paper]
+
+    def format_answer(self, q, variant):
+        text = format_number(variant["answer"], self.template(q).sig_figs)
+        return f"{text} {q['unit']}" if q.get("unit") else text
+
+    def check(self, q, variant, user_answer):
+        return self.template(q).check(user_answer, variant["answer"])
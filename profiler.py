@@ -0,0 +1,301 @@
+"""線上取樣分析（sampling profiler）：變慢的時候不用重開伺服器，老師從後台開 N 秒就能看出時間花在哪裡。
+
+做法：每個 worker 一條背景執行緒，每隔 interval 秒用 sys._current_frames() 抓一次所有執行緒的呼叫堆疊，
+把「同一條堆疊」出現幾次記下來。沒開的時候這條執行緒只是每秒看一下控制檔有沒有變。
+（不用 signal / setitimer：只抓得到主執行緒，而且會跟 gunicorn 自己的 signal 打架。）
+
+跨 worker：
+  - 開始：寫控制檔 shared_path("profile", ".json")（id、結束時間、取樣間隔）；每個 worker 的執行緒看到就開始取樣
+  - 結束：各 worker 各寫一個 collapsed stack 檔 physics-quiz-<tag>-profile-<id>-<pid>.folded
+          （一行一條堆疊「外層;內層;... 次數」，flamegraph.pl / speedscope 可以直接讀）
+  - 下載時把同一個 id 的所有 worker 檔案加總成一個
+
+每條堆疊的最外層是「正在處理的請求」（例如 GET home），往內是 函式 (檔案:行號)。
+預設只取正在處理請求的執行緒；勾「包含背景執行緒」才連預產考卷、自動存檔等背景執行緒一起取（最外層是執行緒名稱）。
+"""
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import request
+
+from shared_cache import shared_path
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_INTERVAL = 0.01     # 取樣間隔（秒），100 Hz
+MAX_SECONDS = 120           # 一次最多取樣幾秒
+MAX_DEPTH = 128             # 堆疊最多記幾層（遞迴太深就截掉最外面的部分）
+POLL_INTERVAL = 1.0         # 沒在取樣時，多久看一次控制檔
+KEEP_SESSIONS = 10          # 保留最近幾次的結果檔
+
+
+def _short_path(filename):
+    """檔名縮短：本專案的檔案用相對路徑，套件用 site-packages 之後的部分。"""
+    if filename.startswith(BASE_DIR + os.sep):
+        return os.path.relpath(filename, BASE_DIR)
+    marker = "site-packages" + os.sep
+    k = filename.rfind(marker)
+    if k >= 0:
+        return filename[k + len(marker):]
+    return os.path.basename(filename)
+
+
+def read_folded(path, counts=None):
+    """讀一個 collapsed stack 檔，加進 counts（Counter）。"""
+    counts = Counter() if counts is None else counts
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            stack, _, n = line.rstrip("\n").rpartition(" ")
+            if stack and n.isdigit():
+                counts[stack] += int(n)
+    return counts
+
+
+def function_label(frame):
+    """「函式 (檔案:行號)」去掉行號變成「函式 (檔案)」；.folded 留行號給火焰圖，排行要整個函式合起來算。"""
+    head, sep, tail = frame.rpartition(":")
+    if sep and tail.endswith(")") and tail[:-1].isdigit():
+        return head + ")"
+    return frame
+
+
+def hot_functions(counts, n=20):
+    """最花時間的函式：[(函式, 自己的樣本數, 含呼叫的樣本數), ...]，依「自己」排序。
+
+    「自己」= 堆疊最內層就是這個函式（正在執行它本身的程式碼）；
+    「含呼叫」= 堆疊裡有它（它或它呼叫的函式在執行）。
+    同一個函式的不同行合成一筆，遞迴或同一函式在堆疊裡出現好幾次也只算一次。
+    """
+    own = Counter()
+    total = Counter()
+    for stack, c in counts.items():
+        frames = [function_label(f) for f in stack.split(";")[1:]]    # 第一層是請求 / 執行緒名稱
+        if not frames:
+            continue
+        own[frames[-1]] += c
+        for frame in set(frames):
+            total[frame] += c
+    return [(name, c, total[name]) for name, c in own.most_common(n)]
+
+
+def by_request(counts):
+    """各請求（堆疊最外層）佔了多少樣本：[(請求, 樣本數), ...]，多的在前。"""
+    roots = Counter()
+    for stack, c in counts.items():
+        roots[stack.split(";", 1)[0]] += c
+    return roots.most_common()
+
+
+class SamplingProfiler:
+    def __init__(self, app, control_path=None):
+        self.control_path = control_path or shared_path("profile", suffix=".json")
+        self._active = {}                # 執行緒 id -> 正在處理的請求（"GET home"）
+        self._labels = {}                # (code, 行號) -> "函式 (檔案:行號)"
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._done = set()               # 這個 worker 已經取樣完的 id
+        self.running = None              # 這個 worker 正在取樣的 id
+        app.before_request(self._before)
+        app.teardown_request(self._teardown)
+
+    # ===== 記錄每條執行緒在處理哪個請求 =====
+
+    def _before(self):
+        self.ensure_started()
+        self._active[threading.get_ident()] = f"{request.method} {request.endpoint or request.path}"
+
+    def _teardown(self, exc):
+        self._active.pop(threading.get_ident(), None)
+
+    # ===== 控制檔 =====
+
+    def start(self, seconds, interval=DEFAULT_INTERVAL, all_threads=False, by=None):
+        """開始一次取樣（所有 worker 一起）；回傳這次的 id。"""
+        seconds = max(1, min(MAX_SECONDS, int(seconds)))
+        now = time.time()
+        control = {
+            "id": time.strftime("%Y%m%d-%H%M%S", time.localtime(now)),
+            "started": now,
+            "until": now + seconds,
+            "seconds": seconds,
+            "interval": max(0.001, float(interval)),
+            "all_threads": bool(all_threads),
+            "by": by,
+        }
+        self._cleanup()
+        tmp = f"{self.control_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(control, f)
+        os.replace(tmp, self.control_path)
+        self.ensure_started()
+        return control["id"]
+
+    def control(self):
+        """目前（或上一次）的控制檔內容；沒有回傳 None。"""
+        try:
+            with open(self.control_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # ===== 結果檔 =====
+
+    def _result_path(self, session_id, pid, suffix=".folded"):
+        return shared_path(f"profile-{session_id}-{pid}", suffix=suffix)
+
+    def _result_files(self, session_id="*"):
+        return glob.glob(self._result_path(session_id, "*"))
+
+    def sessions(self):
+        """[(id, {"workers", "samples", "ticks", "cpu", "seconds"}), ...]，新的在前。"""
+        prefix = shared_path("profile-", suffix="")
+        out = {}
+        for path in self._result_files():
+            session_id = path[len(prefix):-len(".folded")].rsplit("-", 1)[0]
+            info = out.setdefault(session_id, {"workers": 0, "samples": 0, "ticks": 0, "cpu": 0.0, "seconds": 0})
+            info["workers"] += 1
+            try:
+                with open(path[:-len(".folded")] + ".json", "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            info["samples"] += meta["samples"]
+            info["ticks"] += meta["ticks"]
+            info["cpu"] += meta["cpu"]
+            info["seconds"] = max(info["seconds"], meta["seconds"])
+        return sorted(out.items(), reverse=True)
+
+    def merged(self, session_id):
+        """把同一個 id 所有 worker 的結果加總成一個 Counter。"""
+        counts = Counter()
+        for path in self._result_files(session_id):
+            try:
+                read_folded(path, counts)
+            except OSError:
+                continue
+        return counts
+
+    def _cleanup(self):
+        """只留最近 KEEP_SESSIONS 次的結果檔。"""
+        for session_id, _ in self.sessions()[KEEP_SESSIONS - 1:]:
+            for path in self._result_files(session_id):
+                for p in (path, path[:-len(".folded")] + ".json"):
+                    try:
+                        os.remove(p)
+                    except OSError:
+                        pass
+
+    # ===== 取樣執行緒 =====
+
+    def ensure_started(self):
+        # gunicorn fork 之後執行緒不會跟過去，所以用 pid 判斷要不要重開
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._done = set()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        key = None
+        while True:
+            try:
+                try:
+                    st = os.stat(self.control_path)
+                    new_key = (st.st_ino, st.st_mtime_ns)
+                except FileNotFoundError:
+                    new_key = None
+                if new_key is not None and new_key != key:
+                    key = new_key
+                    control = self.control()
+                    if (control and control["id"] not in self._done
+                            and time.time() < control["until"]):
+                        self._done.add(control["id"])
+                        self._profile(control)
+                        continue
+            except Exception as e:
+                print("⚠️ 取樣分析失敗：", e)
+            time.sleep(POLL_INTERVAL)
+
+    def _profile(self, control):
+        self.running = control["id"]
+        interval = control["interval"]
+        all_threads = control["all_threads"]
+        counts = Counter()
+        ticks = 0
+        cpu0 = time.thread_time()
+        started = time.monotonic()
+        deadline = started + max(0.0, control["until"] - time.time())
+        next_tick = started
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                if next_tick > now:
+                    time.sleep(next_tick - now)
+                next_tick += interval
+                self._sample(counts, all_threads)
+                ticks += 1
+        finally:
+            self.running = None
+        cpu = time.thread_time() - cpu0
+        self._write_result(control["id"], counts, {
+            "pid": os.getpid(),
+            "ticks": ticks,
+            "samples": sum(counts.values()),
+            "cpu": round(cpu, 4),
+            "seconds": round(time.monotonic() - started, 2),
+        })
+        print(f"🛠 取樣分析 {control['id']} 完成：{ticks} 次、{sum(counts.values())} 筆堆疊，"
+              f"取樣本身用了 {cpu * 1000:.0f} ms CPU")
+
+    def _sample(self, counts, all_threads):
+        me = threading.get_ident()
+        active = self._active
+        names = {t.ident: t.name for t in threading.enumerate()} if all_threads else None
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            root = active.get(ident)
+            if root is None:
+                if not all_threads:
+                    continue
+                root = f"[{names.get(ident, ident)}]"
+            counts[self._collapse(root, frame)] += 1
+
+    def _collapse(self, root, frame):
+        labels = self._labels
+        stack = []
+        while frame is not None and len(stack) < MAX_DEPTH:
+            code = frame.f_code
+            k = (code, frame.f_lineno)
+            label = labels.get(k)
+            if label is None:
+                label = f"{code.co_name} ({_short_path(code.co_filename)}:{frame.f_lineno})".replace(";", ",")
+                labels[k] = label
+            stack.append(label)
+            frame = frame.f_back
+        stack.append(root)
+        stack.reverse()
+        return ";".join(stack)
+
+    def _write_result(self, session_id, counts, meta):
+        # 先寫 .json 再寫 .folded：列表是看 .folded，看到時 .json 一定已經在
+        with open(self._result_path(session_id, os.getpid(), ".json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        path = self._result_path(session_id, os.getpid())
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for stack, n in counts.most_common():
+                f.write(f"{stack} {n}\n")
+        os.replace(tmp, path)
@@ -0,0 +1,219 @@
+import os
+import random
+import threading
+from collections import deque
+
+
+class QuizPaperPool:
+    """考卷預產池：在背景先把考卷（題目順序＋選項排列）做好，/quiz 直接取一份。
+
+    - 一般模式：全班共用一個池子，被取走就在背景補回 target_size 份。
+    - 錯題模式：每個學生的題目範圍不同，所以另外替每個學生預做幾份。
+    - 適性抽題：每題被抽到的機率依學生能力而定（weigher 給權重），一樣每人預做。
+    """
+
+    def __init__(self, bank_getter, settings_getter, wrong_loader,
+                 target_size=60, low_water=20, per_student=2, instantiate=None, weigher=None):
+        self._bank_getter = bank_getter          # 回傳目前題庫 list
+        self._settings_getter = settings_getter  # 回傳目前 SETTINGS dict
+        self._wrong_loader = wrong_loader        # account -> 該生錯題 list
+        self._instantiate = instantiate          # paper -> paper（參數化題目代入數字）
+        self._weigher = weigher                  # (account, 題目 list) -> 權重 list 或 None
+        self.target_size = target_size
+        self.low_water = low_water
+        self.per_student = per_student
+
+        self._lock = threading.Lock()
+        self._shared = deque()       # 一般模式的考卷
+        self._students = {}          # account -> deque(考卷)
+        self._signature = None       # 設定或題庫改了就整池作廢
+        self._generation = 0         # 每次整池作廢 +1：作廢前開始做的考卷做完就丟掉，不放回池子
+        self._account_gen = {}       # account -> 該生的預做考卷作廢過幾次（交卷後錯題變了）
+        self._wake = threading.Event()
+        self._pending_accounts = deque()
+        self._thread = None
+        self._pid = None
+
+    # ===== 產生一份考卷 =====
+
+    def _signature_now(self):
+        settings = self._settings_getter()
+        bank = self._bank_getter()
+        return (
+            settings.get("questions_per_test", 5),
+            bool(settings.get("wrong_only_mode", False)),
+            bool(settings.get("adaptive_selection", False)),
+            id(bank),
+            len(bank),
+        )
+
+    @staticmethod
+    def _per_student(settings):
+        return bool(settings.get("wrong_only_mode", False) or settings.get("adaptive_selection", False))
+
+    @staticmethod
+    def build_paper(usable_bank, n, rng=random, weights=None):
+        """從 usable_bank 抽 n 題並打亂選項；回傳的是複本，不會動到題庫本身。
+
+        給 weights 時依權重不放回抽樣（每題取 u^(1/w) 當鍵，挑最大的 n 個）。
+        """
+        n = min(n, len(usable_bank))
+        if weights is None:
+            picked = rng.sample(usable_bank, n)
+        else:
+            keys = [rng.random() ** (1.0 / w) if w > 0 else 0.0 for w in weights]
+            top = sorted(range(len(usable_bank)), key=keys.__getitem__, reverse=True)[:n]
+            picked = [usable_bank[k] for k in top]
+        paper = []
+        for q in picked:
+            q = dict(q)
+            if q.get("options"):
+                opts = list(q["options"])
+                rng.shuffle(opts)
+                q["options"] = opts
+            paper.append(q)
+        return paper
+
+    def _build_for(self, account=None, rng=random):
+        settings = self._settings_getter()
+        bank = self._bank_getter()
+        usable_bank = bank
+        if account is not None and settings.get("wrong_only_mode", False):
+            wrong_q = self._wrong_loader(account)
+            if wrong_q:
+                usable_bank = wrong_q
+        if not usable_bank:
+            return None
+        weights = None
+        if account is not None and self._weigher is not None:
+            weights = self._weigher(account, usable_bank)
+        paper = self.build_paper(usable_bank, settings.get("questions_per_test", 5), rng=rng, weights=weights)
+        if self._instantiate is not None:
+            paper = self._instantiate(paper)
+        return paper
+
+    # ===== 背景補貨 =====
+
+    def _ensure_thread(self):
+        # gunicorn fork 之後執行緒不會跟過去，所以用 pid 判斷要不要重開
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="quiz-pool", daemon=True)
+        self._thread.start()
+
+    def _check_signature(self):
+        sig = self._signature_now()
+        with self._lock:
+            if sig != self._signature:
+                self._signature = sig
+                self._generation += 1
+                self._shared.clear()
+                self._students.clear()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=30)
+            self._wake.clear()
+            try:
+                self._refill()
+            except Exception as e:
+                print("⚠️ 考卷預產池補貨失敗：", e)
+
+    def _refill(self):
+        self._check_signature()
+
+        # 一般池補到 target_size（做考卷不拿鎖；做好時池子已經作廢過就丟掉重來）
+        while True:
+            with self._lock:
+                missing = self.target_size - len(self._shared)
+                gen = self._generation
+            if missing <= 0:
+                break
+            paper = self._build_for()
+            if paper is None:
+                break
+            with self._lock:
+                if self._generation == gen:
+                    self._shared.append(paper)
+
+        # 錯題模式 / 適性抽題：替排隊中的學生預做考卷
+        while self._pending_accounts:
+            account = self._pending_accounts.popleft()
+            with self._lock:
+                missing = self.per_student - len(self._students.get(account, ()))
+                gen = (self._generation, self._account_gen.get(account, 0))
+            for _ in range(missing):
+                paper = self._build_for(account)
+                if paper is None:
+                    break
+                with self._lock:
+                    if (self._generation, self._account_gen.get(account, 0)) != gen:
+                        break  # 做到一半作廢了（改設定或剛交卷），refresh 會再排一次
+                    self._students.setdefault(account, deque()).append(paper)
+
+    # ===== 對外介面 =====
+
+    def prewarm(self, accounts=()):
+        """開考前呼叫：補滿一般池，錯題模式 / 適性抽題時也替 accounts 每人預做考卷。"""
+        self._ensure_thread()
+        if self._per_student(self._settings_getter()):
+            self._pending_accounts.extend(accounts)
+        self._wake.set()
+
+    def pop(self, account, rng=None):
+        """取一份考卷（O(1)）；池子空了就當場現做一份，不讓學生等補貨。
+
+        給 rng 時（流量重播）不用池子，直接用這個 rng 現做，抽到的題目才會固定。
+        """
+        if rng is not None:
+            return self._build_for(account, rng)
+        self._ensure_thread()
+        self._check_signature()
+        per_student = self._per_student(self._settings_getter())
+
+        paper = None
+        with self._lock:
+            if per_student:
+                q = self._students.get(account)
+                if q:
+                    paper = q.popleft()
+            elif self._shared:
+                paper = self._shared.popleft()
+            low = len(self._shared) < self.low_water
+
+        if per_student:
+            # 做完這份，下一次的先準備好
+            self._pending_accounts.append(account)
+            self._wake.set()
+        elif low:
+            self._wake.set()
+
+        if paper is None:
+            paper = self._build_for(account)
+        return paper
+
+    def invalidate(self):
+        """老師改設定或題庫重新載入時呼叫，整池重做。"""
+        with self._lock:
+            self._signature = None
+            self._generation += 1
+            self._shared.clear()
+            self._students.clear()
+        self._wake.set()
+
+    def refresh(self, account):
+        """學生交卷後呼叫：錯題 / 能力變了，丟掉替他預做的考卷，需要的話重新排隊做。"""
+        with self._lock:
+            self._account_gen[account] = self._account_gen.get(account, 0) + 1
+            self._students.pop(account, None)
+        if self._per_student(self._settings_getter()):
+            self._pending_accounts.append(account)
+            self._wake.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "shared": len(self._shared),
+                "students": sum(len(q) for q in self._students.values()),
+            }
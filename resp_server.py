@@ -0,0 +1,249 @@
+"""本機用的迷你 Redis 協定伺服器（全部存在記憶體，只實作本系統用到的指令）。
+
+沒有裝 Redis 也能測 QUIZ_STORAGE=redis://... 的後端：
+  python resp_server.py --port 6399
+  QUIZ_STORAGE=redis://127.0.0.1:6399/0 python app.py
+"""
+import argparse
+import bisect
+import socketserver
+import threading
+
+
+class RespError(Exception):
+    pass
+
+
+class MemoryStore:
+    def __init__(self):
+        self.dbs = {}
+        self.lock = threading.Lock()
+
+    def db(self, n):
+        return self.dbs.setdefault(n, {})
+
+
+def _encode(value):
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, RespError):
+        return b"-ERR %s\r\n" % str(value).encode("utf-8")
+    if isinstance(value, (list, tuple)):
+        return b"*%d\r\n" % len(value) + b"".join(_encode(v) for v in value)
+    if isinstance(value, SimpleString):
+        return b"+%s\r\n" % value.encode("utf-8")
+    data = value if isinstance(value, bytes) else str(value).encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+class SimpleString(str):
+    pass
+
+
+class SortedSet:
+    """Redis 的 sorted set：成員 -> 分數，另外維持一份依 (分數, 成員) 排好的 list，用 bisect 查。"""
+
+    def __init__(self):
+        self.scores = {}
+        self.order = []
+
+    def __len__(self):
+        return len(self.scores)
+
+    def incr(self, member, delta):
+        old = self.scores.get(member)
+        if old is not None:
+            self.order.pop(bisect.bisect_left(self.order, (old, member)))
+        new = (old or 0.0) + delta
+        self.scores[member] = new
+        bisect.insort(self.order, (new, member))
+        return new
+
+    def score(self, member):
+        return self.scores.get(member)
+
+    def count(self, low, high):
+        """low / high 是 (分數, 是否不含端點)。"""
+        lo = bisect.bisect_right(self.order, (low[0], _MAX)) if low[1] else bisect.bisect_left(self.order, (low[0],))
+        hi = bisect.bisect_left(self.order, (high[0],)) if high[1] else bisect.bisect_right(self.order, (high[0], _MAX))
+        return max(0, hi - lo)
+
+    def revrange(self, start, stop):
+        items = self.order[::-1]
+        stop = len(items) if stop == -1 else stop + 1
+        return [(member, score) for score, member in items[start:stop]]
+
+
+_MAX = "\U0010ffff"   # 比任何成員名稱都大，bisect 找「同分的最後一個」用
+
+
+def _parse_bound(text):
+    exclusive = text.startswith("(")
+    return float(text.lstrip("(")), exclusive
+
+
+def _format_score(score):
+    return str(int(score)) if score == int(score) else repr(score)
+
+
+OK = SimpleString("OK")
+QUEUED = SimpleString("QUEUED")
+
+
+class Handler(socketserver.StreamRequestHandler):
+    store = None
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.decode("utf-8").split()   # inline 指令（方便用 telnet 測）
+        n = int(line[1:-2])
+        args = []
+        for _ in range(n):
+            size = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(size + 2)[:-2].decode("utf-8"))
+        return args
+
+    def handle(self):
+        self.dbno = 0
+        self.queue = None
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            if not args:
+                continue
+            cmd = args[0].upper()
+            if cmd == "MULTI":
+                self.queue = []
+                reply = OK
+            elif cmd == "EXEC":
+                queued, self.queue = self.queue or [], None
+                with self.store.lock:
+                    reply = [self._run(a[0].upper(), a[1:]) for a in queued]
+            elif self.queue is not None:
+                self.queue.append(args)
+                reply = QUEUED
+            else:
+                with self.store.lock:
+                    reply = self._run(cmd, args[1:])
+            self.wfile.write(_encode(reply))
+
+    def _run(self, cmd, a):
+        try:
+            return self._dispatch(cmd, a)
+        except RespError as e:
+            return e
+        except (ValueError, IndexError, TypeError) as e:
+            return RespError(f"{cmd}: {e}")
+
+    def _dispatch(self, cmd, a):
+        d = self.store.db(self.dbno)
+        if cmd == "PING":
+            return SimpleString("PONG")
+        if cmd == "AUTH":
+            return OK
+        if cmd == "SELECT":
+            self.dbno = int(a[0])
+            return OK
+        if cmd == "FLUSHDB":
+            d.clear()
+            return OK
+        if cmd == "DEL":
+            return sum(1 for k in a if d.pop(k, None) is not None)
+        if cmd == "GET":
+            return d.get(a[0])
+        if cmd == "SET":
+            d[a[0]] = a[1]
+            return OK
+        if cmd == "INCRBY":
+            d[a[0]] = str(int(d.get(a[0], 0)) + int(a[1]))
+            return int(d[a[0]])
+        if cmd == "HSET":
+            h = d.setdefault(a[0], {})
+            added = 0
+            for k, v in zip(a[1::2], a[2::2]):
+                added += k not in h
+                h[k] = v
+            return added
+        if cmd == "HGETALL":
+            h = d.get(a[0], {})
+            return [x for kv in h.items() for x in kv]
+        if cmd == "HINCRBY":
+            h = d.setdefault(a[0], {})
+            h[a[1]] = str(int(h.get(a[1], 0)) + int(a[2]))
+            return int(h[a[1]])
+        if cmd == "SADD":
+            s = d.setdefault(a[0], set())
+            before = len(s)
+            s.update(a[1:])
+            return len(s) - before
+        if cmd == "SREM":
+            s = d.get(a[0], set())
+            before = len(s)
+            s.difference_update(a[1:])
+            return before - len(s)
+        if cmd == "SMEMBERS":
+            return sorted(d.get(a[0], set()))
+        if cmd == "SISMEMBER":
+            return a[1] in d.get(a[0], set())
+        if cmd == "RPUSH":
+            lst = d.setdefault(a[0], [])
+            lst.extend(a[1:])
+            return len(lst)
+        if cmd == "LLEN":
+            return len(d.get(a[0], []))
+        if cmd == "LRANGE":
+            lst = d.get(a[0], [])
+            start, stop = int(a[1]), int(a[2])
+            stop = len(lst) if stop == -1 else stop + 1
+            return lst[start:stop]
+        if cmd == "LTRIM":
+            lst = d.get(a[0], [])
+            start, stop = int(a[1]), int(a[2])
+            stop = len(lst) if stop == -1 else stop + 1
+            d[a[0]] = lst[start:stop]
+            return OK
+        if cmd == "ZINCRBY":
+            z = d.setdefault(a[0], SortedSet())
+            return _format_score(z.incr(a[2], float(a[1])))
+        if cmd == "ZSCORE":
+            z = d.get(a[0])
+            score = z.score(a[1]) if z else None
+            return None if score is None else _format_score(score)
+        if cmd == "ZCARD":
+            return len(d.get(a[0]) or ())
+        if cmd == "ZCOUNT":
+            z = d.get(a[0])
+            return z.count(_parse_bound(a[1]), _parse_bound(a[2])) if z else 0
+        if cmd == "ZREVRANGE":
+            z = d.get(a[0])
+            items = z.revrange(int(a[1]), int(a[2])) if z else []
+            if len(a) > 3 and a[3].upper() == "WITHSCORES":
+                return [x for m, sc in items for x in (m, _format_score(sc))]
+            return [m for m, _ in items]
+        raise RespError(f"unknown command '{cmd}'")
+
+
+def serve(host="127.0.0.1", port=6399):
+    store = MemoryStore()
+    handler = type("BoundHandler", (Handler,), {"store": store})
+    server = socketserver.ThreadingTCPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本機測試用的迷你 Redis 協定伺服器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6399)
+    args = parser.parse_args()
+    server = serve(args.host, args.port)
+    print(f"🧪 迷你 Redis 伺服器啟動：{args.host}:{args.port}")
+    server.serve_forever()
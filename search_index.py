@@ -0,0 +1,206 @@
+import hashlib
+import json
+import re
+import threading
+
+
+# 中日韓文字（題目幾乎都是中文）：切成單字 + 相鄰兩字
+_CJK_RE = re.compile(r"[㐀-䶿一-鿿豈-﫿]+")
+# 英文 / 數字 / 單位（例如 m/s、3×10^8）
+_WORD_RE = re.compile(r"[A-Za-z0-9]+(?:[./^×][A-Za-z0-9]+)*")
+
+
+def tokenize(text):
+    """中文用 bigram（加上單字，讓一個字的查詢也找得到），英數用整個詞（小寫）。"""
+    text = str(text or "")
+    tokens = []
+    for run in _CJK_RE.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.extend(w.lower() for w in _WORD_RE.findall(text))
+    return tokens
+
+
+def query_tokens(text):
+    """查詢字串的 token：中文只用 bigram（比單字精準），只有一個字時才用單字。"""
+    text = str(text or "")
+    tokens = []
+    for run in _CJK_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.extend(w.lower() for w in _WORD_RE.findall(text))
+    return tokens
+
+
+def _fingerprint(q):
+    raw = json.dumps(
+        [q.get("text"), q.get("options"), q.get("answer"), q.get("category"), q.get("explanation")],
+        ensure_ascii=False,
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class QuestionIndex:
+    """題庫的倒排索引：題目文字、分類、答案各一份。
+
+    題庫重新載入時呼叫 update()，只重建有改過的題目。
+    給 loader 的話，第一次查詢時才呼叫 loader() 載入題庫（import 時不讀 Excel）。
+    """
+
+    def __init__(self, bank=(), loader=None):
+        self._lock = threading.RLock()
+        self._loader = loader
+        self._bank = []          # 目前的題庫 list（照題庫順序）
+        self._docs = {}          # qid -> 題目 dict
+        self._order = {}         # qid -> 在題庫中的順序（搜尋結果照題庫順序排）
+        self._prints = {}        # qid -> 內容指紋
+        self._tokens = {}        # qid -> 這題索引了哪些 token（刪除時用）
+        self._postings = {}      # token -> set(qid)
+        self._by_category = {}   # 分類 -> set(qid)
+        self._by_answer = {}     # 答案 -> set(qid)
+        self._lists = {}         # 分類 -> 題目 list（抽題用，update 時作廢）
+        if bank:
+            self.update(bank)
+
+    # ===== 建索引 =====
+
+    def _add(self, q):
+        qid = q["id"]
+        toks = set(tokenize(q.get("text")))
+        self._docs[qid] = q
+        self._tokens[qid] = toks
+        for t in toks:
+            self._postings.setdefault(t, set()).add(qid)
+        self._by_category.setdefault(q.get("category") or "", set()).add(qid)
+        self._by_answer.setdefault(str(q.get("answer") or "").strip(), set()).add(qid)
+
+    def _remove(self, qid):
+        q = self._docs.pop(qid)
+        for t in self._tokens.pop(qid, ()):
+            s = self._postings.get(t)
+            if s is not None:
+                s.discard(qid)
+                if not s:
+                    del self._postings[t]
+        for table, key in ((self._by_category, q.get("category") or ""),
+                           (self._by_answer, str(q.get("answer") or "").strip())):
+            s = table.get(key)
+            if s is not None:
+                s.discard(qid)
+                if not s:
+                    del table[key]
+
+    def _ensure_loaded(self):
+        if self._loader is None:
+            return
+        with self._lock:
+            loader, self._loader = self._loader, None
+            if loader is not None:
+                self.update(loader())
+
+    def update(self, bank):
+        """和目前索引比對，只處理新增 / 修改 / 刪除的題目；回傳 (新增, 修改, 刪除) 題數。"""
+        with self._lock:
+            self._loader = None
+            incoming = {q["id"]: q for q in bank}
+            added = changed = removed = 0
+
+            for qid in list(self._docs):
+                if qid not in incoming:
+                    self._remove(qid)
+                    self._prints.pop(qid, None)
+                    removed += 1
+
+            for qid, q in incoming.items():
+                fp = _fingerprint(q)
+                if qid in self._docs:
+                    if self._prints.get(qid) == fp:
+                        self._docs[qid] = q   # 內容一樣，只換成新的物件
+                        continue
+                    self._remove(qid)
+                    changed += 1
+                else:
+                    added += 1
+                self._add(q)
+                self._prints[qid] = fp
+
+            self._bank = list(bank)
+            self._order = {q["id"]: i for i, q in enumerate(bank)}
+            self._lists = {}
+            return added, changed, removed
+
+    # ===== 查詢 =====
+
+    def bank(self):
+        """整個題庫 list（第一次呼叫時才載入）；同一次載入回傳同一個 list 物件。"""
+        self._ensure_loaded()
+        return self._bank
+
+    def ids(self):
+        """所有題號（照題庫順序）。"""
+        self._ensure_loaded()
+        return [q["id"] for q in self._bank]
+
+    def get(self, qid):
+        self._ensure_loaded()
+        return self._docs.get(qid)
+
+    def get_many(self, qids):
+        """依題庫順序回傳這些 ID 的題目（不存在的略過）。"""
+        self._ensure_loaded()
+        found = [qid for qid in qids if qid in self._docs]
+        found.sort(key=lambda qid: self._order.get(qid, 0))
+        return [self._docs[qid] for qid in found]
+
+    def categories(self):
+        """[(分類, 題數)]，依分類名稱排序。"""
+        self._ensure_loaded()
+        with self._lock:
+            return sorted((c, len(ids)) for c, ids in self._by_category.items())
+
+    def category_ids(self, category):
+        self._ensure_loaded()
+        return self._by_category.get(category or "", set())
+
+    def in_category(self, category=None):
+        """某分類的題目 list（沒給分類就是全部）；同一個分類會回傳同一個 list 物件。"""
+        key = category or None
+        self._ensure_loaded()
+        with self._lock:
+            lst = self._lists.get(key)
+            if lst is None:
+                ids = self._docs.keys() if key is None else self._by_category.get(key, ())
+                lst = self.get_many(ids)
+                self._lists[key] = lst
+            return lst
+
+    def search(self, text="", category=None, answer=None, limit=50):
+        """關鍵字 + 分類 + 答案的交集；從最小的集合開始交，不會掃整個題庫。"""
+        self._ensure_loaded()
+        with self._lock:
+            sets = []
+            for t in set(query_tokens(text)):
+                sets.append(self._postings.get(t, set()))
+            if category:
+                sets.append(self._by_category.get(category, set()))
+            if answer:
+                sets.append(self._by_answer.get(str(answer).strip(), set()))
+
+            if not sets:
+                hits = set(self._docs)
+            else:
+                sets.sort(key=len)
+                hits = set(sets[0])
+                for s in sets[1:]:
+                    if not hits:
+                        break
+                    hits &= s
+
+            results = self.get_many(hits)
+            return results[:limit] if limit else results
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._docs)
@@ -0,0 +1,459 @@
+"""跨 gunicorn worker 共用的唯讀快取：題庫索引、排行榜分數，存成記憶體對映（mmap）檔案。
+
+每個 worker 各自 json 讀一份題庫 / 各算一份排行榜，記憶體會隨 worker 數線性增加。
+這裡把資料一次寫成一個二進位檔（預設放 /dev/shm），每個 worker 只 mmap 進來：
+  - 檔案內容由作業系統的 page cache 共用，不會每個 worker 各一份
+  - 查詢直接在 mmap 上二分搜尋 / 讀 uint32 陣列，題目要用到才 json 解碼
+  - gunicorn --preload 時由 master 先建好（見 gunicorn.conf.py），fork 出來的 worker 直接沿用
+
+檔案格式：
+  MAGIC(8) + 表頭長度(uint32) + 表頭 JSON + 各區段（8 byte 對齊）
+  表頭 JSON = {"meta": {...}, "sections": {名稱: [typecode, 相對位移, bytes]}}
+"""
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from collections.abc import Sequence
+from contextlib import contextmanager
+
+try:
+    import fcntl  # Windows 沒有，就不做跨行程的建檔鎖
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from search_index import tokenize, query_tokens, _fingerprint
+
+
+MAGIC = b"QSHM0001"
+FORMAT_VERSION = 1
+CHECK_INTERVAL = 0.5        # 每隔幾秒看一次檔案有沒有被別的 worker 換掉
+LEADERBOARD_TTL = 10.0      # 排行榜分數最多舊幾秒
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def shared_dir():
+    """放共用檔的資料夾：QUIZ_SHARED_DIR > /dev/shm（記憶體檔案系統）> 系統暫存資料夾。"""
+    d = os.environ.get("QUIZ_SHARED_DIR")
+    if d:
+        return d
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def shared_path(name, suffix=".shm"):
+    """同一台機器上不同部署（不同資料夾）各用各的檔案。"""
+    tag = hashlib.sha1(BASE_DIR.encode("utf-8")).hexdigest()[:10]
+    return os.path.join(shared_dir(), f"physics-quiz-{tag}-{name}{suffix}")
+
+
+def _file_key(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+@contextmanager
+def _build_lock(path):
+    """建檔時上鎖：同時開機的幾個 worker 只有一個真的去建，其他人等它建好直接用。"""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+# ===== 寫入 / 讀取 =====
+
+class SegmentWriter:
+    def __init__(self, meta=None):
+        self.meta = dict(meta or {})
+        self._sections = []   # (名稱, typecode, bytes)
+
+    def add_array(self, name, typecode, values):
+        self._sections.append((name, typecode, array(typecode, values).tobytes()))
+
+    def add_strings(self, name, strings):
+        """字串表：name.off（uint32 位移，比字串數多一個）+ name.data（UTF-8 接在一起）。"""
+        offsets = [0]
+        chunks = []
+        for s in strings:
+            b = s.encode("utf-8")
+            chunks.append(b)
+            offsets.append(offsets[-1] + len(b))
+        self.add_array(name + ".off", "I", offsets)
+        self._sections.append((name + ".data", "B", b"".join(chunks)))
+
+    def write(self, path):
+        """寫到暫存檔再 os.replace，讀的人永遠看到完整的舊檔或新檔。"""
+        sections = {}
+        pos = 0
+        for name, typecode, data in self._sections:
+            sections[name] = [typecode, pos, len(data)]
+            pos += len(data) + (-len(data) % 8)
+        header = json.dumps({"meta": self.meta, "sections": sections}, ensure_ascii=False).encode("utf-8")
+
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(MAGIC + struct.pack("<I", len(header)) + header)
+            f.write(b"\0" * (-(len(MAGIC) + 4 + len(header)) % 8))
+            for _, _, data in self._sections:
+                f.write(data)
+                f.write(b"\0" * (-len(data) % 8))
+        os.replace(tmp, path)
+
+
+class Segment:
+    """一個 mmap 進來的共用檔；array() / strings() 回傳的都是直接指向 mmap 的 view，不複製。"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.key = _file_key(path)
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"不是共用快取檔：{path}")
+        (header_len,) = struct.unpack_from("<I", self._mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(self._mm[start:start + header_len].decode("utf-8"))
+        self.meta = header["meta"]
+        self._sections = header["sections"]
+        data_start = start + header_len
+        self._base = data_start + (-data_start % 8)
+        self._view = memoryview(self._mm)
+        self._tables = {}
+
+    def array(self, name):
+        typecode, offset, nbytes = self._sections[name]
+        view = self._view[self._base + offset:self._base + offset + nbytes]
+        return view if typecode == "B" else view.cast(typecode)
+
+    def strings(self, name):
+        table = self._tables.get(name)
+        if table is None:
+            table = self._tables[name] = StringTable(self.array(name + ".off"), self.array(name + ".data"))
+        return table
+
+    def doc(self, i):
+        """第 i 題（json 解碼成 dict，每次都是新的物件，呼叫的人可以隨意修改）。"""
+        return json.loads(self.strings("docs")[i])
+
+
+class StringTable(Sequence):
+    """mmap 上的字串陣列；排序過的表可以直接用 bisect 查。"""
+
+    def __init__(self, offsets, data):
+        self._off = offsets
+        self._data = data
+
+    def __len__(self):
+        return len(self._off) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return bytes(self._data[self._off[i]:self._off[i + 1]]).decode("utf-8")
+
+    def find(self, key):
+        """在排序過的表裡找 key，回傳位置；沒有就回傳 -1。"""
+        i = bisect.bisect_left(self, key)
+        return i if i < len(self) and self[i] == key else -1
+
+
+# ===== 題庫索引 =====
+
+class _DocList(Sequence):
+    """一串題目（存的是題目編號），取到哪題才解碼哪題；random.sample 可以直接用。"""
+
+    def __init__(self, seg, docs):
+        self._seg = seg       # 綁定建立時的那份檔案，題庫重新載入也不會錯位
+        self._docs = docs     # range 或 uint32 view
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __getitem__(self, i):
+        return self._seg.doc(self._docs[i])
+
+
+class SharedQuestionIndex:
+    """和 search_index.QuestionIndex 一樣的查詢介面，但資料放在共用的 mmap 檔。
+
+    第一次查詢時：檔案存在而且是同一版 questions.xlsx 建的就直接 mmap，
+    否則呼叫 loader() 讀題庫、建檔（多個 worker 同時開機只會建一次）。
+    update() 重建檔案後，其他 worker 會在 CHECK_INTERVAL 秒內自動換成新檔。
+    """
+
+    def __init__(self, path, loader=None, source=None):
+        self.path = path
+        self._loader = loader
+        self._source = source        # 題庫來源檔（questions.xlsx），用來判斷共用檔是不是舊的
+        self._lock = threading.RLock()
+        self._seg = None
+        self._checked = 0.0
+        self._lists = {}             # 分類 -> _DocList（同一份檔案回傳同一個物件）
+
+    # ===== 建檔 =====
+
+    def _source_key(self):
+        key = _file_key(self._source) if self._source else None
+        return [FORMAT_VERSION, list(key[1:]) if key else None]
+
+    def _write(self, bank):
+        docs = [json.dumps(q, ensure_ascii=False) for q in bank]
+        ids = [q["id"] for q in bank]
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+
+        postings = {}
+        by_category = {}
+        by_answer = {}
+        for i, q in enumerate(bank):
+            for t in set(tokenize(q.get("text"))):
+                postings.setdefault(t, []).append(i)
+            by_category.setdefault(q.get("category") or "", []).append(i)
+            by_answer.setdefault(str(q.get("answer") or "").strip(), []).append(i)
+
+        w = SegmentWriter({"source": self._source_key(), "built_at": time.time(), "count": len(bank)})
+        w.add_strings("docs", docs)
+        w.add_strings("ids", ids)
+        w.add_strings("prints", [_fingerprint(q) for q in bank])
+        w.add_strings("ids_sorted", [ids[i] for i in order])
+        w.add_array("ids_doc", "I", order)
+        for name, table in (("tok", postings), ("cat", by_category), ("ans", by_answer)):
+            keys = sorted(table)
+            offsets = [0]
+            flat = []
+            for k in keys:
+                flat.extend(table[k])
+                offsets.append(len(flat))
+            w.add_strings(name, keys)
+            w.add_array(name + ".post_off", "I", offsets)
+            w.add_array(name + ".post", "I", flat)
+        w.write(self.path)
+
+    def _map(self):
+        self._seg = Segment(self.path)
+        self._lists = {}
+        self._checked = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._seg is not None and time.monotonic() - self._checked < CHECK_INTERVAL:
+            return self._seg
+        with self._lock:
+            if self._seg is not None:
+                self._checked = time.monotonic()
+                key = _file_key(self.path)
+                if key is not None and key != self._seg.key:
+                    self._map()     # 別的 worker 重新載入過題庫
+                return self._seg
+
+            with _build_lock(self.path):
+                if _file_key(self.path) is not None:
+                    seg = Segment(self.path)
+                    if seg.meta.get("source") == self._source_key() or self._loader is None:
+                        self._seg = seg
+                        self._checked = time.monotonic()
+                        return seg
+                bank = self._loader() if self._loader is not None else []
+                self._write(bank)
+                self._map()
+            return self._seg
+
+    def update(self, bank):
+        """重建共用檔；回傳 (新增, 修改, 刪除) 題數（和 QuestionIndex.update 一樣）。"""
+        with self._lock:
+            seg = self._seg
+            if seg is None and _file_key(self.path) is not None:
+                try:
+                    seg = Segment(self.path)
+                except ValueError:
+                    seg = None
+            old = {}
+            if seg is not None:
+                ids, prints = seg.strings("ids"), seg.strings("prints")
+                old = {ids[i]: prints[i] for i in range(len(ids))}
+            added = changed = 0
+            incoming = set()
+            for q in bank:
+                incoming.add(q["id"])
+                fp = old.get(q["id"])
+                if fp is None:
+                    added += 1
+                elif fp != _fingerprint(q):
+                    changed += 1
+            removed = sum(1 for qid in old if qid not in incoming)
+
+            with _build_lock(self.path):
+                self._write(bank)
+            self._map()
+            return added, changed, removed
+
+    # ===== 查詢 =====
+
+    def _posting(self, seg, name, key):
+        i = seg.strings(name).find(key)
+        if i < 0:
+            return ()
+        off = seg.array(name + ".post_off")
+        return seg.array(name + ".post")[off[i]:off[i + 1]]
+
+    def _doc_index(self, seg, qid):
+        i = seg.strings("ids_sorted").find(str(qid))
+        return seg.array("ids_doc")[i] if i >= 0 else None
+
+    def bank(self):
+        return self.in_category(None)
+
+    def ids(self):
+        """所有題號（照題庫順序）。"""
+        return list(self._ensure_loaded().strings("ids"))
+
+    def get(self, qid):
+        seg = self._ensure_loaded()
+        i = self._doc_index(seg, qid)
+        return seg.doc(i) if i is not None else None
+
+    def get_many(self, qids):
+        """依題庫順序回傳這些 ID 的題目（不存在的略過）。"""
+        seg = self._ensure_loaded()
+        found = {self._doc_index(seg, qid) for qid in qids}
+        found.discard(None)
+        return [seg.doc(i) for i in sorted(found)]
+
+    def categories(self):
+        seg = self._ensure_loaded()
+        names = seg.strings("cat")
+        off = seg.array("cat.post_off")
+        return [(names[i], off[i + 1] - off[i]) for i in range(len(names))]
+
+    def category_ids(self, category):
+        seg = self._ensure_loaded()
+        ids = seg.strings("ids")
+        return {ids[i] for i in self._posting(seg, "cat", category or "")}
+
+    def in_category(self, category=None):
+        key = category or None
+        seg = self._ensure_loaded()
+        with self._lock:
+            lst = self._lists.get(key)
+            if lst is None:
+                docs = range(seg.meta["count"]) if key is None else self._posting(seg, "cat", key)
+                lst = _DocList(seg, docs)
+                self._lists[key] = lst
+            return lst
+
+    def search(self, text="", category=None, answer=None, limit=50):
+        seg = self._ensure_loaded()
+        sets = [self._posting(seg, "tok", t) for t in set(query_tokens(text))]
+        if category:
+            sets.append(self._posting(seg, "cat", category))
+        if answer:
+            sets.append(self._posting(seg, "ans", str(answer).strip()))
+
+        if not sets:
+            hits = range(seg.meta["count"])
+        else:
+            sets.sort(key=len)
+            hits = set(sets[0])
+            for s in sets[1:]:
+                if not hits:
+                    break
+                hits &= set(s)
+            hits = sorted(hits)
+        if limit:
+            hits = hits[:limit]
+        return [seg.doc(i) for i in hits]
+
+    def __len__(self):
+        return self._ensure_loaded().meta["count"]
+
+
+# ===== 排行榜 =====
+
+class SharedLeaderboard:
+    """全部學生的總積分（排序好的 int64 陣列），排名用 bisect 在 mmap 上查。
+
+    檔案超過 ttl 秒就由下一個用到的 worker 重建（拿不到鎖的人先用舊的），
+    學生自己的分數則是查詢時帶進來的最新值，所以剛交卷的人名次一定是對的。
+    """
+
+    def __init__(self, path, loader, ttl=LEADERBOARD_TTL):
+        self.path = path
+        self._loader = loader        # () -> [總積分, ...]
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._seg = None
+        self._checked = 0.0
+
+    def _rebuild(self):
+        points = sorted(int(p or 0) for p in self._loader())
+        w = SegmentWriter({
+            "built_at": time.time(),
+            "count": len(points),
+            "sum": sum(points),
+            "max": points[-1] if points else None,
+        })
+        w.add_array("points", "q", points)
+        w.write(self.path)
+
+    def _segment(self):
+        now = time.monotonic()
+        if self._seg is not None and now - self._checked < CHECK_INTERVAL \
+                and time.time() - self._seg.meta["built_at"] < self.ttl:
+            return self._seg
+        with self._lock:
+            self._checked = now
+            key = _file_key(self.path)
+            if key is not None and (self._seg is None or key != self._seg.key):
+                self._seg = Segment(self.path)
+            if self._seg is None or time.time() - self._seg.meta["built_at"] >= self.ttl:
+                with _build_lock(self.path):
+                    # 等鎖的時候可能別人已經建好了
+                    key = _file_key(self.path)
+                    if key is not None and (self._seg is None or key != self._seg.key):
+                        self._seg = Segment(self.path)
+                    if self._seg is None or time.time() - self._seg.meta["built_at"] >= self.ttl:
+                        self._rebuild()
+                        self._seg = Segment(self.path)
+            return self._seg
+
+    def invalidate(self):
+        """下一次查詢一定重建（例如老師手動改了積分）。"""
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self._seg = None
+
+    def rank(self, points):
+        """總積分 points 排第幾名（同分同名次）。"""
+        seg = self._segment()
+        scores = seg.array("points")
+        return len(scores) - bisect.bisect_right(scores, int(points or 0)) + 1
+
+    def stats(self):
+        meta = self._segment().meta
+        count = meta["count"]
+        return {
+            "count": count,
+            "max": meta["max"],
+            "avg": round(meta["sum"] / count, 1) if count else None,
+            "built_at": meta["built_at"],
+        }
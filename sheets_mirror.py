@@ -0,0 +1,270 @@
+import atexit
+import re
+import threading
+import time
+
+
+# 表頭名稱（中英文都認得）
+ACCOUNT_HEADERS = ("account", "帳號")
+FIELD_HEADERS = {
+    "password": ("password", "密碼"),
+    "name": ("name", "姓名"),
+    "total_points": ("total_points", "總積分"),
+}
+
+FLUSH_INTERVAL = 2.0         # 最多累積幾秒就送出一批
+FLUSH_BATCH_SIZE = 50        # 累積幾筆就立刻送出
+RECONCILE_INTERVAL = 300.0   # 每幾秒跟試算表對一次帳號欄
+
+
+def _col_letter(col):
+    """1 -> A、27 -> AA"""
+    letters = ""
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+class SheetMirror:
+    """Google 試算表鏡像：本機記住「帳號 -> 第幾列」，寫入累積起來一次送出。
+
+    兩張工作表：
+      sheet_getter    帳號工作表（表頭有 account / 帳號 欄）：建索引、改密碼
+      results_getter  作答紀錄工作表：交卷只往後 append，不建索引
+                      （作答列的第一欄是時間，跟帳號表放同一張的話索引會混進時間字串）
+
+    - 改密碼不再 get_all_records() 整張下載，直接更新那一格
+    - 交卷的 append_row 與改密碼的 update_cell 都先排隊，合併成 append_rows / batch_update
+    - 定期只下載「帳號欄」做差異比對，新增的列補進索引，對不上就重建
+    """
+
+    def __init__(self, sheet_getter, results_getter, flush_interval=FLUSH_INTERVAL,
+                 batch_size=FLUSH_BATCH_SIZE, reconcile_interval=RECONCILE_INTERVAL):
+        self._sheet_getter = sheet_getter
+        self._results_getter = results_getter
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.reconcile_interval = reconcile_interval
+
+        self._lock = threading.RLock()
+        self._headers = None          # 第 1 列表頭
+        self._account_col = None      # 帳號在第幾欄（1 起算）
+        self._index = {}              # 帳號 -> 列號（同帳號多列時記第一列）
+        self._row_count = 0           # 目前已知的資料列數（含表頭）
+        self._reconciled_at = 0.0
+
+        self._pending_updates = {}    # "B5" -> 值（同一格只留最後一次）
+        self._pending_rows = []       # 等著 append 的列
+        self._wake = threading.Event()
+        self._thread = None
+        atexit.register(self.flush)
+
+    # ===== 索引 =====
+
+    def _sheet(self):
+        return self._sheet_getter()
+
+    def _load_index(self):
+        """第一次使用：只讀表頭和帳號欄建立索引。"""
+        ws = self._sheet()
+        headers = [str(h).strip() for h in ws.row_values(1)]
+        account_col = None
+        for name in ACCOUNT_HEADERS:
+            if name in headers:
+                account_col = headers.index(name) + 1
+                break
+        self._headers = headers
+        self._account_col = account_col
+        self._index = {}
+        self._row_count = 1
+        if account_col is not None:
+            self._index_column(ws.col_values(account_col), start_row=1)
+        self._reconciled_at = time.time()
+
+    def _index_column(self, values, start_row):
+        """values[0] 對應第 start_row 列；只補進還沒看過的帳號。"""
+        for offset, acc in enumerate(values):
+            row = start_row + offset
+            if row == 1:
+                continue
+            acc = str(acc).strip()
+            if acc and acc not in self._index:
+                self._index[acc] = row
+        self._row_count = max(self._row_count, start_row + len(values) - 1)
+
+    def _ensure_index(self):
+        with self._lock:
+            if self._headers is None:
+                self._load_index()
+            elif time.time() - self._reconciled_at > self.reconcile_interval:
+                self.reconcile()
+
+    def reconcile(self):
+        """差異比對：只下載帳號欄。列數變多就補索引；變少或抽查對不上就整個重建。"""
+        with self._lock:
+            if self._account_col is None:
+                self._load_index()
+                return
+            ws = self._sheet()
+            values = ws.col_values(self._account_col)
+            known = self._row_count
+            if len(values) < known or any(
+                str(values[row - 1]).strip() != acc
+                for acc, row in list(self._index.items())[:20]
+                if row <= len(values)
+            ):
+                print("🔄 Google 試算表有人手動改過，重建帳號索引")
+                self._index = {}
+                self._row_count = 1
+                self._index_column(values, start_row=1)
+            elif len(values) > known:
+                self._index_column(values[known:], start_row=known + 1)
+            self._reconciled_at = time.time()
+
+    def row_of(self, account):
+        self._ensure_index()
+        with self._lock:
+            return self._index.get(str(account).strip())
+
+    def column_of(self, field):
+        self._ensure_index()
+        with self._lock:
+            for name in FIELD_HEADERS.get(field, (field,)):
+                if name in self._headers:
+                    return self._headers.index(name) + 1
+        return None
+
+    # ===== 寫入（先排隊，再批次送出） =====
+
+    def update_field(self, account, field, value):
+        """把某帳號的某欄改成 value；找不到帳號或欄位回傳 False。"""
+        row = self.row_of(account)
+        col = self.column_of(field)
+        if row is None or col is None:
+            return False
+        with self._lock:
+            self._pending_updates[f"{_col_letter(col)}{row}"] = value
+        self._schedule()
+        return True
+
+    def append_row(self, values):
+        with self._lock:
+            self._pending_rows.append(list(values))
+        self._schedule()
+
+    def _schedule(self):
+        with self._lock:
+            pending = len(self._pending_updates) + len(self._pending_rows)
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="sheet-mirror", daemon=True)
+            self._thread.start()
+        if pending >= self.batch_size:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """把排隊中的寫入送出：更新合併成一個 batch_update，新增合併成一個 append_rows。
+
+        兩種各自送、各自重試；送失敗的放回佇列，下一輪再送（不讓學生看到錯誤）。
+        """
+        with self._lock:
+            updates, self._pending_updates = self._pending_updates, {}
+            rows, self._pending_rows = self._pending_rows, []
+
+        if updates:
+            try:
+                self._sheet().batch_update(
+                    [{"range": a1, "values": [[v]]} for a1, v in updates.items()],
+                    value_input_option="RAW",
+                )
+            except Exception as e:
+                print("更新 Google Sheet 帳號表失敗，稍後重試：", e)
+                with self._lock:
+                    for a1, v in updates.items():
+                        self._pending_updates.setdefault(a1, v)
+        if rows:
+            try:
+                self._results_getter().append_rows(rows, value_input_option="RAW")
+            except Exception as e:
+                print("寫入 Google Sheet 作答紀錄失敗，稍後重試：", e)
+                with self._lock:
+                    self._pending_rows[:0] = rows
+
+    def stats(self):
+        with self._lock:
+            return {
+                "indexed_accounts": len(self._index),
+                "row_count": self._row_count,
+                "pending_updates": len(self._pending_updates),
+                "pending_rows": len(self._pending_rows),
+            }
+
+
+class FakeWorksheet:
+    """離線版的 gspread Worksheet（只做本系統用到的方法），沒網路也能跑與測試。
+
+    calls 會記錄每種 API 被呼叫幾次，方便確認有沒有真的合併成批次。
+    """
+
+    title = "offline"
+
+    def __init__(self, rows=None):
+        self.rows = [list(r) for r in (rows or [])]
+        self.calls = {}
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def row_values(self, row):
+        self._count("row_values")
+        return [str(v) for v in self.rows[row - 1]] if row <= len(self.rows) else []
+
+    def col_values(self, col):
+        self._count("col_values")
+        values = [str(r[col - 1]) if len(r) >= col else "" for r in self.rows]
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def get_all_records(self):
+        self._count("get_all_records")
+        headers = self.rows[0] if self.rows else []
+        return [dict(zip(headers, r)) for r in self.rows[1:]]
+
+    def update_cell(self, row, col, value):
+        self._count("update_cell")
+        self._set(row, col, value)
+
+    def _set(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        r = self.rows[row - 1]
+        while len(r) < col:
+            r.append("")
+        r[col - 1] = value
+
+    def batch_update(self, data, value_input_option=None):
+        self._count("batch_update")
+        for item in data:
+            m = re.fullmatch(r"([A-Z]+)(\d+)", item["range"])
+            col = 0
+            for ch in m.group(1):
+                col = col * 26 + (ord(ch) - 64)
+            self._set(int(m.group(2)), col, item["values"][0][0])
+
+    def append_row(self, values, value_input_option=None):
+        self._count("append_row")
+        return self.append_rows([values])
+
+    def append_rows(self, values, value_input_option=None):
+        self._count("append_rows")
+        first = len(self.rows) + 1
+        self.rows.extend(list(v) for v in values)
+        width = max((len(v) for v in values), default=1)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{first}:{_col_letter(width)}{len(self.rows)}"}}
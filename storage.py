@@ -0,0 +1,1213 @@
+"""資料存取層：帳號、作答紀錄、設定、計數器都經過這裡。
+
+用環境變數 QUIZ_STORAGE 選擇後端：
+  xlsx（預設）             -> users.xlsx / quiz_results.xlsx / settings.json（原本的做法）
+  sqlite:路徑              -> 單一 SQLite 檔
+  redis://主機:埠/資料庫編號 -> 任何相容 Redis 協定的伺服器（多台 Render 共用）
+
+作答紀錄一律用 dict 表示：
+  {"time", "account", "name", "attempt_no", "score", "answers": {題目ID: (答案, "O"/"X")}}
+
+老師報表（全班排行、後台統計）請用 snapshot()：拿到的是某一瞬間的唯讀資料，
+讀很久也不會擋到交卷寫入，也不會讀到寫到一半的檔案。
+"""
+import bisect
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from types import MappingProxyType
+from urllib.parse import urlparse
+
+try:
+    import fcntl  # Windows 沒有，就只用執行緒鎖
+except ImportError:
+    fcntl = None
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+USER_FIELDS = ["account", "password", "name", "total_points"]
+RESULT_BASE_HEADERS = ["時間", "帳號", "姓名", "作答次數", "本次分數"]
+# quiz_results.xlsx 裡隱藏的工作表：交卷 API 的作答編號，和作答紀錄存在同一個檔（同一次換檔生效）
+ATTEMPTS_SHEET = "Attempts"
+
+
+class StorageError(Exception):
+    """後端讀寫失敗（例如 Redis 回傳錯誤）。"""
+
+
+def record_to_row(record, qids):
+    """把作答紀錄轉成 Excel / Google 試算表的一列（依 qids 的順序填各題答案與對錯）。"""
+    row = [
+        record["time"],
+        record["account"],
+        record["name"],
+        record["attempt_no"],
+        record["score"],
+    ]
+    answers = record.get("answers") or {}
+    for qid in qids:
+        ans, mark = answers.get(qid, ("", ""))
+        row.append(ans)
+        row.append(mark)
+    return row
+
+
+def _freeze(d):
+    """把 dict 包成唯讀（快照裡的資料大家共用，不能被改到）。"""
+    if "answers" in d:
+        d = dict(d, answers=MappingProxyType(dict(d["answers"])))
+    return MappingProxyType(d)
+
+
+class Snapshot:
+    """某一瞬間的帳號與作答紀錄（唯讀）。"""
+
+    def __init__(self, users, results):
+        self.users = tuple(_freeze(u) for u in users)
+        self.results = tuple(_freeze(r) for r in results)
+
+    def results_for(self, account):
+        return [r for r in self.results if r["account"] == account]
+
+
+class StorageBackend:
+    """所有後端共同的介面。"""
+
+    # ---- 帳號 ----
+    def get_user(self, account):
+        """回傳 {"account", "password", "name", "total_points"}，找不到回傳 None。"""
+        raise NotImplementedError
+
+    def list_users(self):
+        raise NotImplementedError
+
+    def set_password(self, account, new_password):
+        """成功回傳 True；帳號不存在回傳 False。"""
+        raise NotImplementedError
+
+    def add_points(self, account, delta):
+        """總積分加 delta，回傳新的總積分；帳號不存在回傳 None。"""
+        raise NotImplementedError
+
+    # ---- 作答紀錄 ----
+    def append_result(self, record):
+        """record 帶 "attempt_id"（交卷 API 的作答編號）時，編號要和這筆作答在同一次寫入裡一起生效。"""
+        raise NotImplementedError
+
+    def has_attempt(self, attempt_id):
+        """這個作答編號的成績已經寫進去了沒（交卷批改前檢查，重送不會記兩次）。"""
+        return any(rec.get("attempt_id") == attempt_id for rec in self.iter_results())
+
+    def iter_results(self, account=None):
+        """依寫入順序逐筆回傳作答紀錄；account 指定時只回傳該生的。"""
+        raise NotImplementedError
+
+    def iter_results_since(self, since):
+        """time >= since 的作答（依寫入順序）；批次工作只讀新進來的作答用。"""
+        for rec in self.iter_results():
+            if str(rec["time"]) >= since:
+                yield rec
+
+    def count_attempts(self, account):
+        return sum(1 for _ in self.iter_results(account))
+
+    def delete_results_before(self, cutoff):
+        """刪掉 time < cutoff 的作答（封存之後呼叫）；回傳刪了幾筆。"""
+        raise NotImplementedError
+
+    def snapshot(self):
+        """回傳 Snapshot；各後端會改寫成真正一致的版本。"""
+        return Snapshot(self.list_users(), list(self.iter_results()))
+
+    # ---- 設定 ----
+    def load_settings(self):
+        """回傳設定 dict；還沒存過回傳 None。"""
+        raise NotImplementedError
+
+    def save_settings(self, settings):
+        raise NotImplementedError
+
+    # ---- 文件（批次工作算好的結果，整包 JSON 讀寫） ----
+    def load_document(self, name):
+        """回傳 dict；還沒存過回傳 None。"""
+        raise NotImplementedError
+
+    def save_document(self, name, data):
+        raise NotImplementedError
+
+    # ---- 時段排行（rollup：每個時段一張「帳號 -> 該時段積分」的表，交卷時順手加上去） ----
+    def rollup_add(self, entries):
+        """entries = [(時段, 帳號, 積分), ...]，在同一個交易裡加上去。"""
+        raise NotImplementedError
+
+    def rollup_top(self, bucket, limit=50):
+        """該時段積分最高的 limit 人：[(帳號, 積分), ...]，由高到低。"""
+        raise NotImplementedError
+
+    def rollup_rank(self, bucket, account):
+        """回傳 (名次, 積分, 人數)；同分同名次，這個時段沒作答過名次是 None。"""
+        raise NotImplementedError
+
+    def rollup_clear(self):
+        """清掉所有時段排行（重建用）。"""
+        raise NotImplementedError
+
+    # ---- 其他 ----
+    def init(self, question_ids=()):
+        """第一次啟動時建立需要的檔案 / 資料表。"""
+
+    def put_user(self, user):
+        """新增或覆蓋一個帳號（搬資料用）。"""
+        raise NotImplementedError
+
+
+# ===== 時段排行表（SQLite；sqlite 後端放在同一個檔，xlsx 後端另外放一個小檔） =====
+
+class RollupTable:
+    """(時段, 帳號) -> 積分，另外有 (時段, 積分) 索引：前幾名走索引，不用掃作答紀錄。
+
+    名次：每個時段有一個版本號，跟著加分在同一個交易裡 +1。每個 worker 記住某個版本的
+    「該時段全部積分（排序好）」，版本沒變就用 bisect 查，不用每次看排行都 COUNT 一次。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS rollups (
+        bucket TEXT NOT NULL,
+        account TEXT NOT NULL,
+        points INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, account)
+    );
+    CREATE INDEX IF NOT EXISTS idx_rollups_points ON rollups (bucket, points);
+    CREATE TABLE IF NOT EXISTS rollup_generations (
+        bucket TEXT PRIMARY KEY,
+        generation INTEGER NOT NULL DEFAULT 0
+    );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._rank_lock = threading.Lock()
+        self._ranks = {}   # bucket -> (版本號, 由低到高排序的積分 list)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add(self, entries):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO rollups (bucket, account, points) VALUES (?, ?, ?) "
+                "ON CONFLICT(bucket, account) DO UPDATE SET points = points + excluded.points",
+                [(b, a, int(p)) for b, a, p in entries],
+            )
+            conn.executemany(
+                "INSERT INTO rollup_generations (bucket, generation) VALUES (?, 1) "
+                "ON CONFLICT(bucket) DO UPDATE SET generation = generation + 1",
+                [(b,) for b in {b for b, _, _ in entries}],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def top(self, bucket, limit=50):
+        rows = self._conn().execute(
+            "SELECT account, points FROM rollups WHERE bucket = ? ORDER BY points DESC, account LIMIT ?",
+            (bucket, limit),
+        ).fetchall()
+        return [(a, p) for a, p in rows]
+
+    def _sorted_points(self, conn, bucket):
+        """該時段全部積分（由低到高）；版本號沒變就用記憶體裡的。"""
+        row = conn.execute("SELECT generation FROM rollup_generations WHERE bucket = ?", (bucket,)).fetchone()
+        generation = row[0] if row else 0
+        with self._rank_lock:
+            cached = self._ranks.get(bucket)
+            if cached is not None and cached[0] == generation:
+                return cached[1]
+        # 版本號和積分在同一個讀取交易裡讀，讀到的積分一定是這個版本的
+        conn.execute("BEGIN")
+        try:
+            row = conn.execute("SELECT generation FROM rollup_generations WHERE bucket = ?", (bucket,)).fetchone()
+            generation = row[0] if row else 0
+            points = [p for (p,) in conn.execute(
+                "SELECT points FROM rollups WHERE bucket = ? ORDER BY points", (bucket,))]
+        finally:
+            conn.execute("COMMIT")
+        with self._rank_lock:
+            self._ranks[bucket] = (generation, points)
+        return points
+
+    def rank(self, bucket, account):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT points FROM rollups WHERE bucket = ? AND account = ?", (bucket, account)
+        ).fetchone()
+        points = self._sorted_points(conn, bucket)
+        if row is None:
+            return None, 0, len(points)
+        return len(points) - bisect.bisect_right(points, row[0]) + 1, row[0], len(points)
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM rollups")
+            # 版本號不歸零（歸零的話別的 worker 手上舊的排序可能剛好對到同一個號碼）
+            conn.execute("UPDATE rollup_generations SET generation = generation + 1")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+# ===== xlsx（原本的做法） =====
+
+class XlsxStorage(StorageBackend):
+    def __init__(self, users_file="users.xlsx", results_file="quiz_results.xlsx",
+                 settings_file="settings.json", rollups_file="rollups.sqlite3"):
+        self.users_file = users_file
+        self.results_file = results_file
+        self.settings_file = settings_file
+        self._rollups = RollupTable(rollups_file)
+        self._lock = threading.RLock()
+        self._snapshot_key = None
+        self._snapshot = None
+
+    @contextmanager
+    def _locked(self, path):
+        """寫入前上鎖：同一個 worker 用執行緒鎖，不同 worker 之間用 flock。"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(path + ".lock", "a") as lockf:
+                fcntl.flock(lockf, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lockf, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _commit_lock(self, exclusive):
+        """「換檔」用的鎖：寫入端換檔時拿排他鎖，讀快照時只在開檔那一下拿共享鎖。"""
+        if fcntl is None:
+            yield
+            return
+        path = os.path.join(os.path.dirname(os.path.abspath(self.users_file)), ".snapshot.lock")
+        with open(path, "a") as lockf:
+            fcntl.flock(lockf, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockf, fcntl.LOCK_UN)
+
+    def _save_atomic(self, wb, path):
+        """先存到暫存檔再 os.replace：讀的人只會看到舊檔或新檔，不會讀到存一半的 xlsx。"""
+        tmp = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            wb.save(tmp)
+            with self._commit_lock(exclusive=True):
+                os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    # ---- 帳號 ----
+
+    @staticmethod
+    def _users_sheet(wb):
+        try:
+            return wb["Users"]
+        except KeyError:
+            return wb.active
+
+    @staticmethod
+    def _user_columns(header_row):
+        headers = [str(v).strip() if v else "" for v in header_row]
+        if all(h in headers for h in USER_FIELDS):
+            return {h: headers.index(h) for h in USER_FIELDS}
+        # 舊版表頭（帳號 / 密碼 / 姓名 / 總積分）就照欄位順序
+        return {h: i for i, h in enumerate(USER_FIELDS)}
+
+    @staticmethod
+    def _user_from_row(row, col):
+        total = row[col["total_points"]] if len(row) > col["total_points"] else 0
+        return {
+            "account": str(row[col["account"]] or "").strip(),
+            "password": str(row[col["password"]] or "").strip(),
+            "name": str(row[col["name"]] or "").strip(),
+            "total_points": int(total) if isinstance(total, (int, float)) else 0,
+        }
+
+    def list_users(self, source=None):
+        from openpyxl import load_workbook
+
+        wb = load_workbook(source or self.users_file, read_only=True)
+        ws = self._users_sheet(wb)
+        rows = ws.iter_rows(values_only=True)
+        col = self._user_columns(next(rows, ()))
+        users = []
+        for row in rows:
+            if not row or not row[col["account"]]:
+                continue
+            users.append(self._user_from_row(row, col))
+        wb.close()
+        return users
+
+    def get_user(self, account):
+        account = str(account).strip()
+        for u in self.list_users():
+            if u["account"] == account:
+                return u
+        return None
+
+    def _update_user(self, account, field, func):
+        from openpyxl import load_workbook
+
+        with self._locked(self.users_file):
+            wb = load_workbook(self.users_file)
+            ws = self._users_sheet(wb)
+            col = self._user_columns([c.value for c in ws[1]])
+            for row in ws.iter_rows(min_row=2):
+                if str(row[col["account"]].value or "").strip() == str(account):
+                    cell = row[col[field]]
+                    cell.value = func(cell.value)
+                    self._save_atomic(wb, self.users_file)
+                    return cell.value
+        return None
+
+    def set_password(self, account, new_password):
+        return self._update_user(account, "password", lambda _: new_password) is not None
+
+    def add_points(self, account, delta):
+        return self._update_user(account, "total_points", lambda v: (v or 0) + delta)
+
+    def put_user(self, user):
+        from openpyxl import load_workbook
+
+        with self._locked(self.users_file):
+            wb = load_workbook(self.users_file)
+            ws = self._users_sheet(wb)
+            col = self._user_columns([c.value for c in ws[1]])
+            for row in ws.iter_rows(min_row=2):
+                if str(row[col["account"]].value or "").strip() == user["account"]:
+                    for f in USER_FIELDS:
+                        row[col[f]].value = user[f]
+                    break
+            else:
+                ws.append([user[f] for f in USER_FIELDS])
+            self._save_atomic(wb, self.users_file)
+
+    # ---- 作答紀錄 ----
+
+    @staticmethod
+    def _question_columns(headers):
+        """表頭 -> {題目ID: (答案欄索引, 對錯欄索引)}"""
+        q_cols = {}
+        for i in range(5, len(headers) - 1, 2):
+            ans_h = headers[i]
+            if ans_h and "_答案" in str(ans_h):
+                q_cols[str(ans_h).split("_答案")[0]] = (i, i + 1)
+        return q_cols
+
+    @staticmethod
+    def _record_from_row(row, q_cols):
+        tstr, acc, nm, attempt_no, score = (tuple(row) + (None,) * 5)[:5]
+        answers = {}
+        for qid, (ai, mi) in q_cols.items():
+            mark = row[mi] if mi < len(row) else None
+            if mark:
+                answers[qid] = (row[ai] or "", mark)
+        return {
+            "time": str(tstr) if tstr else "",
+            "account": acc,
+            "name": nm,
+            "attempt_no": attempt_no,
+            "score": score or 0,
+            "answers": answers,
+        }
+
+    def iter_results(self, account=None, source=None):
+        from openpyxl import load_workbook
+
+        try:
+            wb = load_workbook(source or self.results_file, read_only=True)
+        except FileNotFoundError:
+            return
+        ws = wb["Results"]
+        rows = ws.iter_rows(values_only=True)
+        q_cols = self._question_columns(list(next(rows, ())))
+        try:
+            for row in rows:
+                if not row or (account is not None and row[1] != account):
+                    continue
+                yield self._record_from_row(row, q_cols)
+        finally:
+            wb.close()
+
+    def append_result(self, record):
+        from openpyxl import load_workbook
+
+        with self._locked(self.results_file):
+            wb = load_workbook(self.results_file)
+            ws = wb["Results"]
+            headers = [c.value for c in ws[1]]
+            q_cols = self._question_columns(headers)
+
+            # 題庫新增的題目還沒有欄位，就補在表頭最後
+            for qid in record.get("answers", {}):
+                if qid not in q_cols:
+                    ws.cell(row=1, column=len(headers) + 1, value=f"{qid}_答案")
+                    ws.cell(row=1, column=len(headers) + 2, value=f"{qid}_是否正確")
+                    headers += [f"{qid}_答案", f"{qid}_是否正確"]
+                    q_cols[qid] = (len(headers) - 2, len(headers) - 1)
+
+            ordered = sorted(q_cols, key=lambda q: q_cols[q][0])
+            ws.append(record_to_row(record, ordered))
+            if record.get("attempt_id"):
+                if ATTEMPTS_SHEET in wb.sheetnames:
+                    attempts = wb[ATTEMPTS_SHEET]
+                else:
+                    attempts = wb.create_sheet(ATTEMPTS_SHEET)
+                    attempts.sheet_state = "hidden"
+                    attempts.append(["作答編號", "時間", "帳號"])
+                attempts.append([record["attempt_id"], record["time"], record["account"]])
+            self._save_atomic(wb, self.results_file)
+
+    def has_attempt(self, attempt_id):
+        from openpyxl import load_workbook
+
+        try:
+            wb = load_workbook(self.results_file, read_only=True)
+        except FileNotFoundError:
+            return False
+        try:
+            if ATTEMPTS_SHEET not in wb.sheetnames:
+                return False
+            return any(row and row[0] == attempt_id
+                       for row in wb[ATTEMPTS_SHEET].iter_rows(min_row=2, max_col=1, values_only=True))
+        finally:
+            wb.close()
+
+    def delete_results_before(self, cutoff):
+        """重寫一份只剩 cutoff 之後的 quiz_results.xlsx（表頭不變）。"""
+        from openpyxl import Workbook, load_workbook
+
+        with self._locked(self.results_file):
+            src = load_workbook(self.results_file, read_only=True)
+            rows = src["Results"].iter_rows(values_only=True)
+            wb = Workbook()
+            ws = wb.active
+            ws.title = "Results"
+            ws.append(list(next(rows, ())))
+            removed = 0
+            for row in rows:
+                if not row:
+                    continue
+                if row[0] and str(row[0]) < cutoff:
+                    removed += 1
+                    continue
+                ws.append(list(row))
+            if ATTEMPTS_SHEET in src.sheetnames:
+                attempts = wb.create_sheet(ATTEMPTS_SHEET)
+                attempts.sheet_state = "hidden"
+                for i, row in enumerate(src[ATTEMPTS_SHEET].iter_rows(values_only=True)):
+                    if i == 0 or (row and str(row[1]) >= cutoff):
+                        attempts.append(list(row))
+            src.close()
+            if removed:
+                self._save_atomic(wb, self.results_file)
+            return removed
+
+    def snapshot(self):
+        """在共享鎖下同時打開兩個檔案，之後慢慢解析也不怕被換掉（換檔不影響已開啟的檔案）。
+
+        兩個檔案都沒變過就直接回傳上一次解析好的快照。
+        """
+        with self._commit_lock(exclusive=False):
+            users_f = open(self.users_file, "rb")
+            try:
+                results_f = open(self.results_file, "rb")
+            except FileNotFoundError:
+                results_f = None
+
+        try:
+            key = tuple(
+                (st.st_ino, st.st_mtime_ns, st.st_size)
+                for st in (os.fstat(f.fileno()) for f in (users_f, results_f) if f)
+            )
+            with self._lock:
+                if key == self._snapshot_key:
+                    return self._snapshot
+            users = self.list_users(source=users_f)
+            results = list(self.iter_results(source=results_f)) if results_f else []
+            snap = Snapshot(users, results)
+            with self._lock:
+                self._snapshot_key, self._snapshot = key, snap
+            return snap
+        finally:
+            users_f.close()
+            if results_f:
+                results_f.close()
+
+    # ---- 設定 ----
+
+    def load_settings(self):
+        if not os.path.exists(self.settings_file):
+            return None
+        try:
+            with open(self.settings_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_settings(self, settings):
+        with open(self.settings_file, "w", encoding="utf-8") as f:
+            json.dump(settings, f, ensure_ascii=False, indent=2)
+
+    # ---- 文件（和 settings.json 放同一個資料夾，<名稱>.json） ----
+
+    def _document_path(self, name):
+        return os.path.join(os.path.dirname(self.settings_file), f"{name}.json")
+
+    def load_document(self, name):
+        try:
+            with open(self._document_path(name), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_document(self, name, data):
+        path = self._document_path(name)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    # ---- 時段排行（存在 rollups.sqlite3，xlsx 沒辦法有索引） ----
+
+    def rollup_add(self, entries):
+        self._rollups.add(entries)
+
+    def rollup_top(self, bucket, limit=50):
+        return self._rollups.top(bucket, limit)
+
+    def rollup_rank(self, bucket, account):
+        return self._rollups.rank(bucket, account)
+
+    def rollup_clear(self):
+        self._rollups.clear()
+
+    # ---- 初始化 ----
+
+    def init(self, question_ids=()):
+        from openpyxl import Workbook
+
+        if not os.path.exists(self.users_file):
+            wb = Workbook()
+            ws = wb.active
+            ws.title = "Users"
+            ws.append(USER_FIELDS)
+            # 測試資料：之後你可以改成真正學生名單
+            ws.append(["s001", "1234", "小明", 0])
+            ws.append(["s002", "1234", "小美", 0])
+            self._save_atomic(wb, self.users_file)
+
+        if not os.path.exists(self.results_file):
+            wb = Workbook()
+            ws = wb.active
+            ws.title = "Results"
+            headers = list(RESULT_BASE_HEADERS)
+            # 依照題庫動態加欄位：每題兩欄（答案 / 是否正確）
+            for qid in question_ids:
+                headers.append(f"{qid}_答案")
+                headers.append(f"{qid}_是否正確")
+            ws.append(headers)
+            self._save_atomic(wb, self.results_file)
+
+
+# ===== SQLite =====
+
+class SQLiteStorage(StorageBackend):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        account TEXT PRIMARY KEY,
+        password TEXT NOT NULL,
+        name TEXT NOT NULL DEFAULT '',
+        total_points INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        time TEXT NOT NULL,
+        account TEXT NOT NULL,
+        name TEXT,
+        attempt_no INTEGER,
+        score INTEGER NOT NULL DEFAULT 0,
+        answers TEXT NOT NULL DEFAULT '{}'
+    );
+    CREATE INDEX IF NOT EXISTS idx_results_account ON results (account, id);
+    CREATE TABLE IF NOT EXISTS attempts (
+        attempt_id TEXT PRIMARY KEY,
+        result_id INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._rollups = RollupTable(path)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _tx(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _user(row):
+        return dict(zip(USER_FIELDS, row)) if row else None
+
+    def get_user(self, account):
+        row = self._conn().execute(
+            "SELECT account, password, name, total_points FROM users WHERE account = ?",
+            (str(account).strip(),),
+        ).fetchone()
+        return self._user(row)
+
+    def list_users(self):
+        rows = self._conn().execute(
+            "SELECT account, password, name, total_points FROM users ORDER BY rowid"
+        ).fetchall()
+        return [self._user(r) for r in rows]
+
+    def set_password(self, account, new_password):
+        with self._tx() as conn:
+            cur = conn.execute("UPDATE users SET password = ? WHERE account = ?", (new_password, account))
+            return cur.rowcount > 0
+
+    def add_points(self, account, delta):
+        with self._tx() as conn:
+            conn.execute("UPDATE users SET total_points = total_points + ? WHERE account = ?", (delta, account))
+            row = conn.execute("SELECT total_points FROM users WHERE account = ?", (account,)).fetchone()
+        return row[0] if row else None
+
+    def put_user(self, user):
+        with self._tx() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO users (account, password, name, total_points) VALUES (?, ?, ?, ?)",
+                tuple(user[f] for f in USER_FIELDS),
+            )
+
+    @staticmethod
+    def _record(row):
+        tstr, acc, nm, attempt_no, score, answers = row
+        return {
+            "time": tstr,
+            "account": acc,
+            "name": nm,
+            "attempt_no": attempt_no,
+            "score": score,
+            "answers": {k: tuple(v) for k, v in json.loads(answers).items()},
+        }
+
+    def append_result(self, record):
+        with self._tx() as conn:
+            cur = conn.execute(
+                "INSERT INTO results (time, account, name, attempt_no, score, answers) VALUES (?, ?, ?, ?, ?, ?)",
+                (record["time"], record["account"], record["name"], record["attempt_no"],
+                 record["score"], json.dumps(record.get("answers") or {}, ensure_ascii=False)),
+            )
+            if record.get("attempt_id"):
+                conn.execute("INSERT INTO attempts (attempt_id, result_id) VALUES (?, ?)",
+                             (record["attempt_id"], cur.lastrowid))
+
+    def has_attempt(self, attempt_id):
+        row = self._conn().execute("SELECT 1 FROM attempts WHERE attempt_id = ?", (attempt_id,)).fetchone()
+        return row is not None
+
+    def iter_results(self, account=None):
+        sql = "SELECT time, account, name, attempt_no, score, answers FROM results"
+        if account is None:
+            cur = self._conn().execute(sql + " ORDER BY id")
+        else:
+            cur = self._conn().execute(sql + " WHERE account = ? ORDER BY id", (account,))
+        for row in cur:
+            yield self._record(row)
+
+    def iter_results_since(self, since):
+        cur = self._conn().execute(
+            "SELECT time, account, name, attempt_no, score, answers FROM results WHERE time >= ? ORDER BY id",
+            (since,),
+        )
+        for row in cur:
+            yield self._record(row)
+
+    def count_attempts(self, account):
+        return self._conn().execute("SELECT COUNT(*) FROM results WHERE account = ?", (account,)).fetchone()[0]
+
+    def delete_results_before(self, cutoff):
+        with self._tx() as conn:
+            removed = conn.execute("DELETE FROM results WHERE time < ?", (cutoff,)).rowcount
+            conn.execute("DELETE FROM attempts WHERE result_id NOT IN (SELECT id FROM results)")
+            return removed
+
+    def snapshot(self):
+        """WAL 模式下的讀取交易：同一個交易裡讀兩張表，看到的是同一個時間點，也不會擋到寫入。"""
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            users = [self._user(r) for r in conn.execute(
+                "SELECT account, password, name, total_points FROM users ORDER BY rowid")]
+            results = [self._record(r) for r in conn.execute(
+                "SELECT time, account, name, attempt_no, score, answers FROM results ORDER BY id")]
+        finally:
+            conn.execute("COMMIT")
+        return Snapshot(users, results)
+
+    def load_settings(self):
+        row = self._conn().execute("SELECT value FROM kv WHERE key = 'settings'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_settings(self, settings):
+        with self._tx() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value) VALUES ('settings', ?)",
+                (json.dumps(settings, ensure_ascii=False),),
+            )
+
+    def load_document(self, name):
+        row = self._conn().execute("SELECT value FROM kv WHERE key = ?", (f"doc:{name}",)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_document(self, name, data):
+        with self._tx() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
+                (f"doc:{name}", json.dumps(data, ensure_ascii=False)),
+            )
+
+    def rollup_add(self, entries):
+        self._rollups.add(entries)
+
+    def rollup_top(self, bucket, limit=50):
+        return self._rollups.top(bucket, limit)
+
+    def rollup_rank(self, bucket, account):
+        return self._rollups.rank(bucket, account)
+
+    def rollup_clear(self):
+        self._rollups.clear()
+
+    def init(self, question_ids=()):
+        self._conn()
+
+
+# ===== Redis 協定 =====
+
+class RespError(StorageError):
+    """Redis 回覆的錯誤（-ERR ...）。"""
+
+
+# 重送也不會多算的指令：連線中途斷掉、不知道伺服器有沒有執行時，只有這些會自動重送。
+# INCRBY / HINCRBY / RPUSH / ZINCRBY / LTRIM 這類重送一次就多加一次，絕對不能重送。
+RETRYABLE_COMMANDS = {
+    "GET", "HGETALL", "SMEMBERS", "SISMEMBER", "LRANGE", "LLEN",
+    "ZREVRANGE", "ZSCORE", "ZCARD", "ZCOUNT", "PING",
+    "SET", "HSET", "SADD", "DEL",
+}
+
+
+class RespClient:
+    """極簡 RESP 客戶端（不需安裝 redis 套件）；每個執行緒一條連線。
+
+    回覆讀到一半出錯（連線中斷、看不懂的回覆）就把連線整個丟掉，下一個指令重連，
+    不會讀到上一個指令殘留在 socket 裡的回覆。
+    """
+
+    def __init__(self, host="127.0.0.1", port=6379, db=0, password=None, timeout=5):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._local.sock = sock
+        self._local.reader = sock.makefile("rb")
+        self._local.pid = os.getpid()
+        try:
+            if self.password:
+                self._call("AUTH", self.password)
+            if self.db:
+                self._call("SELECT", self.db)
+        except Exception:
+            self._drop()
+            raise
+
+    @staticmethod
+    def _encode(args):
+        out = [b"*%d\r\n" % len(args)]
+        for a in args:
+            if not isinstance(a, bytes):
+                a = str(a).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(a), a))
+        return b"".join(out)
+
+    def _drop(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _ensure_connected(self):
+        if getattr(self._local, "sock", None) is None or self._local.pid != os.getpid():
+            self._connect()
+
+    def _read(self):
+        """讀一個完整的回覆。Redis 的錯誤回覆回傳 RespError（不丟出），陣列才會整個讀完。"""
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError("Redis 連線中斷")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            return RespError(rest.decode("utf-8"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = self._local.reader.read(n + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            n = int(rest)
+            if n < 0:
+                return None
+            return [self._read() for _ in range(n)]
+        raise StorageError(f"看不懂的 Redis 回應：{line!r}")
+
+    @staticmethod
+    def _check(reply):
+        if isinstance(reply, RespError):
+            raise reply
+        if isinstance(reply, list):
+            for item in reply:
+                if isinstance(item, RespError):
+                    raise item
+        return reply
+
+    def _call(self, *args):
+        self._local.sock.sendall(self._encode(args))
+        return self._check(self._read())
+
+    def _send_and_read(self, payload, n_replies, retryable):
+        """送出 payload、讀 n_replies 個回覆。
+
+        送出前連線就斷了（sendall 失敗，伺服器不可能執行）或指令全都可以重送，才重連再送一次。
+        """
+        for attempt in (1, 2):
+            self._ensure_connected()
+            try:
+                self._local.sock.sendall(payload)
+            except OSError:
+                self._drop()
+                if attempt == 2:
+                    raise
+                continue
+            try:
+                return [self._read() for _ in range(n_replies)]
+            except (OSError, ValueError, StorageError):
+                # 回覆讀到一半：socket 裡可能還有殘留，整條連線丟掉
+                self._drop()
+                if attempt == 2 or not retryable:
+                    raise
+
+    def execute(self, *args):
+        retryable = str(args[0]).upper() in RETRYABLE_COMMANDS
+        (reply,) = self._send_and_read(self._encode(args), 1, retryable)
+        return self._check(reply)
+
+    def pipeline(self, commands):
+        """一次送出多個指令（MULTI/EXEC 包起來，保證一起生效）。
+
+        MULTI、每個 QUEUED、EXEC 的回覆全部讀完才檢查錯誤，連線上不會留下沒讀的回覆。
+        """
+        payload = self._encode(["MULTI"]) + b"".join(self._encode(c) for c in commands) + self._encode(["EXEC"])
+        retryable = all(str(c[0]).upper() in RETRYABLE_COMMANDS for c in commands)
+        replies = self._send_and_read(payload, len(commands) + 2, retryable)
+        for reply in replies[:-1]:
+            self._check(reply)            # MULTI 的 OK、每個指令的 QUEUED
+        if replies[-1] is None:
+            raise StorageError("Redis 交易被中止（EXEC 回傳 null）")
+        return self._check(replies[-1])   # EXEC 的結果陣列
+
+
+class RedisStorage(StorageBackend):
+    """Redis 鍵值配置：
+      users            -> set（所有帳號）
+      user:<帳號>       -> hash（password / name / total_points）
+      results          -> list（全部作答，JSON）
+      results:<帳號>    -> list（該生作答，JSON）
+      attempts         -> set（已寫入成績的交卷 API 作答編號）
+      settings         -> string（JSON）
+      doc:<名稱>        -> string（JSON，批次工作的結果）
+      rollup:<時段>     -> sorted set（帳號 -> 該時段積分）
+      rollups          -> set（所有時段名稱，重建時用來清除）
+    """
+
+    def __init__(self, client, prefix="quiz:"):
+        self.client = client
+        self.prefix = prefix
+
+    def _k(self, *parts):
+        return self.prefix + ":".join(str(p) for p in parts)
+
+    def get_user(self, account):
+        account = str(account).strip()
+        flat = self.client.execute("HGETALL", self._k("user", account))
+        if not flat:
+            return None
+        h = dict(zip(flat[::2], flat[1::2]))
+        return {
+            "account": account,
+            "password": h.get("password", ""),
+            "name": h.get("name", ""),
+            "total_points": int(h.get("total_points") or 0),
+        }
+
+    def list_users(self):
+        accounts = self.client.execute("SMEMBERS", self._k("users")) or []
+        users = [self.get_user(a) for a in sorted(accounts)]
+        return [u for u in users if u]
+
+    def set_password(self, account, new_password):
+        if not self.client.execute("SISMEMBER", self._k("users"), account):
+            return False
+        self.client.execute("HSET", self._k("user", account), "password", new_password)
+        return True
+
+    def add_points(self, account, delta):
+        if not self.client.execute("SISMEMBER", self._k("users"), account):
+            return None
+        return self.client.execute("HINCRBY", self._k("user", account), "total_points", delta)
+
+    def put_user(self, user):
+        self.client.pipeline([
+            ["SADD", self._k("users"), user["account"]],
+            ["HSET", self._k("user", user["account"]),
+             "password", user["password"], "name", user["name"], "total_points", user["total_points"]],
+        ])
+
+    @staticmethod
+    def _record(raw):
+        rec = json.loads(raw)
+        rec["answers"] = {k: tuple(v) for k, v in rec.get("answers", {}).items()}
+        return rec
+
+    def append_result(self, record):
+        raw = json.dumps(record, ensure_ascii=False)
+        commands = [
+            ["RPUSH", self._k("results"), raw],
+            ["RPUSH", self._k("results", record["account"]), raw],
+        ]
+        if record.get("attempt_id"):
+            commands.append(["SADD", self._k("attempts"), record["attempt_id"]])
+        self.client.pipeline(commands)
+
+    def has_attempt(self, attempt_id):
+        return bool(self.client.execute("SISMEMBER", self._k("attempts"), attempt_id))
+
+    def iter_results(self, account=None):
+        key = self._k("results") if account is None else self._k("results", account)
+        start, batch = 0, 500
+        while True:
+            chunk = self.client.execute("LRANGE", key, start, start + batch - 1) or []
+            for raw in chunk:
+                yield self._record(raw)
+            if len(chunk) < batch:
+                return
+            start += batch
+
+    def count_attempts(self, account):
+        return self.client.execute("LLEN", self._k("results", account))
+
+    def delete_results_before(self, cutoff):
+        """作答是依時間 RPUSH 的，舊的都在 list 前面：數出前面幾筆要刪，再 LTRIM 掉。
+
+        交卷同時進行也沒關係（新的只會加在後面）。
+        """
+        removed = 0
+        per_account = {}
+        attempt_ids = []
+        for rec in self.iter_results():
+            if str(rec["time"]) >= cutoff:
+                break
+            removed += 1
+            per_account[rec["account"]] = per_account.get(rec["account"], 0) + 1
+            if rec.get("attempt_id"):
+                attempt_ids.append(rec["attempt_id"])
+        if removed:
+            self.client.pipeline(
+                [["LTRIM", self._k("results"), removed, -1]]
+                + [["LTRIM", self._k("results", acc), n, -1] for acc, n in per_account.items()]
+                + ([["SREM", self._k("attempts")] + attempt_ids] if attempt_ids else [])
+            )
+        return removed
+
+    def snapshot(self):
+        """帳號 hash 和作答 list 包在同一個 MULTI/EXEC 讀，Redis 保證中間不會插進寫入。"""
+        accounts = sorted(self.client.execute("SMEMBERS", self._k("users")) or [])
+        replies = self.client.pipeline(
+            [["HGETALL", self._k("user", a)] for a in accounts]
+            + [["LRANGE", self._k("results"), 0, -1]]
+        )
+        users = []
+        for account, flat in zip(accounts, replies[:-1]):
+            if not flat:
+                continue
+            h = dict(zip(flat[::2], flat[1::2]))
+            users.append({
+                "account": account,
+                "password": h.get("password", ""),
+                "name": h.get("name", ""),
+                "total_points": int(h.get("total_points") or 0),
+            })
+        return Snapshot(users, [self._record(raw) for raw in replies[-1] or []])
+
+    def load_settings(self):
+        raw = self.client.execute("GET", self._k("settings"))
+        return json.loads(raw) if raw else None
+
+    def save_settings(self, settings):
+        self.client.execute("SET", self._k("settings"), json.dumps(settings, ensure_ascii=False))
+
+    def load_document(self, name):
+        raw = self.client.execute("GET", self._k("doc", name))
+        return json.loads(raw) if raw else None
+
+    def save_document(self, name, data):
+        self.client.execute("SET", self._k("doc", name), json.dumps(data, ensure_ascii=False))
+
+    def rollup_add(self, entries):
+        commands = []
+        for bucket, account, points in entries:
+            commands.append(["SADD", self._k("rollups"), bucket])
+            commands.append(["ZINCRBY", self._k("rollup", bucket), int(points), account])
+        if commands:
+            self.client.pipeline(commands)
+
+    def rollup_top(self, bucket, limit=50):
+        flat = self.client.execute("ZREVRANGE", self._k("rollup", bucket), 0, limit - 1, "WITHSCORES") or []
+        return [(a, int(float(p))) for a, p in zip(flat[::2], flat[1::2])]
+
+    def rollup_rank(self, bucket, account):
+        key = self._k("rollup", bucket)
+        score, count = self.client.pipeline([["ZSCORE", key, account], ["ZCARD", key]])
+        if score is None:
+            return None, 0, count
+        above = self.client.execute("ZCOUNT", key, f"({score}", "+inf")
+        return above + 1, int(float(score)), count
+
+    def rollup_clear(self):
+        buckets = self.client.execute("SMEMBERS", self._k("rollups")) or []
+        if buckets:
+            self.client.execute("DEL", self._k("rollups"), *[self._k("rollup", b) for b in buckets])
+
+
+# ===== 建立後端 =====
+
+def open_storage(url=None):
+    """依網址建立後端；沒給就看 QUIZ_STORAGE 環境變數，預設 xlsx。"""
+    url = url or os.environ.get("QUIZ_STORAGE", "xlsx")
+    if url == "xlsx":
+        return XlsxStorage()
+    if url.startswith("sqlite:"):
+        return SQLiteStorage(url[len("sqlite:"):] or os.path.join(BASE_DIR, "quiz.sqlite3"))
+    if url.startswith("redis://"):
+        u = urlparse(url)
+        db = int(u.path.strip("/") or 0)
+        client = RespClient(u.hostname or "127.0.0.1", u.port or 6379, db=db, password=u.password)
+        return RedisStorage(client)
+    raise ValueError(f"不支援的 QUIZ_STORAGE：{url}")
+
+
+def copy_storage(src, dst, documents=()):
+    """把帳號、作答紀錄、設定和指定名稱的文件整包搬到另一個後端（例如 xlsx -> sqlite）。
+
+    時段排行（rollup）是從作答紀錄算出來的，不在這裡搬；搬完用 WindowedLeaderboard(dst).rebuild() 重算
+    （python storage.py migrate 會自動做）。
+    """
+    users = src.list_users()
+    for u in users:
+        dst.put_user(u)
+    n = 0
+    for rec in src.iter_results():
+        dst.append_result(rec)
+        n += 1
+    settings = src.load_settings()
+    if settings is not None:
+        dst.save_settings(settings)
+    for name in documents:
+        data = src.load_document(name)
+        if data is not None:
+            dst.save_document(name, data)
+    return len(users), n
+
+
+if __name__ == "__main__":
+    # 用法：python storage.py migrate sqlite:quiz.sqlite3
+    if len(sys.argv) == 3 and sys.argv[1] == "migrate":
+        src = open_storage()
+        dst = open_storage(sys.argv[2])
+        dst.init()
+        sys.path.insert(0, BASE_DIR)
+        import itertools
+        from archive import ResultArchive
+        from irt import DOCUMENT as IRT_DOCUMENT
+        from leaderboards import WindowedLeaderboard
+
+        n_users, n_results = copy_storage(src, dst, documents=[IRT_DOCUMENT])
+        print(f"✅ 已搬移 {n_users} 個帳號、{n_results} 筆作答到 {sys.argv[2]}")
+        # 時段排行在新後端重算一次（本學期可能橫跨已封存的月份）
+        WindowedLeaderboard(dst).rebuild(itertools.chain(ResultArchive().iter_results(), dst.iter_results()))
+        print("✅ 時段排行已在新後端重建")
+    else:
+        print("用法：python storage.py migrate <目的地，例如 sqlite:quiz.sqlite3 或 redis://127.0.0.1:6379/0>")
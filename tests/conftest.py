@@ -0,0 +1,84 @@
+"""測試共用設定。
+
+需要整個 app 的測試用 quiz_app：把專案複製到暫存資料夾再 import，
+交卷、積分、暫存檔都只寫進複本，不會動到專案裡的 Excel。
+"""
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+COPY_IGNORE = shutil.ignore_patterns(
+    ".git", "tests", "__pycache__", "*.pyc", "autosave", "archive", "formula_cache", "*.sqlite3*")
+
+
+def _forget_modules_under(directory):
+    """拿掉從 directory import 的模組（測試本身除外），之後的 import 才會換成另一份。"""
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None) or ""
+        if path.startswith(directory + os.sep) and not path.startswith(os.path.join(ROOT, "tests") + os.sep):
+            del sys.modules[name]
+
+
+@pytest.fixture(scope="session")
+def quiz_app(tmp_path_factory):
+    base = tmp_path_factory.mktemp("quiz")
+    copy = str(base / "app")
+    shutil.copytree(ROOT, copy, ignore=COPY_IGNORE)
+    shared = base / "shared"
+    shared.mkdir()
+    env = {
+        "QUIZ_SHEETS_OFFLINE": "1",
+        "QUIZ_SHARED_DIR": str(shared),
+        "ADMISSION_STATE_FILE": str(base / "admission.sqlite3"),
+        "QUIZ_CAPTURE": "",
+    }
+    saved_env = {k: os.environ.get(k) for k in env}
+    saved_cwd = os.getcwd()
+    os.environ.update(env)
+    os.chdir(copy)
+    _forget_modules_under(ROOT)
+    sys.path.insert(0, copy)
+    try:
+        import app as quiz_app_module
+
+        nested = os.path.join(copy, "templates", "templates")
+        if os.path.isdir(nested):
+            quiz_app_module.app.template_folder = nested
+        # 趁 QUIZ_SHEETS_OFFLINE 還在先建好離線替身，背景同步執行緒之後才不會去連 Google
+        quiz_app_module.get_google_sheet()
+        quiz_app_module.get_results_sheet()
+        # 測試會連續登入 / 交卷很多次，限流放寬
+        adm = quiz_app_module.ADMISSION
+        adm.classes = {k: dict(v, rate=1000.0, burst=1000) if v.get("rate") else v for k, v in adm.classes.items()}
+        yield quiz_app_module
+    finally:
+        sys.path.remove(copy)
+        _forget_modules_under(copy)
+        os.chdir(saved_cwd)
+        for k, v in saved_env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+def login(quiz_app, account, password):
+    client = quiz_app.app.test_client()
+    resp = client.post("/login", data={"account": account, "password": password})
+    assert resp.status_code == 302, resp.get_data(as_text=True)[:200]
+    return client
+
+
+@pytest.fixture
+def student(quiz_app):
+    return login(quiz_app, "s11", "fhsh")
+
+
+@pytest.fixture
+def teacher(quiz_app):
+    return login(quiz_app, "t001", "0957")
@@ -0,0 +1,55 @@
+import threading
+import time
+
+from flask import Flask
+
+import admission
+from admission import AdmissionControl, RouteQueue, ROUTE_CLASSES
+
+
+def test_queues_and_streams_fit_in_the_worker_threads():
+    reserved = sum(cfg["max_active"] + cfg["max_queue"] for cfg in ROUTE_CLASSES.values())
+    assert reserved + admission.SPARE_THREADS + admission.STREAM_THREADS <= admission.WORKER_THREADS
+
+
+def test_full_queue_rejects_without_waiting():
+    queue = RouteQueue("grading", max_active=1, max_queue=1, max_wait=5.0)
+    assert queue.acquire() == 0.0
+    waiter = threading.Thread(target=queue.acquire)
+    waiter.start()
+    while queue.waiting == 0:
+        time.sleep(0.01)
+    t0 = time.monotonic()
+    assert queue.acquire() is None           # 處理中 1 + 排隊 1 都滿了：馬上回 503
+    assert time.monotonic() - t0 < 0.5
+    queue.release()
+    waiter.join()
+    assert queue.active == 1 and queue.rejected == 1
+
+
+class _CountingBuckets:
+    def __init__(self):
+        self.keys = []
+
+    def take(self, key, rate, burst):
+        self.keys.append(key)
+        return 0
+
+
+def test_only_login_and_grading_are_rate_limited(tmp_path):
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.add_url_rule("/login", "login", lambda: "ok", methods=["GET", "POST"])
+    app.add_url_rule("/submit", "submit", lambda: "ok", methods=["POST"])
+    app.add_url_rule("/home", "home", lambda: "ok")
+    adm = AdmissionControl(app, state_file=str(tmp_path / "buckets.sqlite3"))
+    adm.buckets = _CountingBuckets()
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_account"] = "s11"
+    for _ in range(5):
+        assert client.get("/home").status_code == 200
+    client.post("/submit")
+    client.post("/login", data={"account": "s11"})
+    assert adm.buckets.keys == ["grading:s11", "login:s11"]
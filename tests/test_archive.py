@@ -0,0 +1,33 @@
+from archive import ResultArchive
+from conftest import login
+
+
+def _rec(account, time, answers, score=0):
+    return {"time": time, "account": account, "name": account, "attempt_no": 1, "score": score,
+            "answers": answers}
+
+
+def test_account_results_only_opens_partitions_with_the_account(tmp_path):
+    archive = ResultArchive(str(tmp_path))
+    archive.add([
+        _rec("s01", "2025-01-05 10:00:00", {"Q1": ("A", "X")}),
+        _rec("s02", "2025-02-05 10:00:00", {"Q2": ("B", "O")}),
+        _rec("s01", "2025-03-05 10:00:00", {"Q3": ("C", "O")}),
+    ])
+    (tmp_path / archive.file_name("2025-02")).unlink()   # s01 沒有 2 月的作答，不該去開這個檔
+    records = archive.account_results("s01")
+    assert [r["time"] for r in records] == ["2025-01-05 10:00:00", "2025-03-05 10:00:00"]
+    assert records[0]["answers"] == {"Q1": ("A", "X")}
+
+    # 再封存一個月份：manifest 換了，快取跟著重讀
+    archive.add([_rec("s01", "2025-04-05 10:00:00", {}, score=2)])
+    assert len(archive.account_results("s01")) == 3
+
+
+def test_review_and_points_include_archived_months(quiz_app):
+    quiz_app.ARCHIVE.add([_rec("s12", "2025-01-15 10:00:00", {"q1": ("焦耳", "X")}, score=4)])
+    client = login(quiz_app, "s12", "fhsh")
+
+    assert "下列何者為力的單位？" in client.get("/review").get_data(as_text=True)
+    assert "2025-01-15 10:00:00" in client.get("/points").get_data(as_text=True)
+    assert "q1" in {q["id"] for q in quiz_app.load_wrong_questions("s12")}
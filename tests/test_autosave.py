@@ -0,0 +1,98 @@
+import os
+import time
+
+from autosave import AutosaveBuffer, FINAL_CLAIM_TIMEOUT
+
+
+def test_claim_final_only_once(tmp_path):
+    buf = AutosaveBuffer(str(tmp_path))
+    attempt_id = buf.start("s01", [{"id": "Q1", "options": ["A", "B"]}])
+    assert buf.claim_final(attempt_id)
+    assert not buf.claim_final(attempt_id)
+
+
+def test_released_claim_can_be_taken_again(tmp_path):
+    buf = AutosaveBuffer(str(tmp_path))
+    attempt_id = buf.start("s01", [{"id": "Q1", "options": ["A", "B"]}])
+    assert buf.claim_final(attempt_id)
+    buf.release_final(attempt_id)
+    assert buf.claim_final(attempt_id)
+
+
+def test_stale_claim_is_reclaimed(tmp_path):
+    buf = AutosaveBuffer(str(tmp_path))
+    attempt_id = buf.start("s01", [{"id": "Q1", "options": ["A", "B"]}])
+    assert buf.claim_final(attempt_id)
+    marker = os.path.join(str(tmp_path), f"{attempt_id}.jsonl.final")
+    old = time.time() - FINAL_CLAIM_TIMEOUT - 5
+    os.utime(marker, (old, old))
+    assert buf.claim_final(attempt_id)
+    assert not buf.claim_final(attempt_id)
+    assert [f for f in os.listdir(str(tmp_path)) if f.endswith(".stale")] == []
+
+
+def test_failed_finalize_can_be_retried(quiz_app, student, monkeypatch):
+    paper = student.post("/api/quiz/paper").get_json()
+    attempt_id = paper["attempt_id"]
+    answers = {q["id"]: (q["options"][0] if q["options"] else "1") for q in paper["questions"]}
+    assert student.patch(f"/api/quiz/{attempt_id}/answers", json={"answers": answers}).status_code == 200
+
+    real_record = quiz_app.record_attempt
+
+    def broken(*args, **kwargs):
+        raise OSError("quiz_results.xlsx is locked")
+
+    monkeypatch.setattr(quiz_app, "record_attempt", broken)
+    resp = student.post(f"/api/quiz/{attempt_id}/finalize", json={})
+    assert resp.status_code == 500
+    assert quiz_app.AUTOSAVE.load(attempt_id)["final"] is None
+
+    monkeypatch.setattr(quiz_app, "record_attempt", real_record)
+    resp = student.post(f"/api/quiz/{attempt_id}/finalize", json={})
+    assert resp.status_code == 200
+    result = resp.get_json()
+    assert result["total"] == len(paper["questions"])
+
+    # 再送一次只會拿到同一份結果，不會再記一次成績
+    again = student.post(f"/api/quiz/{attempt_id}/finalize", json={})
+    assert again.status_code == 200
+    assert again.get_json() == result
+
+
+def test_cleanup_removes_old_files(tmp_path):
+    buf = AutosaveBuffer(str(tmp_path), keep_seconds=60)
+    old_id = buf.start("s01", [{"id": "Q1", "options": ["A", "B"]}])
+    assert buf.claim_final(old_id)
+    new_id = buf.start("s01", [{"id": "Q1", "options": ["A", "B"]}])
+    old = time.time() - 120
+    for name in os.listdir(str(tmp_path)):
+        if name.startswith(old_id):
+            os.utime(os.path.join(str(tmp_path), name), (old, old))
+    assert buf.cleanup() == 2
+    assert buf.load(old_id) is None
+    assert buf.load(new_id) is not None
+
+
+def test_finalize_does_not_wait_or_record_twice(quiz_app, student):
+    paper = student.post("/api/quiz/paper").get_json()
+    attempt_id = paper["attempt_id"]
+    marker = os.path.join(quiz_app.AUTOSAVE.directory, f"{attempt_id}.jsonl.final")
+
+    # 另一個請求拿著交卷權利：馬上回 202，不在請求裡等
+    assert quiz_app.AUTOSAVE.claim_final(attempt_id)
+    started = time.time()
+    resp = student.post(f"/api/quiz/{attempt_id}/finalize", json={})
+    assert resp.status_code == 202
+    assert time.time() - started < 1
+
+    # 那個請求寫完成績就掛了；權利過期後重送只補結果，不會再記一次
+    with quiz_app.app.app_context():
+        quiz_app.record_attempt("s11", "s11", 0, [], attempt_id=attempt_id)
+    before = quiz_app.STORAGE.count_attempts("s11")
+    old = time.time() - FINAL_CLAIM_TIMEOUT - 5
+    os.utime(marker, (old, old))
+    resp = student.post(f"/api/quiz/{attempt_id}/finalize", json={})
+    assert resp.status_code == 200
+    assert quiz_app.STORAGE.count_attempts("s11") == before
+    assert quiz_app.AUTOSAVE.load(attempt_id)["final"] == resp.get_json()
+    assert not os.path.exists(marker)
@@ -0,0 +1,80 @@
+import sys
+
+import numpy as np
+import pytest
+
+import irt
+
+
+def _simulate(seed, n_students=600, n_items=40, coverage=0.6):
+    rng = np.random.default_rng(seed)
+    theta = rng.normal(0, 1, n_students)
+    b = rng.normal(0, 1, n_items)
+    a = np.exp(rng.normal(0, 0.3, n_items))
+    s = np.repeat(np.arange(n_students), n_items)
+    i = np.tile(np.arange(n_items), n_students)
+    keep = rng.random(len(s)) < coverage
+    s, i = s[keep], i[keep]
+    y = (rng.random(len(s)) < 1 / (1 + np.exp(-a[i] * (theta[s] - b[i])))).astype(np.int8)
+    return s, i, y, theta, b, a
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_2pl_recovers_known_parameters(seed):
+    s, i, y, theta, b, a = _simulate(seed)
+    result = irt.fit(s, i, y, len(theta), len(b), model="2pl", max_iter=200)
+    est_a = np.exp(result["log_a"])
+
+    assert result["iterations"] < 60
+    assert abs(result["theta"].mean()) < 1e-6 and abs(result["theta"].std() - 1) < 1e-6
+    assert np.corrcoef(theta, result["theta"])[0, 1] > 0.85
+    assert np.corrcoef(b, result["b"])[0, 1] > 0.97
+    assert np.corrcoef(a, est_a)[0, 1] > 0.7
+    # 尺度要對：b 的斜率、a 的平均都接近真值
+    assert 0.85 < np.polyfit(b, result["b"], 1)[0] < 1.15
+    assert 0.85 < est_a.mean() / a.mean() < 1.2
+    assert np.all(result["se_b"] > 0)
+
+
+def test_rasch_recovers_difficulty():
+    s, i, y, theta, b, _ = _simulate(3)
+    result = irt.fit(s, i, y, len(theta), len(b), model="rasch", max_iter=200)
+    assert result["iterations"] < 60
+    assert np.corrcoef(b, result["b"])[0, 1] > 0.95
+    assert np.all(result["log_a"] == 0)
+
+
+def test_process_pool_matches_single_process(monkeypatch):
+    s, i, y, theta, b, _ = _simulate(4, n_students=200, n_items=20)
+    single = irt.fit(s, i, y, len(theta), len(b), max_iter=20)
+    monkeypatch.setattr(irt, "PARALLEL_MIN_RESPONSES", 0)
+    monkeypatch.setitem(sys.modules, "irt", irt)   # quiz_app 換過模組時，pool 還是要 pickle 這一份
+    pooled = irt.fit(s, i, y, len(theta), len(b), max_iter=20, workers=2)
+    assert np.allclose(single["theta"], pooled["theta"])
+    assert np.allclose(single["b"], pooled["b"])
+
+
+class _FakeCalibrator:
+    calls = 0
+
+    def refresh(self):
+        _FakeCalibrator.calls += 1
+        return {"added": 3, "students": 1, "items": 3, "iterations": 4, "seconds": 0.0}
+
+
+def test_refresher_skips_while_another_process_holds_the_lock(tmp_path):
+    done = []
+    lock_path = str(tmp_path / "irt.lock")
+    refresher = irt.IrtRefresher(_FakeCalibrator, on_done=done.append, every=2, lock_path=lock_path)
+    _FakeCalibrator.calls = 0
+
+    with irt.refresh_lock(lock_path):
+        assert refresher.busy()
+        assert refresher.run_once() is None
+    assert _FakeCalibrator.calls == 0
+
+    refresher._new_results = 2
+    assert refresher._due()
+    summary = refresher.run_once()
+    assert _FakeCalibrator.calls == 1 and done == [summary]
+    assert not refresher._due() and not refresher.busy()
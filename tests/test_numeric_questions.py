@@ -0,0 +1,69 @@
+import json
+import re
+
+from numeric_questions import VariantBank
+
+TEMPLATE = {
+    "id": "T1",
+    "kind": "numeric",
+    "text": "質量 {m} kg 的物體以 {v} m/s 運動，動能為多少？",
+    "variables": "m=1:10:0.5; v=2:20:1",
+    "formula": "0.5*m*v**2",
+    "unit": "J",
+    "tolerance": "",
+    "sig_figs": "",
+    "explanation": "",
+}
+
+
+def test_restore_recomputes_the_sampled_answer():
+    bank = VariantBank(batch_size=32, seed=1)
+    for _ in range(32):
+        variant = bank.take(TEMPLATE)
+        assert bank.restore(TEMPLATE, variant["values"]) == variant
+
+
+def test_grading_from_session_values_only(quiz_app, monkeypatch):
+    variant = quiz_app.VARIANTS.take(TEMPLATE)
+    shown = quiz_app.VARIANTS.instantiate(TEMPLATE, variant)
+    monkeypatch.setattr(quiz_app.QUESTION_INDEX, "get_many", lambda qids: [TEMPLATE])
+    answer_text = shown["answer"].split()[0]
+
+    score, details = quiz_app.grade_answers({"T1": answer_text}, variants={"T1": {"values": variant["values"]}})
+    assert score == 1 and details[0]["correct_answer"] == shown["answer"]
+    score, _ = quiz_app.grade_answers({"T1": "0"}, variants={"T1": {"values": variant["values"]}})
+    assert score == 0
+
+
+def test_missing_variant_is_ungradable(quiz_app, monkeypatch):
+    monkeypatch.setattr(quiz_app.QUESTION_INDEX, "get_many", lambda qids: [TEMPLATE])
+    for variants in ({}, {"T1": {"values": {"m": 2.0}}}):     # 沒有這一題 / 變數對不上
+        score, details = quiz_app.grade_answers({"T1": TEMPLATE["formula"]}, variants=variants)
+        assert score == 0 and details[0]["ungradable"] and not details[0]["correct"]
+        assert quiz_app.graded_count(details) == 0
+
+
+def test_two_open_papers_keep_their_own_numbers(quiz_app, student, monkeypatch):
+    monkeypatch.setattr(quiz_app.QUESTION_INDEX, "get_many", lambda qids: [TEMPLATE])
+    monkeypatch.setattr(quiz_app.QUIZ_POOL, "pop",
+                        lambda account, rng=None: [quiz_app.VARIANTS.instantiate(TEMPLATE)])
+    monkeypatch.setitem(quiz_app.SETTINGS, "client_render_quiz", False)
+    monkeypatch.setitem(quiz_app.SETTINGS, "daily_limit", 0)
+
+    paper_ids = []
+    for _ in range(2):
+        html = student.get("/quiz").get_data(as_text=True)
+        paper_ids.append(re.search(r'name="paper_id" value="(\w+)"', html).group(1))
+    with student.session_transaction() as sess:
+        papers = sess["variants"]
+        assert "answer" not in json.dumps(papers)
+        answers = [
+            quiz_app.VARIANTS.format_answer(TEMPLATE, quiz_app.VARIANTS.restore(TEMPLATE, papers[p]["q"]["T1"]["values"]))
+            for p in paper_ids
+        ]
+
+    for paper_id, answer in zip(reversed(paper_ids), reversed(answers)):
+        html = student.post("/submit", data={"paper_id": paper_id, "T1": answer.split()[0]}).get_data(as_text=True)
+        assert "本次得分：<b>1</b>" in html
+    html = student.post("/submit", data={"paper_id": paper_ids[0], "T1": answers[0].split()[0]}).get_data(as_text=True)
+    assert "本次得分：<b>0</b>" in html       # 交過的考卷數字已經拿掉，不會拿公式字串亂批
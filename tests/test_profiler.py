@@ -0,0 +1,25 @@
+from collections import Counter
+
+from profiler import function_label, hot_functions
+
+
+def test_function_label_drops_only_the_line_number():
+    assert function_label("grade_answers (app.py:1190)") == "grade_answers (app.py)"
+    assert function_label("<module> (C:\\\\x\\\\y.py:3)") == "<module> (C:\\\\x\\\\y.py)"
+    assert function_label("[quiz-pool]") == "[quiz-pool]"
+
+
+def test_hot_functions_aggregate_lines_of_one_function():
+    counts = Counter({
+        "POST submit;submit (app.py:1280);grade_answers (app.py:1190)": 3,
+        "POST submit;submit (app.py:1280);grade_answers (app.py:1195)": 2,
+        "POST submit;submit (app.py:1291);record_attempt (app.py:1230)": 4,
+        "POST submit;submit (app.py:1300)": 1,
+        "GET home;fib (x.py:2);fib (x.py:3);fib (x.py:3)": 5,
+    })
+    hot = {name: (own, incl) for name, own, incl in hot_functions(counts)}
+    assert hot["grade_answers (app.py)"] == (5, 5)
+    assert hot["record_attempt (app.py)"] == (4, 4)
+    assert hot["submit (app.py)"] == (1, 10)
+    assert hot["fib (x.py)"] == (5, 5)       # 遞迴只算一次
+    assert [name for name, _, _ in hot_functions(counts, n=2)] == ["grade_answers (app.py)", "fib (x.py)"]
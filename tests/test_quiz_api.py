@@ -0,0 +1,53 @@
+import time
+
+from formula_cache import formula_hash
+
+
+def test_result_details_carry_rendered_formulas(quiz_app, monkeypatch):
+    monkeypatch.setattr(quiz_app.FORMULAS, "_known", {formula_hash(r"v=\frac{d}{t}")})
+    detail = {
+        "id": "Q1",
+        "text": r"速率 $v=\frac{d}{t}$ <b>",
+        "user_answer": "2",
+        "correct_answer": r"$v=\frac{d}{t}$",
+        "correct": False,
+        "explanation": "<script>x</script>",
+    }
+    with quiz_app.app.test_request_context():
+        view = quiz_app._detail_for_view(detail, show_explanation=True)
+        hidden = quiz_app._detail_for_view(detail, show_explanation=False)
+    assert '<img class="formula"' in view["text_html"]
+    assert "&lt;b&gt;" in view["text_html"]
+    assert '<img class="formula"' in view["correct_answer_html"]
+    assert "<script>" not in view["explanation_html"]
+    assert view["text"] == detail["text"]          # 純文字欄位照舊
+    assert hidden["explanation"] == "" and hidden["explanation_html"] == ""
+
+
+def test_finalize_returns_html_fields(student):
+    paper = student.post("/api/quiz/paper").get_json()
+    result = student.post(f"/api/quiz/{paper['attempt_id']}/finalize", json={}).get_json()
+    for d in result["details"]:
+        assert {"text_html", "user_answer_html", "correct_answer_html", "explanation_html"} <= set(d)
+
+
+def test_irt_refresh_runs_in_background(quiz_app, student, teacher):
+    paper = student.post("/api/quiz/paper").get_json()
+    student.post(f"/api/quiz/{paper['attempt_id']}/finalize", json={})
+
+    resp = teacher.post("/teacher/irt/refresh")
+    assert resp.status_code == 302
+    deadline = time.time() + 30
+    while quiz_app.IRT_REFRESHER.busy() or quiz_app.IRT_REFRESHER._due():
+        assert time.time() < deadline
+        time.sleep(0.05)
+    doc = quiz_app.STORAGE.load_document("irt")
+    assert doc["responses"] > 0 and "s11" in doc["students"]
+
+
+def test_stream_over_the_limit_says_busy(quiz_app, teacher, monkeypatch):
+    monkeypatch.setattr(quiz_app, "MAX_STREAMS_PER_WORKER", 0)
+    resp = teacher.get("/teacher/stream")
+    body = resp.get_data(as_text=True)
+    assert resp.mimetype == "text/event-stream"
+    assert "event: busy" in body and "retry: " in body and "id:" not in body
@@ -0,0 +1,42 @@
+from quiz_pool import QuizPaperPool
+
+BANK = [{"id": f"Q{i}", "options": ["A", "B", "C"]} for i in range(10)]
+
+
+def _pool(settings, wrong=None, instantiate=None):
+    return QuizPaperPool(lambda: BANK, lambda: settings, lambda account: (wrong or {}).get(account, []),
+                         target_size=3, low_water=1, per_student=2, instantiate=instantiate)
+
+
+def test_paper_built_before_invalidate_is_dropped():
+    settings = {"questions_per_test": 2}
+    built = []
+
+    def invalidate_once(paper):
+        # 第一份考卷做到一半，老師改了設定
+        if not built:
+            pool.invalidate()
+        built.append(paper)
+        return paper
+
+    pool = _pool(settings, instantiate=invalidate_once)
+    pool._refill()
+    assert len(pool._shared) == 3
+    assert all(p is not built[0] for p in pool._shared)
+
+
+def test_refresh_drops_prebuilt_wrong_only_papers():
+    settings = {"questions_per_test": 2, "wrong_only_mode": True}
+    wrong = {"s01": [BANK[0], BANK[1]]}
+    pool = _pool(settings, wrong=wrong)
+    pool._pending_accounts.append("s01")
+    pool._refill()
+    assert pool.stats()["students"] == 2
+
+    # 交卷後錯題變了：舊的預做考卷作廢，重做的是新的錯題
+    wrong["s01"] = [BANK[5], BANK[6]]
+    pool.refresh("s01")
+    assert pool.stats()["students"] == 0
+    pool._refill()
+    paper = pool.pop("s01")
+    assert {q["id"] for q in paper} == {"Q5", "Q6"}
@@ -0,0 +1,51 @@
+import importlib.util
+import os
+
+from conftest import ROOT
+
+_spec = importlib.util.spec_from_file_location("replay", os.path.join(ROOT, "tools", "replay.py"))
+replay = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(replay)
+
+
+def _rec(path, account="s11", **extra):
+    return dict(path=path, session={"user_account": account}, **extra)
+
+
+def test_recorded_attempt_ids_are_rewritten():
+    ids = replay.AttemptIds()
+    ids.started(_rec("/api/quiz/paper", attempt_id="old-1"), "new-1")
+    ids.started(_rec("/api/quiz/paper", attempt_id="old-2"), "new-2")
+    assert ids.rewrite(_rec("/api/quiz/old-1/answers")) == "/api/quiz/new-1/answers"
+    assert ids.rewrite(_rec("/api/quiz/old-2/finalize")) == "/api/quiz/new-2/finalize"
+    assert ids.rewrite(_rec("/api/quiz/old-1")) == "/api/quiz/new-1"
+    assert ids.rewrite(_rec("/api/quiz/paper")) == "/api/quiz/paper"
+    assert ids.rewrite(_rec("/quiz")) == "/quiz"
+
+
+def test_old_traces_fall_back_to_the_accounts_latest_paper():
+    ids = replay.AttemptIds()
+    ids.started(_rec("/api/quiz/paper", account="s11"), "new-a")
+    ids.started(_rec("/api/quiz/paper", account="s12"), "new-b")
+    assert ids.rewrite(_rec("/api/quiz/x/answers", account="s11")) == "/api/quiz/new-a/answers"
+    assert ids.rewrite(_rec("/api/quiz/y/answers", account="s12")) == "/api/quiz/new-b/answers"
+    ids.started(_rec("/api/quiz/paper", account="s11"), "new-c")
+    assert ids.rewrite(_rec("/api/quiz/x/finalize", account="s11")) == "/api/quiz/new-a/finalize"
+    assert ids.rewrite(_rec("/api/quiz/z", account="s13")) == "/api/quiz/z"
+
+
+def test_lanes_keep_each_account_in_order():
+    records = [
+        _rec("/login", account=None), _rec("/api/quiz/paper"), _rec("/api/quiz/paper", account="s12"),
+        _rec("/api/quiz/a/answers"), _rec("/", account=None), _rec("/api/quiz/a/finalize"),
+    ]
+    lanes = sorted(([k for k, _ in lane] for lane in replay.lanes_of(records)), key=len, reverse=True)
+    assert lanes == [[1, 3, 5], [0], [2], [4]]
+
+
+def test_signed_session_is_accepted_by_the_app(quiz_app):
+    signer = replay.session_signer(quiz_app.app.secret_key)
+    client = quiz_app.app.test_client()
+    client.set_cookie("session", signer.dumps({"user_account": "s11", "user_name": "x", "logged_in": True}))
+    with client.session_transaction() as sess:
+        assert sess["user_account"] == "s11"
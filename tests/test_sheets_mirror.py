@@ -0,0 +1,124 @@
+import pytest
+
+from sheets_mirror import SheetMirror, FakeWorksheet
+
+HEADER = ["account", "password", "name", "total_points"]
+
+
+def make_users(n=5):
+    return FakeWorksheet([HEADER] + [[f"s{i:02d}", "pw", f"學生{i}", 0] for i in range(1, n + 1)])
+
+
+def result_row(account, k=1):
+    return [f"2026-10-19 10:00:{k:02d}", account, "學生", k, 3, "A", "O"]
+
+
+class FlakyWorksheet(FakeWorksheet):
+    """前 fail_times 次寫入丟出例外（模擬 Google API 逾時 / 配額用完）。"""
+
+    def __init__(self, rows=None, fail_times=1):
+        super().__init__(rows)
+        self.fail_times = fail_times
+
+    def _maybe_fail(self):
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise ConnectionError("quota exceeded")
+
+    def batch_update(self, data, value_input_option=None):
+        self._maybe_fail()
+        return super().batch_update(data, value_input_option)
+
+    def append_rows(self, values, value_input_option=None):
+        self._maybe_fail()
+        return super().append_rows(values, value_input_option)
+
+
+@pytest.fixture
+def sheets():
+    return make_users(), FakeWorksheet()
+
+
+def make_mirror(users, results):
+    # 背景執行緒不主動送（間隔很長），測試自己呼叫 flush()
+    return SheetMirror(lambda: users, lambda: results, flush_interval=3600, batch_size=10_000)
+
+
+def test_flush_sends_one_batch_update_and_one_append_rows(sheets):
+    users, results = sheets
+    mirror = make_mirror(users, results)
+    assert mirror.update_field("s01", "password", "a1")
+    assert mirror.update_field("s03", "password", "c1")
+    assert mirror.update_field("s01", "password", "a2")     # 同一格只送最後一次
+    for k in range(5):
+        mirror.append_row(result_row("s02", k))
+    assert "batch_update" not in users.calls and "append_rows" not in results.calls
+
+    mirror.flush()
+    assert users.calls["batch_update"] == 1
+    assert results.calls["append_rows"] == 1
+    assert "get_all_records" not in users.calls
+    assert "update_cell" not in users.calls
+    assert users.rows[1][1] == "a2" and users.rows[3][1] == "c1"
+    assert len(results.rows) == 5
+    assert mirror.stats()["pending_rows"] == 0
+
+    mirror.flush()     # 沒有東西要送就不呼叫 API
+    assert users.calls["batch_update"] == 1
+    assert results.calls["append_rows"] == 1
+
+
+def test_failed_flush_is_retried_without_duplicates():
+    users = FlakyWorksheet(make_users().rows, fail_times=1)
+    results = FlakyWorksheet(fail_times=1)
+    mirror = make_mirror(users, results)
+    mirror.update_field("s02", "password", "new")
+    mirror.append_row(result_row("s02", 1))
+    mirror.append_row(result_row("s03", 2))
+
+    mirror.flush()
+    stats = mirror.stats()
+    assert stats["pending_updates"] == 1 and stats["pending_rows"] == 2
+    assert results.rows == []
+
+    mirror.append_row(result_row("s04", 3))    # 重試前又進來一筆，順序要維持
+    mirror.flush()
+    assert users.rows[2][1] == "new"
+    assert [r[1] for r in results.rows] == ["s02", "s03", "s04"]
+    assert mirror.stats()["pending_rows"] == 0 and mirror.stats()["pending_updates"] == 0
+
+
+def test_index_only_covers_the_users_sheet(sheets):
+    users, results = sheets
+    mirror = make_mirror(users, results)
+    for k in range(8):
+        mirror.append_row(result_row("s01", k))
+    mirror.flush()
+    mirror.reconcile()
+    assert mirror.stats()["indexed_accounts"] == 5
+    assert mirror.row_of("2026-10-19 10:00:01") is None
+    assert mirror.row_of("s05") == 6
+
+
+def test_reconcile_picks_up_new_rows_and_rebuilds_after_manual_edits(sheets):
+    users, results = sheets
+    mirror = make_mirror(users, results)
+    assert mirror.row_of("s03") == 4
+
+    # 老師在試算表最下面手動加了一個帳號：只補進索引
+    users.rows.append(["s06", "pw", "學生6", 0])
+    mirror.reconcile()
+    assert mirror.row_of("s06") == 7
+    assert mirror.row_of("s03") == 4
+
+    # 刪掉一列、其他列往上移：索引整個重建
+    del users.rows[1]
+    mirror.reconcile()
+    assert mirror.row_of("s01") is None
+    assert mirror.row_of("s03") == 3
+    assert mirror.row_of("s06") == 6
+
+    # 重建後改密碼寫到正確的那一格
+    mirror.update_field("s03", "password", "moved")
+    mirror.flush()
+    assert users.rows[2] == ["s03", "moved", "學生3", 0]
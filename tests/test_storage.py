@@ -0,0 +1,58 @@
+import pytest
+
+from storage import RollupTable, SQLiteStorage, XlsxStorage
+
+
+@pytest.fixture(params=["sqlite", "xlsx"])
+def storage(request, tmp_path):
+    if request.param == "sqlite":
+        st = SQLiteStorage(str(tmp_path / "quiz.sqlite3"))
+    else:
+        st = XlsxStorage(str(tmp_path / "users.xlsx"), str(tmp_path / "quiz_results.xlsx"),
+                         str(tmp_path / "settings.json"), str(tmp_path / "rollups.sqlite3"))
+    st.init(["Q1"])
+    return st
+
+
+def _record(time, attempt_id=None):
+    rec = {"time": time, "account": "s01", "name": "甲", "attempt_no": 1, "score": 1,
+           "answers": {"Q1": ("A", "O")}}
+    if attempt_id:
+        rec["attempt_id"] = attempt_id
+    return rec
+
+
+def test_attempt_marker_written_with_result(storage):
+    storage.append_result(_record("2026-09-30 10:00:00", "a" * 32))
+    storage.append_result(_record("2026-10-02 10:00:00"))
+    storage.append_result(_record("2026-10-03 10:00:00", "b" * 32))
+    assert storage.has_attempt("a" * 32)
+    assert storage.has_attempt("b" * 32)
+    assert not storage.has_attempt("c" * 32)
+    assert storage.count_attempts("s01") == 3
+
+    # 封存刪掉舊作答時，編號跟著刪；留下來的作答編號還在
+    assert storage.delete_results_before("2026-10-01") == 1
+    assert not storage.has_attempt("a" * 32)
+    assert storage.has_attempt("b" * 32)
+
+
+def test_rollup_rank_cached_per_generation(tmp_path):
+    table = RollupTable(str(tmp_path / "rollups.sqlite3"))
+    table.add([("d:2026-10-01", "s01", 5), ("d:2026-10-01", "s02", 3), ("d:2026-10-01", "s03", 5)])
+    assert table.rank("d:2026-10-01", "s02") == (3, 3, 3)
+    assert table.rank("d:2026-10-01", "s01") == (1, 5, 3)
+    assert table.rank("d:2026-10-01", "s09") == (None, 0, 3)
+    cached = table._ranks["d:2026-10-01"]
+    assert table.rank("d:2026-10-01", "s03") == (1, 5, 3)
+    assert table._ranks["d:2026-10-01"] is cached
+
+    # 加分換版本，另一個 worker（另一個 RollupTable）手上的排序也會重讀
+    other = RollupTable(str(tmp_path / "rollups.sqlite3"))
+    assert other.rank("d:2026-10-01", "s02") == (3, 3, 3)
+    table.add([("d:2026-10-01", "s02", 4)])
+    assert other.rank("d:2026-10-01", "s02") == (1, 7, 3)
+
+    table.clear()
+    table.add([("d:2026-10-01", "s01", 1)])
+    assert other.rank("d:2026-10-01", "s01") == (1, 1, 1)
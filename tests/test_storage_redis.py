@@ -0,0 +1,91 @@
+import socketserver
+import threading
+
+import pytest
+
+import resp_server
+from storage import RespClient, RespError, RedisStorage
+
+
+@pytest.fixture
+def client():
+    server = resp_server.serve(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield RespClient(port=server.server_address[1], timeout=2)
+    server.shutdown()
+    server.server_close()
+
+
+class _HangUpHandler(socketserver.StreamRequestHandler):
+    """讀完一個指令就掛斷、不回覆（模擬伺服器執行了但回覆沒送到）。"""
+    received = []
+
+    def handle(self):
+        line = self.rfile.readline()
+        if line.startswith(b"*"):
+            args = []
+            for _ in range(int(line[1:-2])):
+                size = int(self.rfile.readline()[1:-2])
+                args.append(self.rfile.read(size + 2)[:-2].decode())
+            self.received.append(args[0])
+
+
+@pytest.fixture
+def hang_up_server():
+    _HangUpHandler.received = []
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _HangUpHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_pipeline_error_drains_every_reply(client):
+    client.execute("SET", "k", "1")
+    with pytest.raises(RespError):
+        client.pipeline([["NOPE"], ["SET", "b", "2"]])
+    # 後面的指令拿到的是自己的回覆，不是上一個 pipeline 殘留的
+    assert client.execute("GET", "k") == "1"
+    assert client.execute("GET", "b") == "2"
+
+
+def test_error_reply_keeps_connection_in_sync(client):
+    with pytest.raises(RespError):
+        client.execute("NOPE")
+    assert client.execute("PING") == "PONG"
+
+
+def test_non_idempotent_command_is_not_resent(hang_up_server):
+    c = RespClient(port=hang_up_server.server_address[1], timeout=2)
+    with pytest.raises(OSError):
+        c.execute("RPUSH", "results", "x")
+    assert _HangUpHandler.received == ["RPUSH"]
+
+
+def test_read_command_is_resent_once(hang_up_server):
+    c = RespClient(port=hang_up_server.server_address[1], timeout=2)
+    with pytest.raises(OSError):
+        c.execute("GET", "k")
+    assert _HangUpHandler.received == ["GET", "GET"]
+
+
+def test_redis_storage_roundtrip(client):
+    st = RedisStorage(client)
+    st.put_user({"account": "s01", "password": "pw", "name": "甲", "total_points": 0})
+    assert st.add_points("s01", 3) == 3
+    st.append_result({"time": "2026-10-01 10:00:00", "account": "s01", "name": "甲",
+                      "attempt_no": 1, "score": 3, "answers": {"Q1": ("A", "O")}})
+    assert st.count_attempts("s01") == 1
+    snap = st.snapshot()
+    assert [u["total_points"] for u in snap.users] == [3]
+
+
+def test_redis_attempt_marker_written_with_result(client):
+    st = RedisStorage(client)
+    st.append_result({"time": "2026-10-01 10:00:00", "account": "s01", "name": "甲",
+                      "attempt_no": 1, "score": 3, "answers": {}, "attempt_id": "a" * 32})
+    assert st.has_attempt("a" * 32)
+    assert not st.has_attempt("b" * 32)
+    assert st.delete_results_before("2026-11-01") == 1
+    assert not st.has_attempt("a" * 32)
@@ -0,0 +1,257 @@
+"""即時看板（SSE）每多一個觀看者要多花多少 CPU。
+
+開 N 個觀看者執行緒訂閱 EventBus（每收到一批就 write 到 /dev/null，模擬送到 socket），
+發佈 E 筆交卷事件，量整個行程花掉的 CPU 時間：
+  shared  events.EventBus：事件編碼一次、共用環狀緩衝區、一次 notify_all
+  naive   對照組：每個觀看者一個 queue，發佈時對每個人各編碼、各 put 一次
+另外量 N 個觀看者「沒有事件」時閒置的 CPU（應該接近 0，只有心跳）。
+
+--http：改量真的 HTTP 串流。用 gunicorn 在暫存複本開一個 worker（看板連線上限設成 N），
+以老師帳號開 N 條 /teacher/stream，另開一個行程往共用事件檔寫 E 筆交卷事件
+（跟交卷時同一條路：事件檔 → worker 的 tail 執行緒 → EventBus → socket），量：
+  threads  N 條連線讓 worker 多佔了幾條執行緒（每條連線一條，這就是每個 worker 要設上限的原因）
+  idle     沒有事件時，每位觀看者佔 worker 多少 CPU
+  per      每位觀看者每筆事件，worker 花的 CPU（含 tail 執行緒讀事件檔的固定成本，人少時平均下來比較高）
+  refused  再多開一條時，是不是拿到「連線已滿」（busy）事件
+
+用法：
+  python tools/bench_sse.py
+  python tools/bench_sse.py --viewers 1 10 50 200 --events 300
+  python tools/bench_sse.py --http --viewers 1 2 4 8 --events 100
+"""
+import argparse
+import http.client
+import http.cookiejar
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from events import EventBus, encode_sse  # noqa: E402
+from local_server import LocalServer, process_cpu, process_threads  # noqa: E402
+
+
+class NaiveBus:
+    """對照組：每個觀看者自己一個 queue。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = []
+
+    @property
+    def viewers(self):
+        return len(self._queues)
+
+    def publish(self, event_id, kind, data):
+        with self._lock:
+            queues = list(self._queues)
+        for q in queues:
+            q.put(encode_sse(event_id, kind, data))
+
+    def listen(self, last_event_id=None, backlog=0, heartbeat=15.0, lifetime=300.0):
+        q = queue.Queue()
+        with self._lock:
+            self._queues.append(q)
+        try:
+            while True:
+                try:
+                    yield q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield b": ping\n\n"
+        finally:
+            with self._lock:
+                self._queues.remove(q)
+
+
+def event(k):
+    return {
+        "time": "2026-10-19 10:00:00", "account": f"s{k % 40:03d}", "name": "同學",
+        "attempt_no": k, "score": 4, "correct": 4, "questions": 5, "total_points": 100 + k,
+    }
+
+
+def run(bus_cls, viewers, events, interval):
+    bus = bus_cls()
+    sink = os.open(os.devnull, os.O_WRONLY)
+    done = threading.Barrier(viewers + 1)
+
+    def viewer():
+        received = 0
+        stream = bus.listen(backlog=0, heartbeat=1.0)
+        for chunk in stream:
+            os.write(sink, chunk)
+            received += chunk.count(b"event: submission")
+            if received >= events:
+                break
+        stream.close()
+        done.wait()
+
+    threads = [threading.Thread(target=viewer, daemon=True) for _ in range(viewers)]
+    for t in threads:
+        t.start()
+    while bus.viewers < viewers:
+        time.sleep(0.01)
+
+    # 閒置：沒有事件時 N 個觀看者的 CPU
+    idle_start, idle_cpu = time.perf_counter(), time.process_time()
+    time.sleep(1.0)
+    idle = (time.process_time() - idle_cpu) / (time.perf_counter() - idle_start)
+
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    for k in range(events):
+        bus.publish(f"e{k}", "submission", event(k))
+        if interval:
+            time.sleep(interval)
+    done.wait()
+    cpu = time.process_time() - cpu0
+    wall = time.perf_counter() - wall0
+    os.close(sink)
+    # 扣掉發佈端 sleep 之外都是 CPU；每位觀看者每筆事件平均
+    return cpu, wall, idle, cpu / (viewers * events) * 1e6
+
+
+# ===== 真的 HTTP 串流 =====
+
+PUBLISHER = """
+import sys, time
+from events import SharedEventLog
+from shared_cache import shared_path
+log = SharedEventLog(shared_path("events", suffix=".log"))
+n, interval, tag = int(sys.argv[1]), float(sys.argv[2]), sys.argv[3]
+for k in range(n):
+    log.publish("submission", {"bench": tag, "k": k, "account": "s%03d" % (k % 40), "score": 4})
+    if interval:
+        time.sleep(interval)
+"""
+
+
+def teacher_cookie(url, account, password):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    data = urllib.parse.urlencode({"account": account, "password": password}).encode()
+    opener.open(url + "/login", data=data, timeout=10).close()
+    cookies = "; ".join(f"{c.name}={c.value}" for c in jar)
+    if "session=" not in cookies:
+        raise SystemExit("❌ 老師帳號登入失敗")
+    return cookies
+
+
+class StreamViewer(threading.Thread):
+    """一條 /teacher/stream 連線：數收到幾筆這一輪的事件。"""
+
+    def __init__(self, host, port, cookie, tag):
+        super().__init__(daemon=True)
+        self.conn = http.client.HTTPConnection(host, port, timeout=60)
+        self.conn.request("GET", "/teacher/stream", headers={"Cookie": cookie})
+        self.resp = self.conn.getresponse()
+        self.tag = tag
+        self.received = 0
+        self.busy = False
+        self.connected = threading.Event()
+
+    def run(self):
+        kind = None
+        try:
+            while True:
+                line = self.resp.fp.readline()
+                if not line:
+                    break
+                self.connected.set()
+                line = line.strip()
+                if line.startswith(b"event: "):
+                    kind = line[7:].decode()
+                elif line.startswith(b"data: "):
+                    if kind == "busy":
+                        self.busy = True
+                    elif kind == "submission" and json.loads(line[6:]).get("bench") == self.tag:
+                        self.received += 1
+                elif line == b"" or line.startswith(b":"):
+                    self.connected.set()
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            self.connected.set()
+
+    def close(self):
+        try:
+            self.conn.sock.shutdown(2)
+        except OSError:
+            pass
+        self.conn.close()
+
+
+def run_http(viewers_list, events, interval, account, password):
+    print(f"HTTP 串流：每輪發佈 {events} 筆事件，間隔 {interval * 1000:g} ms（gunicorn 1 個 worker）")
+    print(f"{'觀看者':>6}{'多佔執行緒':>10}{'閒置 CPU/人':>12}{'每人每筆':>12}{'收齊':>8}{'多開一條':>10}")
+    for n in viewers_list:
+        with LocalServer(ROOT, workers=1, env={"QUIZ_MAX_STREAMS": str(n)}) as server:
+            host, port = server.url[len("http://"):].split(":")
+            cookie = teacher_cookie(server.url, account, password)
+            worker = server.worker_pids()[0]
+            time.sleep(0.5)
+            threads0 = process_threads(worker)
+
+            tag = f"round-{n}"
+            viewers = [StreamViewer(host, int(port), cookie, tag) for _ in range(n)]
+            for v in viewers:
+                v.start()
+                v.connected.wait(10)
+            time.sleep(0.5)
+            held = process_threads(worker) - threads0
+
+            cpu0, t0 = process_cpu(worker), time.perf_counter()
+            time.sleep(2.0)
+            idle = (process_cpu(worker) - cpu0) / (time.perf_counter() - t0) / n
+
+            extra = StreamViewer(host, int(port), cookie, tag)
+            extra.start()
+            extra.join(10)
+            refused = "busy" if extra.busy else "接上了"
+            extra.close()
+
+            cpu0 = process_cpu(worker)
+            subprocess.run([sys.executable, "-c", PUBLISHER, str(events), str(interval), tag],
+                           cwd=server.copy, env=dict(os.environ, QUIZ_SHARED_DIR=server.work), check=True)
+            deadline = time.time() + 30
+            while time.time() < deadline and any(v.received < events for v in viewers):
+                time.sleep(0.05)
+            per = (process_cpu(worker) - cpu0) / (n * events) * 1e6
+            complete = sum(1 for v in viewers if v.received >= events)
+            for v in viewers:
+                v.close()
+            print(f"{n:>6}{held:>10}{idle * 100:>11.2f}%{per:>9.1f} µs{complete:>5}/{n:<2}{refused:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE 即時看板的 CPU 成本")
+    parser.add_argument("--viewers", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--interval-ms", type=float, default=2.0, help="發佈間隔（毫秒），0 = 一口氣全部發")
+    parser.add_argument("--http", action="store_true", help="量真的 HTTP 串流（gunicorn + /teacher/stream）")
+    parser.add_argument("--account", default="t001", help="--http 用的老師帳號")
+    parser.add_argument("--password", default="0957")
+    args = parser.parse_args()
+
+    if args.http:
+        run_http(args.viewers, args.events, args.interval_ms / 1000, args.account, args.password)
+        return
+
+    print(f"每輪發佈 {args.events} 筆事件，間隔 {args.interval_ms} ms")
+    print(f"{'模式':<8}{'觀看者':>8}{'CPU 合計':>12}{'每人每筆':>12}{'閒置 CPU':>10}")
+    for n in args.viewers:
+        for name, cls in (("shared", EventBus), ("naive", NaiveBus)):
+            cpu, wall, idle, per = run(cls, n, args.events, args.interval_ms / 1000)
+            print(f"{name:<8}{n:>8}{cpu * 1000:>9.1f} ms{per:>9.1f} µs{idle * 100:>9.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""冷啟動時間測試：每次開一個全新的 Python 行程 import app，量要花多久。
+
+超過預算（預設 800 毫秒，取中位數）或 import 時就載入了不該載入的重套件，以非 0 結束，
+可以放在部署前檢查。
+
+用法：
+  python tools/bench_startup.py
+  python tools/bench_startup.py --runs 10 --budget-ms 500
+  STARTUP_BUDGET_MS=1500 python tools/bench_startup.py    # Render 免費方案比較慢，可以放寬
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 這些只有真的用到（讀題庫、連 Google、算參數化題、產生公式圖）才應該載入
+LAZY_MODULES = ["openpyxl", "gspread", "google.oauth2", "numpy", "matplotlib"]
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import app
+elapsed = time.perf_counter() - t0
+print(json.dumps({"ms": elapsed * 1000, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def run_once():
+    env = dict(os.environ, QUIZ_SHEETS_OFFLINE="1", PYTHONDONTWRITEBYTECODE="1")
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE], cwd=ROOT, env=env,
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="import app 冷啟動時間測試")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("STARTUP_BUDGET_MS", 800)))
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+    times = sorted(r["ms"] for r in results)
+    median = statistics.median(times)
+    eager = sorted({m for r in results for m in r["loaded"]})
+
+    print(f"import app：中位數 {median:.0f} ms（最快 {times[0]:.0f}、最慢 {times[-1]:.0f}，共 {args.runs} 次），預算 {args.budget_ms:.0f} ms")
+    failed = False
+    if eager:
+        print(f"❌ import 時就載入了：{', '.join(eager)}（應該等到用到才 import）")
+        failed = True
+    if median > args.budget_ms:
+        print("❌ 冷啟動超過預算")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("✅ 冷啟動在預算內")
+
+
+if __name__ == "__main__":
+    main()
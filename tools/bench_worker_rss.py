@@ -0,0 +1,149 @@
+"""每個 worker 的記憶體用量：題庫索引放在各 worker 自己的記憶體 vs 放在共用 mmap 檔。
+
+模擬 gunicorn --preload：父行程先建好索引，再 fork 出幾個 worker，每個 worker 做一樣的
+查詢（抽考卷、搜尋、依題號取題），最後讀 /proc/self/smaps_rollup 回報：
+  RSS      看得到的記憶體（共用的頁面每個 worker 都會算一次）
+  PSS      共用頁面按 worker 數平分後的用量（比較接近真正佔用）
+  Private  只屬於這個 worker 的記憶體（worker 數加倍時會跟著加倍的部分）
+
+用法：
+  python tools/bench_worker_rss.py
+  python tools/bench_worker_rss.py --questions 20000 --workers 4
+（只支援 Linux）
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import QuestionIndex  # noqa: E402
+from shared_cache import SharedQuestionIndex  # noqa: E402
+
+WORDS = ["速度", "加速度", "位移", "質量", "動能", "位能", "動量", "衝量", "摩擦力", "重力",
+         "電場", "電位", "電流", "電阻", "磁場", "波長", "頻率", "折射", "透鏡", "熱量"]
+CATEGORIES = ["力學", "運動學", "能量", "電學", "磁學", "波動", "光學", "熱學"]
+
+
+def make_bank(n, seed=0):
+    rng = random.Random(seed)
+    bank = []
+    for i in range(n):
+        words = rng.sample(WORDS, 4)
+        options = [f"{rng.randint(1, 99)} {rng.choice(['m/s', 'J', 'N', 'kg'])}" for _ in range(4)]
+        bank.append({
+            "id": f"q{i + 1}",
+            "text": f"第 {i + 1} 題：已知{words[0]}與{words[1]}，求{words[2]}對{words[3]}的影響。" * 2,
+            "options": options,
+            "answer": options[0],
+            "explanation": f"由{words[0]}的定義可得，{words[2]}與{words[3]}成正比。" * 3,
+            "category": rng.choice(CATEGORIES),
+        })
+    return bank
+
+
+def memory():
+    """回傳 (RSS, PSS, Private)，單位 KB。"""
+    values = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                values[parts[0].rstrip(":")] = int(parts[1])
+    private = values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)
+    return values.get("Rss", 0), values.get("Pss", 0), private
+
+
+def workload(index, rounds, seed):
+    rng = random.Random(seed)
+    ids = index.ids()
+    for _ in range(rounds):
+        for cat in CATEGORIES:
+            pool = index.in_category(cat)
+            rng.sample(pool, min(5, len(pool)))
+        index.search(rng.choice(WORDS), limit=50)
+        index.get_many(rng.sample(ids, 20))
+    # 老師頁面會整個題庫掃一遍
+    sum(len(q["text"]) for q in index.bank())
+
+
+def run(mode, bank, workers, rounds, workdir):
+    if mode == "local":
+        index = QuestionIndex(bank)
+    else:
+        index = SharedQuestionIndex(os.path.join(workdir, "bank.shm"))
+        index.update(bank)
+    len(index)
+
+    pipes = []
+    for w in range(workers):
+        r, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            workload(index, rounds, seed=w)
+            os.write(wfd, ("%d %d %d" % memory()).encode())
+            os._exit(0)
+        os.close(wfd)
+        pipes.append((pid, r))
+
+    results = []
+    for pid, r in pipes:
+        data = b""
+        while True:
+            chunk = os.read(r, 4096)
+            if not chunk:
+                break
+            data += chunk
+        os.close(r)
+        os.waitpid(pid, 0)
+        results.append(tuple(int(x) for x in data.split()))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="每個 worker 的記憶體用量比較")
+    parser.add_argument("--questions", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        print("⚠️ 這個測試需要 Linux 的 /proc/self/smaps_rollup")
+        sys.exit(0)
+
+    bank = make_bank(args.questions)
+    workdir = tempfile.mkdtemp(prefix="rss-bench-")
+    print(f"題庫 {args.questions} 題、{args.workers} 個 worker、每個 worker 查詢 {args.rounds} 輪")
+    print(f"{'模式':<8}{'RSS/worker':>14}{'PSS/worker':>14}{'Private/worker':>16}{'PSS 合計':>12}")
+    for mode in ("local", "shared"):
+        # 每種模式在乾淨的子行程裡跑，互不影響
+        r, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            res = run(mode, bank, args.workers, args.rounds, workdir)
+            os.write(wfd, json.dumps(res).encode())
+            os._exit(0)
+        os.close(wfd)
+        data = b""
+        while True:
+            chunk = os.read(r, 65536)
+            if not chunk:
+                break
+            data += chunk
+        os.close(r)
+        os.waitpid(pid, 0)
+        res = json.loads(data.decode())
+        n = len(res)
+        rss = sum(x[0] for x in res) / n / 1024
+        pss = sum(x[1] for x in res) / n / 1024
+        private = sum(x[2] for x in res) / n / 1024
+        print(f"{mode:<8}{rss:>11.1f} MB{pss:>11.1f} MB{private:>13.1f} MB{pss * n:>9.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
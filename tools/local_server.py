@@ -0,0 +1,139 @@
+"""在暫存資料夾裡用 gunicorn 開一份程式碼（重播流量、壓測 SSE 用）。
+
+交卷、積分、暫存檔都只寫進複本，不會動到原本的 Excel；Google 試算表走離線替身。
+用法：
+  with LocalServer(app_dir, workers=2) as server:
+      urllib.request.urlopen(server.url + "/login")
+"""
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+COPY_IGNORE = shutil.ignore_patterns(
+    ".git", "tests", "__pycache__", "*.pyc", "autosave", "archive", "formula_cache", "*.sqlite3*")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LocalServer:
+    def __init__(self, app_dir, workers=2, threads=None, env=None, ready_timeout=60):
+        self.app_dir = os.path.abspath(app_dir)
+        self.workers = workers
+        self.threads = threads
+        self.extra_env = env or {}
+        self.ready_timeout = ready_timeout
+        self.work = None
+        self.copy = None
+        self.proc = None
+        self.url = None
+
+    def start(self):
+        self.work = tempfile.mkdtemp(prefix="quiz-server-")
+        self.copy = os.path.join(self.work, "app")
+        shutil.copytree(self.app_dir, self.copy, ignore=COPY_IGNORE)
+        # 原始碼的模板放在 templates/templates，部署時才攤平；這裡照部署的樣子攤平
+        nested = os.path.join(self.copy, "templates", "templates")
+        if os.path.isdir(nested):
+            for name in os.listdir(nested):
+                shutil.move(os.path.join(nested, name), os.path.join(self.copy, "templates", name))
+            os.rmdir(nested)
+
+        port = _free_port()
+        self.url = f"http://127.0.0.1:{port}"
+        env = dict(
+            os.environ,
+            QUIZ_CAPTURE="",
+            QUIZ_SHEETS_OFFLINE="1",
+            QUIZ_SHARED_DIR=self.work,
+            ADMISSION_STATE_FILE=os.path.join(self.work, "admission.sqlite3"),
+        )
+        env.update(self.extra_env)
+        cmd = [sys.executable, "-m", "gunicorn", "app:app", "-c", "gunicorn.conf.py",
+               "--bind", f"127.0.0.1:{port}", "--workers", str(self.workers)]
+        if self.threads:
+            cmd += ["--threads", str(self.threads)]
+        self.log_path = os.path.join(self.work, "gunicorn.log")
+        self._log = open(self.log_path, "wb")
+        self.proc = subprocess.Popen(cmd, cwd=self.copy, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+
+        deadline = time.time() + self.ready_timeout
+        while time.time() < deadline:
+            if self.proc.poll() is not None:
+                break
+            try:
+                with urllib.request.urlopen(self.url + "/login", timeout=2) as resp:
+                    if resp.status == 200 and len(self.worker_pids()) >= self.workers:
+                        return self
+            except (urllib.error.URLError, OSError):
+                pass
+            time.sleep(0.2)
+        self.stop(keep_log=True)
+        raise RuntimeError(f"❌ gunicorn 沒有啟動成功，記錄在 {self.log_path}")
+
+    def worker_pids(self):
+        """master 底下的 worker 行程（讀 /proc，只有 Linux）。"""
+        pids = []
+        for name in os.listdir("/proc"):
+            if not name.isdigit():
+                continue
+            try:
+                with open(f"/proc/{name}/stat", "r") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            if int(fields[1]) == self.proc.pid:
+                pids.append(int(name))
+        return sorted(pids)
+
+    def stop(self, keep_log=False):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        if getattr(self, "_log", None) is not None:
+            self._log.close()
+            self._log = None
+        if self.work and not keep_log:
+            shutil.rmtree(self.work, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def process_cpu(pid):
+    """行程裡現有執行緒到目前為止用掉的 CPU 秒數。
+
+    /proc/<pid>/stat 的單位是 clock tick（10 ms），量每筆事件太粗；schedstat 是奈秒。
+    """
+    total = 0
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{tid}/schedstat", "r") as f:
+                total += int(f.read().split()[0])
+        except (OSError, ValueError, IndexError):
+            continue
+    return total / 1e9
+
+
+def process_threads(pid):
+    with open(f"/proc/{pid}/status", "r") as f:
+        for line in f:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+    return None
@@ -0,0 +1,282 @@
+"""重播錄製的流量（QUIZ_CAPTURE 錄的 JSONL），量每個路由的延遲；可以比較兩個版本。
+
+用法：
+  python tools/replay.py traffic.jsonl                        # 用目前這份程式碼重播
+  python tools/replay.py traffic.jsonl --speed 4              # 四倍速（錄製時的間隔縮成 1/4）
+  python tools/replay.py traffic.jsonl --speed 0              # 不等間隔，各帳號一筆接一筆
+  python tools/replay.py traffic.jsonl --compare ../舊版資料夾  # 舊版、目前版本各跑一次，列出差異
+  python tools/replay.py traffic.jsonl --workers 4            # gunicorn 開幾個 worker（預設 2）
+
+每個版本都複製到暫存資料夾，用 gunicorn 開成本機伺服器（交卷、積分只寫進複本，不會動到原本的檔案），
+再用 HTTP 照錄製時的時間點（除以倍速）送請求：不同帳號的請求同時送，所以線上塞車時
+互相搶鎖、排隊的情形也重播得出來；同一個帳號的請求照順序一筆接一筆（跟瀏覽器一樣）。
+伺服器用 QUIZ_REPLAY=1 啟動、請求帶錄製時的種子，所以兩個版本抽到的題目、代入的數字都一樣。
+session 用伺服器的 secret key 簽好直接帶過去（不用重新登入）；登入、改密碼的 POST 因為密碼沒錄，會略過。
+/api/quiz/<attempt_id>/... 的考卷編號是開卷時隨機產生的，重播時換成重播那次開卷拿到的編號。
+報表的「晚送」是請求實際送出比排定時間晚多少（重播端跟不上時會變大，那一輪的數字就不準）。
+"""
+import argparse
+import http.client
+import json
+import os
+import re
+import secrets
+import statistics
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_server import LocalServer  # noqa: E402
+
+# 密碼沒有錄下來，這些請求重播不了
+SKIP = {("POST", "login"), ("POST", "change_password")}
+
+ATTEMPT_PATH_RE = re.compile(r"^/api/quiz/(?!paper(?:/|$))([^/]+)")
+
+
+def load_trace(path):
+    with open(path, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+# ===== 重播：對 gunicorn 開的本機實例送 HTTP =====
+
+class AttemptIds:
+    """錄製時的 attempt_id -> 重播時開卷拿到的 attempt_id。
+
+    錄製檔有記 attempt_id（api_quiz_paper 那筆）就照它對；舊的錄製檔沒記，
+    就把沒見過的編號對到同一個帳號最近一次重播開的考卷。
+    """
+
+    def __init__(self):
+        self.mapping = {}
+        self.latest = {}     # 帳號 -> 重播時最近開的考卷
+        self._lock = threading.Lock()
+
+    def started(self, rec, new_id):
+        if not new_id:
+            return
+        with self._lock:
+            if rec.get("attempt_id"):
+                self.mapping[rec["attempt_id"]] = new_id
+            self.latest[(rec.get("session") or {}).get("user_account")] = new_id
+
+    def rewrite(self, rec):
+        path = rec["path"]
+        m = ATTEMPT_PATH_RE.match(path)
+        if not m:
+            return path
+        old = m.group(1)
+        with self._lock:
+            new = self.mapping.get(old)
+            if new is None:
+                new = self.latest.get((rec.get("session") or {}).get("user_account"))
+                if new is None:
+                    return path
+                self.mapping[old] = new
+        return path[:m.start(1)] + new + path[m.end(1):]
+
+
+def session_signer(secret_key):
+    """用跟伺服器一樣的 secret key 簽 session cookie，把錄製時的 session 原樣帶過去（不用重新登入）。"""
+    from flask import Flask
+    from flask.sessions import SecureCookieSessionInterface
+
+    signer_app = Flask("replay")
+    signer_app.secret_key = secret_key
+    return SecureCookieSessionInterface().get_signing_serializer(signer_app)
+
+
+def lanes_of(records):
+    """同一個帳號的請求依序送（開卷要先回來，之後的暫存 / 交卷才知道考卷編號），不同帳號同時送。
+
+    沒登入的請求彼此無關，各自一條。回傳 [[(錄製順序, 紀錄), ...], ...]。
+    """
+    lanes = {}
+    for k, rec in enumerate(records):
+        account = (rec.get("session") or {}).get("user_account")
+        lanes.setdefault(account if account else ("anonymous", k), []).append((k, rec))
+    return list(lanes.values())
+
+
+class Replayer:
+    def __init__(self, server, records, speed, secret_key):
+        self.host, port = server.url[len("http://"):].split(":")
+        self.port = int(port)
+        self.records = records
+        self.speed = speed
+        self.signer = session_signer(secret_key)
+        self.attempts = AttemptIds()
+        self.results = [None] * len(records)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _request(self, conn, rec):
+        path = self.attempts.rewrite(rec)
+        query = urllib.parse.urlencode(rec.get("args") or {}, doseq=True)
+        if query:
+            path += "?" + query
+        headers = {"X-Replay-Seed": str(rec["seed"])}
+        if rec.get("session"):
+            headers["Cookie"] = "session=" + self.signer.dumps(rec["session"])
+        body = None
+        if rec.get("json") is not None:
+            body = json.dumps(rec["json"], ensure_ascii=False).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        elif rec.get("form"):
+            body = urllib.parse.urlencode(rec["form"], doseq=True).encode("utf-8")
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        conn.request(rec["method"], path, body=body, headers=headers)
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+
+    def _lane(self, lane, started, base_ts):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=120)
+        try:
+            for k, rec in lane:
+                if (rec["method"], rec["endpoint"]) in SKIP:
+                    self.results[k] = {"skip": True, "endpoint": rec["endpoint"]}
+                    continue
+                due = (rec["ts"] - base_ts) / self.speed if self.speed > 0 else 0.0
+                delay = due - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+                late = max(0.0, (time.perf_counter() - started) - due) if self.speed > 0 else None
+                with self._lock:
+                    self.in_flight += 1
+                    self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                t0 = time.perf_counter()
+                try:
+                    status, body = self._request(conn, rec)
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    conn = http.client.HTTPConnection(self.host, self.port, timeout=120)
+                    status, body = 0, b""
+                ms = (time.perf_counter() - t0) * 1000
+                with self._lock:
+                    self.in_flight -= 1
+                if rec["endpoint"] == "api_quiz_paper" and status == 200:
+                    try:
+                        self.attempts.started(rec, json.loads(body).get("attempt_id"))
+                    except ValueError:
+                        pass
+                self.results[k] = {
+                    "endpoint": rec["endpoint"] or rec["path"],
+                    "method": rec["method"],
+                    "ms": round(ms, 2),
+                    "status": status,
+                    "bytes": len(body),
+                    "late_ms": round(late * 1000, 1) if late is not None else None,
+                    "recorded_ms": rec.get("ms"),
+                    "recorded_status": rec.get("status"),
+                }
+        finally:
+            conn.close()
+
+    def run(self):
+        lanes = lanes_of(self.records)
+        base_ts = self.records[0]["ts"] if self.records else 0
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, len(lanes))) as pool:
+            for f in [pool.submit(self._lane, lane, started, base_ts) for lane in lanes]:
+                f.result()
+        return self.results
+
+
+def run_version(app_dir, trace_path, speed, workers):
+    """把 app_dir 複製到暫存資料夾、用 gunicorn 開起來，照錄製的時間點送請求；回傳每筆結果（照錄製順序）。"""
+    records = load_trace(trace_path)
+    secret_key = secrets.token_hex(16)
+    env = {"QUIZ_REPLAY": "1", "QUIZ_SECRET_KEY": secret_key}
+    with LocalServer(app_dir, workers=workers, env=env) as server:
+        replayer = Replayer(server, records, speed, secret_key)
+        results = replayer.run()
+    print(f"   {app_dir}：最多同時 {replayer.max_in_flight} 個請求在處理")
+    return results
+
+
+# ===== 報表 =====
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    k = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def by_endpoint(results):
+    groups = {}
+    for r in results:
+        if r.get("skip"):
+            continue
+        groups.setdefault(f"{r['method']} {r['endpoint']}", []).append(r)
+    return groups
+
+
+def fmt(ms):
+    return "—" if ms is None else f"{ms:.1f}"
+
+
+def report_single(label, results):
+    skipped = sum(1 for r in results if r.get("skip"))
+    groups = by_endpoint(results)
+    print(f"\n{label}（略過 {skipped} 筆無法重播的請求）")
+    print(f"{'路由':<34}{'筆數':>6}{'錄製 p50':>10}{'重播 p50':>10}{'重播 p95':>10}{'狀態不同':>10}{'晚送 p95':>10}")
+    for name, rs in sorted(groups.items()):
+        recorded = [r["recorded_ms"] for r in rs if r.get("recorded_ms") is not None]
+        ms = [r["ms"] for r in rs]
+        late = [r["late_ms"] for r in rs if r.get("late_ms") is not None]
+        mismatched = sum(1 for r in rs if r["status"] != r.get("recorded_status"))
+        print(f"{name:<34}{len(rs):>6}{fmt(statistics.median(recorded) if recorded else None):>10}"
+              f"{fmt(percentile(ms, 50)):>10}{fmt(percentile(ms, 95)):>10}{mismatched:>10}"
+              f"{fmt(percentile(late, 95)):>10}")
+
+
+def report_compare(base_label, base, new_label, new):
+    a, b = by_endpoint(base), by_endpoint(new)
+    print(f"\n版本比較：{base_label} → {new_label}（毫秒，負的代表變快）")
+    print(f"{'路由':<34}{'筆數':>6}{'舊 p50':>9}{'新 p50':>9}{'差':>9}{'舊 p95':>9}{'新 p95':>9}{'差':>9}")
+    for name in sorted(set(a) | set(b)):
+        ma = [r["ms"] for r in a.get(name, [])]
+        mb = [r["ms"] for r in b.get(name, [])]
+        row = [percentile(ma, 50), percentile(mb, 50), percentile(ma, 95), percentile(mb, 95)]
+        d50 = row[1] - row[0] if None not in row[:2] else None
+        d95 = row[3] - row[2] if None not in row[2:] else None
+        print(f"{name:<34}{max(len(ma), len(mb)):>6}{fmt(row[0]):>9}{fmt(row[1]):>9}{fmt(d50):>9}"
+              f"{fmt(row[2]):>9}{fmt(row[3]):>9}{fmt(d95):>9}")
+    diff_status = sum(1 for x, y in zip(base, new) if not x.get("skip") and x["status"] != y.get("status"))
+    if diff_status:
+        print(f"⚠️ 有 {diff_status} 筆請求兩個版本回傳的狀態碼不同")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重播錄製的流量並比較延遲")
+    parser.add_argument("trace", help="QUIZ_CAPTURE 錄下來的 JSONL")
+    parser.add_argument("--speed", type=float, default=1.0, help="倍速（0 = 不等間隔）")
+    parser.add_argument("--app-dir", default=ROOT, help="要重播的版本（預設是這份程式碼）")
+    parser.add_argument("--compare", metavar="舊版資料夾", help="再跑一個版本來比較")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker 數")
+    args = parser.parse_args()
+
+    n = len(load_trace(args.trace))
+    print(f"🔄 重播 {n} 筆請求，{'不等間隔' if args.speed <= 0 else f'{args.speed:g} 倍速'}，"
+          f"gunicorn {args.workers} 個 worker")
+    new = run_version(args.app_dir, args.trace, args.speed, args.workers)
+    report_single(args.app_dir, new)
+    if args.compare:
+        base = run_version(args.compare, args.trace, args.speed, args.workers)
+        report_single(args.compare, base)
+        report_compare(args.compare, base, args.app_dir, new)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""快照一致性壓力測試：多個行程同時交卷（寫）與看報表（讀快照）。
+
+檢查項目（任何一項失敗就以非 0 結束）：
+  1. 讀快照不會丟出例外（例如讀到存一半的 xlsx）
+  2. 每筆作答的分數 = 該筆「O」的數量（不會讀到寫一半的一列）
+  3. 同一個讀者連續拿到的快照，作答筆數只增不減
+  4. 每個帳號的總積分 <= 快照裡該帳號作答分數總和
+     （寫入端先寫作答再加積分，所以同一瞬間一定成立；讀到不同時間點的兩個檔才會違反）
+
+用法：
+  python tools/stress_snapshot.py                     # 在暫存資料夾用 xlsx 後端
+  python tools/stress_snapshot.py --storage sqlite    # 用 SQLite 後端
+  python tools/stress_snapshot.py --storage redis://127.0.0.1:6399/15
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import open_storage, XlsxStorage  # noqa: E402
+
+QIDS = [f"q{i}" for i in range(1, 11)]
+ACCOUNTS = [f"stress{i:02d}" for i in range(8)]
+
+
+def make_storage(spec, workdir):
+    if spec == "xlsx":
+        return XlsxStorage(
+            users_file=os.path.join(workdir, "users.xlsx"),
+            results_file=os.path.join(workdir, "quiz_results.xlsx"),
+            settings_file=os.path.join(workdir, "settings.json"),
+            rollups_file=os.path.join(workdir, "rollups.sqlite3"),
+        )
+    if spec == "sqlite":
+        return open_storage("sqlite:" + os.path.join(workdir, "quiz.sqlite3"))
+    return open_storage(spec)
+
+
+def writer(spec, workdir, n, seed):
+    rng = random.Random(seed)
+    st = make_storage(spec, workdir)
+    for i in range(n):
+        account = rng.choice(ACCOUNTS)
+        answers = {}
+        for qid in rng.sample(QIDS, 3):
+            answers[qid] = ("ans", rng.choice("OX"))
+        score = sum(1 for _, mark in answers.values() if mark == "O")
+        st.append_result({
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "account": account,
+            "name": account,
+            "attempt_no": i + 1,
+            "score": score,
+            "answers": answers,
+        })
+        st.add_points(account, score)
+
+
+def check_snapshot(st, last_count):
+    """讀一次快照並檢查；回傳 (作答筆數, 錯誤清單)。"""
+    errors = []
+    try:
+        snap = st.snapshot()
+    except Exception as e:
+        return last_count, [f"讀快照失敗：{e!r}"]
+
+    if len(snap.results) < last_count:
+        errors.append(f"作答筆數倒退：{last_count} -> {len(snap.results)}")
+
+    sums = {}
+    for rec in snap.results:
+        marks = sum(1 for _, mark in rec["answers"].values() if mark == "O")
+        if marks != rec["score"]:
+            errors.append(f"作答列不完整：{dict(rec)}")
+        sums[rec["account"]] = sums.get(rec["account"], 0) + rec["score"]
+    for u in snap.users:
+        if u["account"] in ACCOUNTS and u["total_points"] > sums.get(u["account"], 0):
+            errors.append(
+                f"{u['account']} 總積分 {u['total_points']} > 快照作答總分 {sums.get(u['account'], 0)}"
+            )
+    return len(snap.results), errors
+
+
+def reader(spec, workdir, stop, out):
+    """一直讀快照，直到寫入端全部結束（stop 被設起來）。"""
+    st = make_storage(spec, workdir)
+    errors = []
+    last_count = 0
+    reads = 0
+    while not stop.is_set() and len(errors) < 5:
+        n, errs = check_snapshot(st, last_count)
+        reads += 1
+        last_count = max(last_count, n)
+        errors.extend(errs)
+    out.put((reads, errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="快照一致性壓力測試")
+    parser.add_argument("--storage", default="xlsx", help="xlsx / sqlite / redis://...")
+    parser.add_argument("--writers", type=int, default=3)
+    parser.add_argument("--readers", type=int, default=3)
+    parser.add_argument("--writes", type=int, default=40, help="每個寫入行程交卷幾次")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="snapshot-stress-")
+    st = make_storage(args.storage, workdir)
+    st.init(question_ids=QIDS)
+    for acc in ACCOUNTS:
+        st.put_user({"account": acc, "password": "x", "name": acc, "total_points": 0})
+
+    writers = [
+        multiprocessing.Process(target=writer, args=(args.storage, workdir, args.writes, i))
+        for i in range(args.writers)
+    ]
+    out = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    readers = [
+        multiprocessing.Process(target=reader, args=(args.storage, workdir, stop, out))
+        for _ in range(args.readers)
+    ]
+
+    started = time.time()
+    for p in writers + readers:
+        p.start()
+    for p in writers:
+        p.join()
+    stop.set()
+    results = [out.get() for _ in readers]
+    for p in readers:
+        p.join()
+
+    total_reads = sum(r for r, _ in results)
+    errors = [e for _, errs in results for e in errs]
+    final = st.snapshot()
+    expected = args.writers * args.writes
+    if len(final.results) != expected:
+        errors.append(f"最後作答筆數 {len(final.results)}，應為 {expected}")
+
+    print(f"後端：{args.storage}，寫入 {expected} 筆，讀快照 {total_reads} 次，耗時 {time.time() - started:.1f} 秒")
+    if errors:
+        print("❌ 發現不一致：")
+        for e in errors[:20]:
+            print("   -", e)
+        sys.exit(1)
+    print("✅ 所有快照都一致")
+
+
+if __name__ == "__main__":
+    main()